@@ -0,0 +1,118 @@
+"""
+Checks the datasm startup cost against a budget, and exits 1 if its over.
+
+    python benchmarks/import_time.py [--import-budget 0.5] [--help-budget 2.0] [--repeat 5] [--no-cli]
+
+Measures, as the median of --repeat fresh interpreters:
+    the cumulative "python -X importtime" cost of "import datasm.util"
+    the wall clock time of "python -m datasm --help"
+and checks that importing datasm.util doesnt load any of HEAVY_MODULES.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+# modules that must only be imported by the code that uses them
+HEAVY_MODULES = ["ipdb", "xarray", "requests", "psutil", "tqdm", "termcolor"]
+
+DEFAULT_IMPORT_BUDGET = 0.5
+DEFAULT_HELP_BUDGET = 2.0
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO), env.get("PYTHONPATH")]))
+    # dont spawn $DSM_GETPATH, the lookup isnt what is being measured
+    env.setdefault("DSM_ROOT_PATHS", "\n".join(
+        f"{tag}:/tmp/datasm-benchmark/{tag}"
+        for tag in ["PUBLICATION_DATA", "STAGING_DATA", "STAGING_STATUS", "STAGING_RESOURCE",
+                    "ARCHIVE_STORAGE", "DSM_STAGING", "STAGING_TOOLS", "ARCHIVE_MANAGEMENT",
+                    "USER_ROOT", "STAGING_ARCHIVE_MAPS", "DSM_ROOT"]))
+    return env
+
+
+def import_seconds(module="datasm.util"):
+    """
+    The cumulative import time of a module in a fresh interpreter, from -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=_env(), cwd=REPO)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    for line in reversed(result.stderr.splitlines()):
+        # "import time: self [us] | cumulative | imported package", top level names arent indented
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.rstrip() == f" {module}":
+            return int(cumulative) / 1e6
+    raise RuntimeError(f"no -X importtime entry for {module}")
+
+
+def heavy_imports(module="datasm.util"):
+    """
+    Which of HEAVY_MODULES are loaded by importing module
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print(' '.join(sorted(sys.modules)))"],
+        capture_output=True, text=True, env=_env(), cwd=REPO, check=True)
+    loaded = set(result.stdout.split())
+    return [x for x in HEAVY_MODULES if x in loaded]
+
+
+def help_seconds():
+    """
+    The wall clock time of "python -m datasm --help"
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "datasm", "--help"],
+        capture_output=True, text=True, env=_env(), cwd=REPO)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"datasm --help failed:\n{result.stderr}")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-budget", type=float, default=DEFAULT_IMPORT_BUDGET, dest="import_budget",
+        help=f"seconds allowed for import datasm.util, default={DEFAULT_IMPORT_BUDGET}")
+    parser.add_argument("--help-budget", type=float, default=DEFAULT_HELP_BUDGET, dest="help_budget",
+        help=f"seconds allowed for datasm --help, default={DEFAULT_HELP_BUDGET}")
+    parser.add_argument("--repeat", type=int, default=5, dest="repeat",
+        help="how many fresh interpreters to take the median of, default=5")
+    parser.add_argument("--no-cli", action="store_true", dest="no_cli",
+        help="only check the import, not datasm --help")
+    args = parser.parse_args(argv)
+
+    failures = []
+
+    if loaded := heavy_imports():
+        failures.append(f"import datasm.util loads {', '.join(loaded)}")
+
+    seconds = statistics.median(import_seconds() for _ in range(args.repeat))
+    print(f"import datasm.util: {seconds:.3f}s (budget {args.import_budget:.3f}s)")
+    if seconds > args.import_budget:
+        failures.append(f"import datasm.util took {seconds:.3f}s")
+
+    if not args.no_cli:
+        seconds = statistics.median(help_seconds() for _ in range(args.repeat))
+        print(f"datasm --help: {seconds:.3f}s (budget {args.help_budget:.3f}s)")
+        if seconds > args.help_budget:
+            failures.append(f"datasm --help took {seconds:.3f}s")
+
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
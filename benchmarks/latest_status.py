@@ -0,0 +1,105 @@
+"""
+Times Dataset.get_latest_status on a synthetic status file, against the
+scan over every major, minor and message that it replaced.
+
+    python benchmarks/latest_status.py [--lines 10000] [--calls 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+os.environ.setdefault("DSM_ROOT_PATHS", "STAGING_RESOURCE:/tmp/datasm-benchmark")
+
+from datasm.dataset import Dataset  # noqa: E402
+from datasm.status import non_binding_status  # noqa: E402
+
+DATASET_ID = "E3SM.2_0.piControl.LR.atmos.180x360.time-series.mon.ens1"
+MAJORS = ["EXTRACTION", "VALIDATION", "POSTPROCESS", "PUBLICATION"]
+MINORS = ["ZSTASH", "CheckFileIntegrity", "CheckTimeUnit", "GenerateTimeseries", "Validate"]
+MESSAGES = ["Ready:", "Engaged:slurm_id=1234", "Pass:", "Fail:"] + non_binding_status
+
+
+def write_status_file(path, lines, seed=0):
+    """
+    Write a status file of STAT lines with increasing timestamps, and a COMM line every 50 lines
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as outstream:
+        outstream.write(f"DATASETID={DATASET_ID}\n")
+        for index in range(lines):
+            if index % 50 == 0:
+                outstream.write(f"COMM:20240101_000000_{index:06d}:comment {index}\n")
+                continue
+            timestamp = f"20240101_000000_{index:06d}"
+            outstream.write(f"STAT:{timestamp}:{rng.choice(MAJORS)}:{rng.choice(MINORS)}:{rng.choice(MESSAGES)}\n")
+
+
+def scan_latest_status(dataset):
+    """
+    The get_latest_status scan this benchmark compares against
+    """
+    latest = "0"
+    latest_val = None
+    second_latest = None
+    for major in dataset.stat.keys():
+        for minor in dataset.stat[major].keys():
+            for item in dataset.stat[major][minor]:
+                if item[0] >= latest and item[1] not in non_binding_status:
+                    latest = item[0]
+                    second_latest = latest_val
+                    latest_val = f"{major}:{minor}:{item[1]}"
+    return latest_val, second_latest
+
+
+def run(lines=10000, calls=1000):
+    """
+    Returns a dict of the seconds per call of the scan and of get_latest_status
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        status_path = Path(tmpdir, f"{DATASET_ID}.status")
+        write_status_file(status_path, lines)
+
+        dataset = Dataset(DATASET_ID, status_path=str(status_path), no_status_file=True)
+        start = time.perf_counter()
+        dataset.load_dataset_status_file()
+        load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            scanned = scan_latest_status(dataset)
+        scan = (time.perf_counter() - start) / calls
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            indexed = dataset.get_latest_status()
+        lookup = (time.perf_counter() - start) / calls
+
+    if indexed[0] != scanned[0]:
+        raise AssertionError(f"latest status differs: {indexed[0]} != {scanned[0]}")
+    return {"load": load, "scan": scan, "lookup": lookup}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=10000, dest="lines", help="status file lines, default=10000")
+    parser.add_argument("--calls", type=int, default=1000, dest="calls", help="lookups to time, default=1000")
+    args = parser.parse_args(argv)
+
+    result = run(args.lines, args.calls)
+    print(f"status file of {args.lines} lines parsed in {result['load'] * 1e3:.1f}ms")
+    print(f"scan:              {result['scan'] * 1e6:10.2f}us per call")
+    print(f"get_latest_status: {result['lookup'] * 1e6:10.2f}us per call")
+    if result["lookup"] >= result["scan"]:
+        print("get_latest_status is no faster than the scan")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
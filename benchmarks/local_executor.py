@@ -0,0 +1,86 @@
+"""
+Measures how many job scripts LocalExecutor gets through per second.
+
+    python benchmarks/local_executor.py [--jobs 500] [--workers 8] [--sleep 0]
+
+Each job is rendered with render_script the way WorkflowJob does it, appends
+a status line to a shared status file like the real job scripts, and
+optionally sleeps to stand in for the work.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+os.environ.setdefault("DSM_ROOT_PATHS", "STAGING_RESOURCE:/tmp/datasm-benchmark")
+
+from datasm.executor import LocalExecutor  # noqa: E402
+
+
+def render_jobs(executor, tmpdir, jobs, sleep=0):
+    """
+    Render the job scripts, returns their paths and the status file they write to
+    """
+    status_path = Path(tmpdir, "benchmark.status")
+    scripts = []
+    for index in range(jobs):
+        script_path = str(Path(tmpdir, f"job-{index}.sh"))
+        cmd = f"sleep {sleep}\necho STAT:$(date -u +%Y%m%d_%H%M%S_%6N):BENCHMARK:Job{index}:Pass: >> {status_path}"
+        executor.render_script(cmd, script_path, [("-J", f"job-{index}"), ("-o", str(Path(tmpdir, f"job-{index}.out")))])
+        scripts.append(script_path)
+    return scripts, status_path
+
+
+def run(jobs=500, workers=None, sleep=0):
+    """
+    Returns a dict with the seconds it took to submit and to finish every job,
+    the jobs per second, and the count of jobs in each final state
+    """
+    executor = LocalExecutor(max_workers=workers)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scripts, status_path = render_jobs(executor, tmpdir, jobs, sleep)
+
+        start = time.perf_counter()
+        job_ids = [executor.sbatch(script) for script in scripts]
+        submitted = time.perf_counter() - start
+        executor.shutdown(wait=True)
+        finished = time.perf_counter() - start
+
+        states = {}
+        for job_id in job_ids:
+            state = executor.state(job_id)
+            states[state] = states.get(state, 0) + 1
+        with open(status_path, "r") as instream:
+            status_lines = len(instream.readlines())
+
+    return {
+        "workers": executor.max_workers,
+        "submit": submitted,
+        "finish": finished,
+        "jobs_per_second": jobs / finished,
+        "states": states,
+        "status_lines": status_lines,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=500, dest="jobs", help="job scripts to run, default=500")
+    parser.add_argument("--workers", type=int, default=None, dest="workers", help="max_workers, defaults to the number of cpus")
+    parser.add_argument("--sleep", type=float, default=0, dest="sleep", help="seconds each job sleeps, default=0")
+    args = parser.parse_args(argv)
+
+    result = run(args.jobs, args.workers, args.sleep)
+    print(f"{args.jobs} jobs on {result['workers']} workers")
+    print(f"  submit: {result['submit']:.3f}s")
+    print(f"  finish: {result['finish']:.3f}s, {result['jobs_per_second']:.1f} jobs/s")
+    print(f"  states: {result['states']}, {result['status_lines']} status lines")
+    return 0 if result["states"].get(LocalExecutor.COMPLETED) == args.jobs else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Times the logging done by a scheduling pass over a synthetic set of
+datasets, with log_message as it is and as it was before it was gated on
+the log level and moved onto a background thread.
+
+    python benchmarks/logging_hot_path.py [--datasets 10000] [--level info]
+
+For each dataset the pass makes the debug calls requires_dataset,
+meets_requirements and next_state make for one candidate job, and the info
+calls start_datasets makes. Each variant runs in its own interpreter, so
+neither inherits the others logging setup.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+os.environ.setdefault("DSM_ROOT_PATHS", "STAGING_RESOURCE:/tmp/datasm-benchmark")
+
+from datasm import util  # noqa: E402
+
+VARIANTS = ["before", "after"]
+
+
+def log_message_before(level, message, user_level='INFO'):
+    """
+    log_message as it was: always upper-cases the level and formats a timestamp, and
+    the message has already been built by the caller
+    """
+    level = level.upper()
+    colors = {"INFO": "white", "WARNING": "yellow", "ERROR": "red", "DEBUG": "cyan"}
+    color = colors.get(level, 'red')
+    tstamp = util.get_UTC_TS()
+    if level == "DEBUG":
+        logging.debug(message)
+    elif level == "ERROR":
+        logging.error(message)
+    elif level == "WARNING":
+        logging.warning(message)
+    elif level == "INFO":
+        logging.info(message)
+
+
+def scheduling_pass_before(dataset_ids, log=log_message_before):
+    for dataset_id in dataset_ids:
+        log("info", f"start_datasets: Generate job objects for {dataset_id}")
+        log("debug", f"WF_init next_state: self.name = VALIDATION for dataset {dataset_id}")
+        log("debug", f"WF_init next_state: current state = VALIDATION:Ready:")
+        log("debug", f"WF_init next_state: transitions = {['CheckFileIntegrity', 'CheckTimeUnit']}")
+        log("debug", f"requires_dataset: self.dataset={dataset_id}, dataset={dataset_id}")
+        for req in ["atmos-native-mon", "atmos-180x360-time-series-mon"]:
+            log("debug", f"requires_dataset: DBG_REQ: self CheckFileIntegrity has req {req}")
+            log("debug", f"init: requires_dataset(): Testing this dataset atmos-native-mon against job req {req}")
+        log("debug", f"init: job.meets_requirements(): returning True")
+        log("info", f"start_datasets: Dataset {dataset_id} transitioning to state VALIDATION:CheckFileIntegrity:Ready:")
+
+
+def scheduling_pass_after(dataset_ids, log=util.log_message):
+    reqs = ["atmos-native-mon", "atmos-180x360-time-series-mon"]
+    for dataset_id in dataset_ids:
+        log("info", f"start_datasets: Generate job objects for {dataset_id}")
+        log("debug", "WF_init next_state: self.name = %s for dataset %s", "VALIDATION", dataset_id)
+        log("debug", "WF_init next_state: current state = %s", "VALIDATION:Ready:")
+        log("debug", "WF_init next_state: transitions = %s", ['CheckFileIntegrity', 'CheckTimeUnit'])
+        log("debug", "requires_dataset: self.dataset=%s, dataset=%s", dataset_id, dataset_id)
+        for req in reqs:
+            log("debug", "requires_dataset: DBG_REQ: self %s has req %s", "CheckFileIntegrity", req)
+            log("debug", "init: requires_dataset(): Testing this dataset %s against job req %s", "atmos-native-mon", req)
+        log("debug", "init: job.meets_requirements(): returning %s", True)
+        log("info", f"start_datasets: Dataset {dataset_id} transitioning to state VALIDATION:CheckFileIntegrity:Ready:")
+
+
+def run_variant(variant, datasets, level, logpath):
+    """
+    Time one scheduling pass in this interpreter, returns seconds
+    """
+    dataset_ids = [f"E3SM.2_0.piControl.LR.atmos.180x360.time-series.mon.ens{x}" for x in range(datasets)]
+    if variant == "before":
+        logging.basicConfig(
+            filename=logpath,
+            format="%(asctime)s_%(msecs)03d:%(levelname)s:%(message)s",
+            datefmt="%Y%m%d_%H%M%S",
+            level=util.LOG_LEVELS[level.upper()])
+        start = time.perf_counter()
+        scheduling_pass_before(dataset_ids)
+    else:
+        util.setup_logging(level, logpath)
+        start = time.perf_counter()
+        scheduling_pass_after(dataset_ids)
+    return time.perf_counter() - start
+
+
+def run(datasets=10000, level="info"):
+    """
+    Returns a dict of variant to the seconds its scheduling pass took
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for variant in VARIANTS:
+            result = subprocess.run(
+                [sys.executable, __file__, "--variant", variant, "--datasets", str(datasets),
+                 "--level", level, "--log", str(Path(tmpdir, f"{variant}.log"))],
+                capture_output=True, text=True, check=True)
+            results[variant] = float(result.stdout.strip())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasets", type=int, default=10000, dest="datasets", help="datasets in the pass, default=10000")
+    parser.add_argument("--level", default="info", choices=["debug", "info"], dest="level", help="log level, default=info")
+    parser.add_argument("--variant", choices=VARIANTS, dest="variant", help=argparse.SUPPRESS)
+    parser.add_argument("--log", dest="log", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.variant:
+        print(run_variant(args.variant, args.datasets, args.level, args.log))
+        return 0
+
+    results = run(args.datasets, args.level)
+    for variant in VARIANTS:
+        print(f"{variant:>6}: {results[variant]:.3f}s for {args.datasets} datasets at {args.level}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
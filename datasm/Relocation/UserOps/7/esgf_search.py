@@ -2,11 +2,12 @@ import os, sys
 import argparse
 import re
 from argparse import RawTextHelpFormatter
-import requests
 import time
 from datetime import datetime
 import pytz
 import yaml
+from datasm import esgf_cache
+from datasm.esgf import ESGFSearchError, get_client
 
 
 
@@ -14,7 +15,7 @@ def ts():
     return pytz.utc.localize(datetime.utcnow()).strftime("%Y%m%d_%H%M%S_%f")
 
 helptext = '''
-    Usage:  esgf_search --project project [--unrestricted]
+    Usage:  esgf_search --project project [--unrestricted] [--no-cache] [--refresh]
 
 '''
 
@@ -31,6 +32,7 @@ def assess_args():
 
     required.add_argument('--project', action='store', dest="project", required=True)
     optional.add_argument('--unrestricted', action='store_true', dest="unrestricted", required=False)
+    esgf_cache.add_cache_args(optional)
 
     args = parser.parse_args()
     return args
@@ -64,26 +66,12 @@ def raw_search_esgf(
         print("ERROR: Must specify string of one or more CSV fieldnames with fields=string")
         return None
 
-    if len(facets):
-        url = f"https://{node}/esg-search/search/?offset={offset}&limit={limit}&type={qtype}&format=application%2Fsolr%2Bjson&latest={latest}&fields={fields}&{'&'.join([f'{k}={v}' for k,v in facets.items()])}"
-    else:
-        url = f"https://{node}/esg-search/search/?offset={offset}&limit={limit}&type={qtype}&format=application%2Fsolr%2Bjson&latest={latest}&fields={fields}"
-
-    # print(f"Executing URL: {url}")
-    req = requests.get(url)
-    # print(f"type req = {type(req)}")
-
-    if req.status_code != 200:
-        # print(f"ERROR: ESGF search request returned non-200 status code: {req.status_code}")
+    try:
+        docs, numFound = get_client(node).search_page(facets, qtype=qtype, fields=fields, offset=offset, limit=limit, latest=latest)
+    except ESGFSearchError as e:
+        print(f"ERROR: {e}")
         return list(), 0
 
-    numFound = req.json()["response"]["numFound"]
-
-    docs = [
-        {k: v for k, v in doc.items()}
-        for doc in req.json()["response"]["docs"]
-    ]
-
     return docs, numFound
 
 # ----------------------------------------------
@@ -112,20 +100,12 @@ def safe_search_esgf(
     full_docs = list()
     full_found = 0
 
-    qlimit = 10000
-    curr_offset = 0
-
-    while True:
-        # logmsg(f"    SSE: calling raw_search_esgf with curr_offset {curr_offset}")
-        docs, numFound = raw_search_esgf(facets, offset=curr_offset, limit=f"{qlimit}", qtype=f"{qtype}", fields=f"{fields}", latest=f"{latest}")
-        # logmsg(f"    SSE: raw_search returned {len(docs)} records")
-        full_docs = full_docs + docs
-        full_found = full_found + numFound
-        if len(docs) < qlimit:
-            # logmsg("    SSE: returning to caller")
-            return full_docs, full_found
-        curr_offset += qlimit
-        # time.sleep(1)
+    try:
+        for docs, numFound in get_client().pages(facets, qtype=qtype, fields=fields, latest=latest):
+            full_docs.extend(docs)
+            full_found = numFound
+    except ESGFSearchError as e:
+        print(f"ERROR: {e}")
 
     return full_docs, full_found
 
@@ -212,6 +192,7 @@ def collect_esgf_search_datasets(facets):
 def main():
 
     args = assess_args()
+    esgf_cache.configure(enabled=not args.no_cache, refresh=args.refresh)
     unrestricted = args.unrestricted
     project = args.project
     if project not in [ 'E3SM', 'CMIP6' ]:
@@ -2,6 +2,7 @@ import sys
 
 from datasm import parse_args
 from datasm.datasm import AutoDataSM
+from datasm.util import setup_logging
 from datasm.workflows.extraction import Extraction
 from datasm.workflows.cleanup import CleanUp
 from datasm.workflows.postprocess import PostProcess
@@ -39,6 +40,9 @@ def main():
     if not args:
         return -1
     command = args.subparser_name
+    if command != "auto":
+        # AutoDataSM sets up its own log under its slurm directory, the workflows share this one
+        setup_logging("info", "DataSM.log")
     job = subcommands[command](**vars(args))
     return job()
 
@@ -0,0 +1,101 @@
+import re
+
+
+MONTHLY_DATE = re.compile(r"\d{4}-\d{2}.*nc")
+TS_SPAN = re.compile(r"_(\d{4})\d{2}_(\d{4})\d{2}.*nc")
+
+
+def merge_ranges(values):
+    """
+    Collapse a collection of integers into sorted, inclusive (start, end) runs
+
+    Returns:
+        list of (start, end) tuples, e.g. {1, 2, 3, 7} -> [(1, 3), (7, 7)]
+    """
+    ranges = []
+    for value in sorted(set(values)):
+        if ranges and value == ranges[-1][1] + 1:
+            ranges[-1][1] = value
+        else:
+            ranges.append([value, value])
+    return [tuple(x) for x in ranges]
+
+
+def missing_ranges(covered, start, end):
+    """
+    Parameters:
+        covered (set): the integer steps (years, months ...) that are present
+        start (int): first expected step
+        end (int): last expected step, inclusive
+    Returns:
+        the merged (start, end) gaps between start and end that are not covered
+    """
+    return merge_ranges(set(range(start, end + 1)) - covered)
+
+
+def years_covered(spans):
+    """
+    Turn a list of inclusive (start_year, end_year) file spans into the set
+    of years they cover
+    """
+    years = set()
+    for start, end in spans:
+        years.update(range(start, end + 1))
+    return years
+
+
+def parse_monthly(files):
+    """
+    Split monthly file names of the form <prefix>YYYY-MM<suffix> using the
+    first file to find the prefix and suffix
+
+    Returns:
+        (prefix, suffix, months) where months is the set of year * 12 + (month - 1)
+        for every file that matches, or None if the first file has no date
+    """
+    first = min(files)
+    if not (idx := MONTHLY_DATE.search(first)):
+        return None
+    prefix = first[: idx.start()]
+    suffix = first[idx.start() + 7 :]
+    width = len(prefix) + 7 + len(suffix)
+
+    months = set()
+    for name in files:
+        if len(name) != width or not name.startswith(prefix) or not name.endswith(suffix):
+            continue
+        date = name[len(prefix) : len(prefix) + 7]
+        if date[4] != "-" or not date[:4].isdigit() or not date[5:].isdigit():
+            continue
+        months.add(int(date[:4]) * 12 + int(date[5:]) - 1)
+    return prefix, suffix, months
+
+
+def parse_years(files, pattern=MONTHLY_DATE):
+    """
+    Returns the set of years that have at least one file, using the year
+    at the first match of pattern in each file name
+    """
+    years = set()
+    for name in files:
+        if idx := pattern.search(name):
+            years.add(int(name[idx.start() : idx.start() + 4]))
+    return years
+
+
+def parse_ts_spans(files):
+    """
+    Parse time-series file names of the form <var>_YYYYMM_YYYYMM.nc, or
+    <var>_<mapname>_YYYYMM_YYYYMM.nc, once each
+
+    Returns:
+        dict of file name prefix (the variable name) -> list of (start_year, end_year)
+    """
+    spans = {}
+    for name in files:
+        name = name.split("/")[-1]
+        if not (idx := TS_SPAN.search(name)):
+            continue
+        cut = -36 if "cmip6_180x360_aave" in name else -17
+        spans.setdefault(name[:cut], []).append((int(idx.group(1)), int(idx.group(2))))
+    return spans
@@ -1,16 +1,23 @@
 import os
 import re
 import sys
+import time
 from enum import Enum
+from functools import lru_cache
 
 from pathlib import Path
 from datetime import datetime, timezone
 
-import ipdb
-
-from datasm.util import get_last_status_line
+from datasm.completeness import (
+    MONTHLY_DATE,
+    missing_ranges,
+    parse_monthly,
+    parse_ts_spans,
+    parse_years,
+    years_covered,
+)
+from datasm.status import StatusFileReader, non_binding_status, parse_status_line
 from datasm.util import is_vdir_pattern
-from datasm.util import load_file_lines
 from datasm.util import log_message
 from datasm.util import search_esgf
 
@@ -37,9 +44,6 @@ class DatasetStatusMessage(Enum):
     POSTPROCESS_READY = "DATASM:POSTPROCESS:Ready:"
 
 
-non_binding_status = ["Blocked:", "Unblocked:", "Approved:", "Unapproved:"]
-
-
 SEASONS = [
     {"name": "ANN", "start": "01", "end": "12"},
     {"name": "DJF", "start": "01", "end": "12"},
@@ -48,7 +52,193 @@ SEASONS = [
     {"name": "SON", "start": "09", "end": "11"},
 ]
 
+CMIP6_TABLE_REALMS = {
+    "Amon": "atmos",
+    "3hr": "atmos",
+    "day": "atmos",
+    "6hr": "atmos",
+    "CFmon": "atmos",
+    "AERmon": "atmos",
+    "fx": "atmos",
+    "Lmon": "land",
+    "LImon": "land",
+    "Omon": "ocean",
+    "Ofx": "ocean",
+    "SImon": "sea-ice",
+}
+
+
+@lru_cache(maxsize=None)
+def parse_dataset_facets(dataset_id):
+    """
+    Split a dataset_id into its facets, this is done once per id no matter
+    how many Dataset objects are made for it
+
+    Returns:
+        tuple of (project, data_type, activity, institution, model_version, experiment,
+                  ensemble, table, cmip_var, resolution, realm, freq, grid)
+    """
+    facets = dataset_id.split(".")
+
+    if facets[0] == "CMIP6":
+        table = facets[6]
+        if (realm := CMIP6_TABLE_REALMS.get(table)) is None:
+            log_message("error", f"{__name__}: {table} is not an expected CMIP6 table")
+            sys.exit(1)
+
+        freq = None
+        for i in ["mon", "day", "3hr", "6hr"]:
+            if i in table:
+                freq = i
+                break
+        if table == "fx" or table == "Ofx":
+            freq = "fixed"
+
+        return ("CMIP6", "cmip", facets[1], facets[2], facets[3], facets[4],
+                facets[5], table, facets[7], None, realm, freq, "gr")
+
+    return ("E3SM", facets[6], None, None, facets[1], facets[2],
+            facets[8], None, None, facets[3], facets[4], facets[7], facets[5])
+
+
+# running totals for the version directory indexes, "saved" counts the
+# stat/listdir calls that would have been made without the cache
+VERSION_INDEX_STATS = {"lookups": 0, "rescans": 0, "fs_calls": 0, "fs_calls_saved": 0}
+
+# filesystems with coarse mtimes can change a directory twice inside one
+# tick, so a listing that is this new is never trusted
+VERSION_INDEX_SETTLE_NS = 2 * 10**9
+
+
+class VersionIndex(object):
+    """
+    Cached listing of the version subdirectories (v0, v1, v0.1 ...) under a
+    warehouse or publication path.
+
+    The listing is only rebuilt when the mtime of the path changes, which it
+    does whenever a version directory is created, removed or renamed. Files
+    can be added to or moved out of a version directory without touching
+    the parent, so when the caller needs to know which versions are
+    non-empty the mtime of each version directory is checked as well.
+    """
+
+    __slots__ = ("path", "_mtime", "_versions")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._mtime = None
+        # name -> [mtime_ns, is_nonempty]
+        self._versions = {}
+
+    def entries(self, check_contents=False):
+        """
+        Parameters:
+            check_contents (bool): make sure the non-empty flags are up to date
+        Returns:
+            list of (name, is_nonempty) for each subdirectory of the path,
+            empty if the path does not exist
+        """
+        VERSION_INDEX_STATS["lookups"] += 1
+        VERSION_INDEX_STATS["fs_calls"] += 1
+        try:
+            st = os.stat(self.path)
+        except (FileNotFoundError, NotADirectoryError):
+            self._mtime = None
+            self._versions = {}
+            return []
+
+        # without the index: one listing of the path, an is_dir() per entry,
+        # and a listing of each version directory when checking contents
+        uncached = 1 + len(self._versions) * (2 if check_contents else 1)
+
+        if st.st_mtime_ns != self._mtime or time.time_ns() - st.st_mtime_ns < VERSION_INDEX_SETTLE_NS:
+            self._rescan(st.st_mtime_ns)
+            return [(name, info[1]) for name, info in self._versions.items()]
+
+        spent = 0
+        if check_contents:
+            for name, info in self._versions.items():
+                spent += 1
+                try:
+                    mtime = os.stat(self.path / name).st_mtime_ns
+                except FileNotFoundError:
+                    mtime, info[1] = None, False
+                if mtime is not None and mtime != info[0]:
+                    info[0] = mtime
+                    info[1] = _dir_has_entries(self.path / name)
+                    spent += 1
+        VERSION_INDEX_STATS["fs_calls"] += spent
+        VERSION_INDEX_STATS["fs_calls_saved"] += max(uncached - 1 - spent, 0)
+        return [(name, info[1]) for name, info in self._versions.items()]
+
+    def _rescan(self, mtime):
+        VERSION_INDEX_STATS["rescans"] += 1
+        versions = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                versions[entry.name] = [entry.stat().st_mtime_ns, _dir_has_entries(entry.path)]
+        VERSION_INDEX_STATS["fs_calls"] += 1 + 2 * len(versions)
+        self._versions = versions
+        self._mtime = mtime
+
+
+def _dir_has_entries(path):
+    try:
+        with os.scandir(path) as it:
+            return any(True for _ in it)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+
 class Dataset(object):
+
+    # there can be tens of thousands of these, so keep them small and
+    # dont touch the filesystem until something actually needs it
+    __slots__ = (
+        "dataset_id",
+        "_status",
+        "_status_pending",
+        "data_path",
+        "start_year",
+        "end_year",
+        "datavars",
+        "missing",
+        "_publication_path",
+        "_publication_checked",
+        "_publication_index",
+        "_warehouse_index",
+        "pub_base",
+        "_warehouse_path",
+        "warehouse_base",
+        "archive_path",
+        "archive_base",
+        "status_path",
+        "stat",
+        "comm",
+        "_status_reader",
+        "_seen_messages",
+        "_last_status_line",
+        "_latest_binding",
+        "_second_binding",
+        "status_store",
+        "versions",
+        "project",
+        "data_type",
+        "activity",
+        "institution",
+        "model_version",
+        "experiment",
+        "ensemble",
+        "table",
+        "cmip_var",
+        "resolution",
+        "realm",
+        "freq",
+        "grid",
+    )
+
     def get_status_from_archive(self):
         ...
 
@@ -66,6 +256,7 @@ class Dataset(object):
         versions={},
         stat=None,
         comm=None,
+        status_store=None,
         *args,
         **kwargs,
     ):
@@ -74,14 +265,17 @@ class Dataset(object):
         self._status = DatasetStatus.UNITITIALIZED.value
 
         self.data_path = None
-        self.cmip_var = None
         self.start_year = start_year
         self.end_year = end_year
         self.datavars = datavars
         self.missing = None
         self._publication_path = Path(path) if path != "" else None
+        self._publication_checked = False
+        self._publication_index = None
+        self._warehouse_index = None
         self.pub_base = pub_base
-        self.warehouse_path = Path(path) if path != "" else None
+        # the warehouse path is built from the facets on first access, unless given
+        self._warehouse_path = Path(path) if path != "" and kwargs.get('no_status_file') else None
         self.warehouse_base = warehouse_base
         self.archive_path = Path(path) if path != "" else None
         self.status_path = Path(status_path)
@@ -91,127 +285,60 @@ class Dataset(object):
         self.stat = stat if stat else {}
         self.comm = comm if comm else []
 
-        self.versions = versions
+        # incremental status file state, see load_dataset_status_file
+        self._status_reader = None
+        self._seen_messages = set()
+        self._last_status_line = None
 
-        log_message("debug", f"{__name__}: init: splitting to obtain facets: dsid = {self.dataset_id}")
-        facets = self.dataset_id.split(".")
+        # (timestamp, "MAJOR:minor:message") of the two most recent binding messages
+        self._latest_binding = None
+        self._second_binding = None
+        for major, minors in self.stat.items():
+            for minor, items in minors.items():
+                for timestamp, message in items:
+                    self._seen_messages.add((major, minor, timestamp, message))
+                    self._track_binding(timestamp, major, minor, message)
 
-        if facets[0] == "CMIP6":
-            self.project = "CMIP6"
-            self.data_type = "cmip"
-            self.activity = facets[1]
-            self.institution = facets[2]
-            self.model_version = facets[3]
-            self.experiment = facets[4]
-            self.ensemble = facets[5]
-            self.table = facets[6]
-            self.cmip_var = facets[7]
-            self.resolution = None
-            if facets[6] in ["Amon", "3hr", "day", "6hr", "CFmon", "AERmon", "fx"]:
-                self.realm = "atmos"
-            elif facets[6] in ["Lmon", "LImon"]:
-                self.realm = "land"
-            elif facets[6] in ["Omon", "Ofx"]:
-                self.realm = "ocean"
-            elif facets[6] == "SImon":
-                self.realm = "sea-ice"
-            else:
-                log_message("error", f"{__name__}: {facets[6]} is not an expected CMIP6 table")
-                sys.exit(1)
-
-            self.freq = None
-            for i in ["mon", "day", "3hr", "6hr"]:
-                if i in self.table:
-                    self.freq = i
-                    break
-            if self.table == "fx" or self.table == "Ofx":
-                self.freq = "fixed"
-
-            self.grid = "gr"
-            if not kwargs.get('no_status_file'):
-                self.warehouse_path = Path(
-                    self.warehouse_base,
-                    self.project,
-                    self.activity,
-                    self.institution,
-                    self.model_version,
-                    self.experiment,
-                    self.ensemble,
-                    self.table,
-                    self.cmip_var,
-                    self.grid,
-                )
-        else:
-            self.project = "E3SM"
-            self.model_version = facets[1]
-            self.experiment = facets[2]
-            self.resolution = facets[3]
-            self.realm = facets[4]
-            self.grid = facets[5]
-            self.data_type = facets[6]
-            self.freq = facets[7]
-            self.ensemble = facets[8]
-            self.activity = None
-            self.institution = None
-            self.table = None
-            if not kwargs.get('no_status_file'):
-                self.warehouse_path = Path(
-                    self.warehouse_base,
-                    self.project,
-                    self.model_version,
-                    self.experiment,
-                    self.resolution,
-                    self.realm,
-                    self.grid,
-                    self.data_type,
-                    self.freq,
-                    self.ensemble,
-                )
-        if not kwargs.get('no_status_file'):
-            self.initialize_status_file()
+        # optional SQLiteStatusStore that mirrors every line read from the status file
+        self.status_store = status_store
 
-        log_message("debug", f"{__name__}: init: self.realm = {self.realm}")
+        self.versions = versions
+
+        (
+            self.project,
+            self.data_type,
+            self.activity,
+            self.institution,
+            self.model_version,
+            self.experiment,
+            self.ensemble,
+            self.table,
+            self.cmip_var,
+            self.resolution,
+            self.realm,
+            self.freq,
+            self.grid,
+        ) = parse_dataset_facets(dataset_id)
+
+        # the status file is read (and created if needed) the first time the status is used
+        self._status_pending = not kwargs.get('no_status_file')
+
+    def ensure_status_file(self):
+        """
+        Initialize the status file if that hasnt happened yet
+        """
+        if self._status_pending:
+            self.initialize_status_file()
 
     def initialize_status_file(self):
+        self._status_pending = False
         if not self.status_path.exists():
             msg = f"{__name__} creating new status file {self.status_path}"
             log_message("info", msg)
             self.status_path.touch(mode=0o660, exist_ok=True)
 
-        # why are these being set in this function?
-        if self.project == 'CMIP6':
-            self.warehouse_path = Path(
-                self.warehouse_base,
-                self.project,
-                self.activity,
-                self.institution,
-                self.model_version,
-                self.experiment,
-                self.ensemble,
-                self.table,
-                self.cmip_var,
-                self.grid,
-            )
-        else:
-            self.warehouse_path = Path(
-                self.warehouse_base,
-                self.project,
-                self.model_version,
-                self.experiment,
-                self.resolution,
-                self.realm,
-                self.grid,
-                self.data_type,
-                self.freq,
-                self.ensemble,
-            )
-
-        found_id = False
-        with open(self.status_path, "r") as instream:
-            for line in instream.readlines():
-                if "DATASETID" in line:
-                    found_id = True
-                    break
+        self.load_dataset_status_file()
+        found_id = any("DATASETID" in line for line in self.comm)
         if not found_id:
             log_message("info", f"{__name__} initialize_status_file: status file {self.status_path} doesnt list its dataset id, adding it")
             with open(self.status_path, "a") as outstream:
@@ -232,11 +359,46 @@ class Dataset(object):
 
         log_message("info", f"{__name__}: initialize_status_file: self._status = {self._status}")
 
+    @property
+    def warehouse_path(self):
+        if self._warehouse_path is None and self.warehouse_base is not None:
+            if self.project == 'CMIP6':
+                self._warehouse_path = Path(
+                    self.warehouse_base,
+                    self.project,
+                    self.activity,
+                    self.institution,
+                    self.model_version,
+                    self.experiment,
+                    self.ensemble,
+                    self.table,
+                    self.cmip_var,
+                    self.grid,
+                )
+            else:
+                self._warehouse_path = Path(
+                    self.warehouse_base,
+                    self.project,
+                    self.model_version,
+                    self.experiment,
+                    self.resolution,
+                    self.realm,
+                    self.grid,
+                    self.data_type,
+                    self.freq,
+                    self.ensemble,
+                )
+        return self._warehouse_path
+
+    @warehouse_path.setter
+    def warehouse_path(self, path):
+        self._warehouse_path = path
 
     # Anyone care to explain the logic here? This is fragile!
     def update_from_status_file(self, update=True):
+        self.ensure_status_file()
         self.load_dataset_status_file()
-        if latest := get_last_status_line(self.status_path):
+        if latest := self._last_status_line:
             latest = latest.split(":")
             if len(latest) == 5:
                 new_status = ":".join(latest[2:]).strip()
@@ -250,6 +412,24 @@ class Dataset(object):
         else:
             return False
 
+    def warehouse_versions(self, check_contents=False):
+        """
+        Returns a list of (name, is_nonempty) for the version directories in
+        the warehouse path, from the cached index
+        """
+        if self._warehouse_index is None or self._warehouse_index.path != self.warehouse_path:
+            self._warehouse_index = VersionIndex(self.warehouse_path)
+        return self._warehouse_index.entries(check_contents)
+
+    def publication_versions(self, check_contents=False):
+        """
+        Returns a list of (name, is_nonempty) for the version directories in
+        the publication path, from the cached index
+        """
+        if self._publication_index is None or self._publication_index.path != self.publication_path:
+            self._publication_index = VersionIndex(self.publication_path)
+        return self._publication_index.entries(check_contents)
+
     @property
     def latest_warehouse_dir(self):
         if self.warehouse_path is None or (
@@ -270,9 +450,9 @@ class Dataset(object):
         try:
             latest_version = sorted(
                 [
-                    float(str(x.name)[1:])
-                    for x in self.warehouse_path.iterdir()
-                    if x.is_dir() and any(x.iterdir()) and "tmp" not in x.name
+                    float(name[1:])
+                    for name, nonempty in self.warehouse_versions(check_contents=True)
+                    if nonempty and "tmp" not in name
                 ]
             ).pop()
         except IndexError:
@@ -295,9 +475,9 @@ class Dataset(object):
         try:
             latest_version = sorted(
                 [
-                    float(str(x.name)[1:])
-                    for x in self.publication_path.iterdir()
-                    if x.is_dir() and is_vdir_pattern(x.name)
+                    float(name[1:])
+                    for name, _ in self.publication_versions()
+                    if is_vdir_pattern(name)
                 ]
             ).pop()
         except IndexError:
@@ -312,16 +492,16 @@ class Dataset(object):
         Returns the latest version number in the publication directory. If not version exists
         then it returns 0
         """
-        if not self.publication_path or not self.publication_path.exists():
+        if not self.publication_path:
             return 0
 
         # we assume that the publication directory contains only directories named "v0.#" or "v#"
         try:
             latest_version = sorted(
                 [
-                    float(str(x.name)[1:])
-                    for x in self.publication_path.iterdir()
-                    if x.is_dir() and is_vdir_pattern(x.name)
+                    float(name[1:])
+                    for name, _ in self.publication_versions()
+                    if is_vdir_pattern(name)
                 ]
             ).pop()
         except IndexError:
@@ -334,17 +514,13 @@ class Dataset(object):
         Returns the latest version number in the warehouse directory. If not version exists
         then it returns 0
         """
-        if not self.warehouse_path or not self.warehouse_path.exists():
+        if not self.warehouse_path:
             return 0
 
         # we assume that the warehouse directory contains only directories named "v0.#" or "v#"
         try:
             latest_version = sorted(
-                [
-                    float(str(x.name)[1:])
-                    for x in self.warehouse_path.iterdir()
-                    if x.is_dir()
-                ]
+                [float(name[1:]) for name, _ in self.warehouse_versions()]
             ).pop()
         except IndexError:
             return 0
@@ -352,9 +528,11 @@ class Dataset(object):
 
     @property
     def publication_path(self):
-        if (
-            not self._publication_path
-            or not self._publication_path.exists()
+        # a publication path given to the constructor is only used if it exists,
+        # otherwise its built from the facets, either way this is settled once
+        if not self._publication_path or (
+            not self._publication_checked
+            and not self._publication_path.exists()
         ):
             if self.project == "CMIP6":
                 pubpath = Path(
@@ -385,11 +563,13 @@ class Dataset(object):
             self._publication_path = pubpath
             log_message("info", f"{__name__}: publication_path (property): pubpath = {pubpath}")
             log_message("info", f"{__name__}: publication_path (property): self.realm = {self.realm}")
+        self._publication_checked = True
 
         return self._publication_path
 
     @property
     def status(self):
+        self.ensure_status_file()
         return self._status
 
     @status.setter
@@ -399,6 +579,7 @@ class Dataset(object):
         Because this is a @property you have to pass in the parameters along with the
         status as a tuple. Would love to have a solution for that uglyness
         """
+        self.ensure_status_file()
         self.load_dataset_status_file()
         latest, _ = self.get_latest_status()
         if status is None or status == self._status or latest == status:
@@ -456,18 +637,28 @@ class Dataset(object):
         return ".".join(facets[4:7])
 
     def get_latest_status(self):
-        latest = "0"
-        latest_val = None
-        second_latest = None
-        for major in self.stat.keys():
-            for minor in self.stat[major].keys():
-                for item in self.stat[major][minor]:
-                    if item[0] >= latest and item[1] not in non_binding_status:
-                        latest = item[0]
-                        second_latest = latest_val
-                        latest_val = f"{major}:{minor}:{item[1]}"
+        """
+        Returns the latest and second latest binding "MAJOR:minor:message" values
+        """
+        self.ensure_status_file()
+        latest_val = self._latest_binding[1] if self._latest_binding else None
+        second_latest = self._second_binding[1] if self._second_binding else None
         return latest_val, second_latest
 
+    def _track_binding(self, timestamp, major, minor, message):
+        """
+        Keep the latest and second latest binding messages up to date as
+        messages arrive, so get_latest_status doesnt have to scan the history
+        """
+        if message in non_binding_status:
+            return
+        entry = (timestamp, f"{major}:{minor}:{message}")
+        if self._latest_binding is None or timestamp >= self._latest_binding[0]:
+            self._second_binding = self._latest_binding
+            self._latest_binding = entry
+        elif self._second_binding is None or timestamp >= self._second_binding[0]:
+            self._second_binding = entry
+
     def check_dataset_is_complete(self, files):
         # TODO: full pass on this to make sure its working for all data types
         # import ipdb; ipdb.set_trace()
@@ -527,13 +718,23 @@ class Dataset(object):
         else:
             return True
 
-    def get_esgf_status(self):
+    def get_esgf_status(self, esgf_files=None):
         """
         Check ESGF to see of the dataset has already been published,
         if it exists check that the dataset is complete
+
+        Parameters:
+            esgf_files (list): the published file names if they have already been
+                looked up (see util.resolve_esgf_files), otherwise ESGF is searched
         """
-        # import ipdb; ipdb.set_trace()
-        # TODO: fix this at some point
+        if esgf_files is not None:
+            if not esgf_files:
+                log_message("info", f"{__name__}: get_esgf_status: {self.dataset_id} has no published files")
+                return DatasetStatus.UNITITIALIZED.value
+            if self.check_dataset_is_complete(esgf_files):
+                return DatasetStatus.PUBLISHED.value
+            else:
+                return DatasetStatus.PARTIAL_PUBLISHED.value
 
         if "CMIP6" in self.dataset_id:
             project = "CMIP6"
@@ -608,16 +809,18 @@ class Dataset(object):
             else:
                 return DatasetStatus.NOT_IN_WAREHOUSE.value
 
-    def find_status(self):
+    def find_status(self, esgf_files=None):
         """
         Lookup the datasets status in ESGF, or on the filesystem
-        """
-        # import ipdb; ipdb.set_trace()
 
+        Parameters:
+            esgf_files (list): the published file names, if they were already
+                looked up in bulk
+        """
         # if the dataset is UNITITIALIZED, then we need to build up the status from scratch
         if self.status not in [DatasetStatus.SUCCESS.value, DatasetStatus.IN_PUBLICATION.value]:
             # returns either NOT_PUBLISHED or SUCCESS or PARTIAL_PUBLISHED or UNITITIALIZED
-            self.status = self.get_esgf_status()
+            self.status = self.get_esgf_status(esgf_files)
 
             print(f"ESGF said {self.dataset_id} was in status {self.status}")
 
@@ -660,11 +863,8 @@ class Dataset(object):
     def check_submonthly(self, files):
 
         missing = list()
-        files = sorted(files)
-
-        first = files[0]
-        pattern = re.compile(r"\d{4}-\d{2}.*nc")
-        if not (idx := pattern.search(first)):
+        first = min(files)
+        if not (idx := MONTHLY_DATE.search(first)):
             log_message("error", f"{__name__}: Unexpected file format: {first}")
             sys.exit(1)
 
@@ -673,66 +873,36 @@ class Dataset(object):
         # robustly. Its hard because the high-freq files arent consistant
         # from case to case, using different 'h' codes and different frequencies
         # for the time being, if there's at least one file per year it'll get marked as correct
-        for year in range(self.start_year, self.end_year):
-            found = None
-            pattern = re.compile(f"{year:04d}" + r"-\d{2}.*.nc")
-            for idx, file in enumerate(files):
-                if pattern.search(file):
-                    found = idx
-                    break
-            if found is not None:
-                files.pop(idx)
+        years = parse_years(files)
+        for start, end in missing_ranges(years, self.start_year, self.end_year - 1):
+            if start == end:
+                missing.append(f"{prefix}{start:04d}")
             else:
-                name = f"{prefix}{year:04d}"
-                missing.append(name)
+                missing.append(f"{prefix}{start:04d}-{end:04d}")
 
         return missing
 
     def check_time_series(self, files):
 
         missing = []
-        files = [x.split("/")[-1] for x in sorted(files)]
-        files_found = []
 
         # DEBUG not self.datavasrs
         if not self.datavars:
             log_message( "error", f"{__name__}: check_time_series: dataset {self.dataset_id} is trying to validate time-series files, but has no datavars",)
             sys.exit(1)
 
-        for var in self.datavars:
-
-            # depending on the mapping file used to regrid the time-series
-            # they may have different names, so we start by finding
-            # all the files for each variable
-            v_files = list()
-            for x in files:
-                idx = -36 if "cmip6_180x360_aave" in x else -17
-                if var in x and x[:idx] == var:
-                    v_files.append(x)
+        # depending on the mapping file used to regrid the time-series
+        # they may have different names, so the variable is taken from
+        # the front of the name with the span and map name cut off
+        spans = parse_ts_spans(files)
 
-            if not v_files:
+        for var in self.datavars:
+            if not (v_spans := spans.get(var)):
                 missing.append(f"{self.dataset_id}-{var}-{self.start_year:04d}-{self.end_year:04d}")
                 continue
 
-            v_files = sorted(v_files)
-            v_start, v_end = self.get_ts_start_end(v_files[0])
-            if self.start_year != v_start:
-                missing.append(f"{self.dataset_id}-{var}-{self.start_year:04d}-{v_start:04d}")
-
-            prev_end = self.start_year
-            for file in v_files:
-                file_start, file_end = self.get_ts_start_end(file)
-                if file_start == self.start_year:
-                    prev_end = file_end
-                    continue
-                if file_start == prev_end + 1:
-                    prev_end = file_end
-                else:
-                    missing.append(f"{self.dataset_id}-{var}-{prev_end:04d}-{file_start:04d}")
-
-            file_start, file_end = self.get_ts_start_end(files[-1])
-            if file_end != self.end_year:
-                missing.append(f"{self.dataset_id}-{var}-{file_start:04d}-{self.end_year:04d}")
+            for start, end in missing_ranges(years_covered(v_spans), self.start_year, self.end_year):
+                missing.append(f"{self.dataset_id}-{var}-{start:04d}-{end:04d}")
 
         return missing
 
@@ -741,27 +911,15 @@ class Dataset(object):
         Given a list of monthly files, find any that are missing
         """
         missing = []
-        files = sorted(files)
 
-        pattern = r"\d{4}-\d{2}.*nc"
-        try:
-            idx = re.search(pattern=pattern, string=files[0])
-        except Exception as e:
-            log_message( "error", f"{__name__}: file {files[0]} does not match expected pattern for monthly files",)
+        if not (parsed := parse_monthly(files)):
+            log_message("error", f"{__name__}: Unexpected file format: {min(files)}")
             sys.exit(1)
+        prefix, suffix, months = parsed
 
-        if not idx:
-            log_message("error", f"{__name__}: Unexpected file format: {files[0]}")
-            sys.exit(1)
-
-        prefix = files[0][: idx.start()]
-        suffix = files[0][idx.start() + 7 :]
-
-        for year in range(self.start_year, self.end_year + 1):
-            for month in range(1, 13):
-                name = f"{prefix}{year:04d}-{month:02d}{suffix}"
-                if name not in files:
-                    missing.append(name)
+        for start, end in missing_ranges(months, self.start_year * 12, self.end_year * 12 + 11):
+            for month in range(start, end + 1):
+                missing.append(f"{prefix}{month // 12:04d}-{month % 12 + 1:02d}{suffix}")
 
         return missing
 
@@ -772,12 +930,13 @@ class Dataset(object):
         missing = []
 
         pattern = r"_\d{6}_\d{6}_climo.nc"
-        files = sorted(files)
-        idx = re.search(pattern=pattern, string=files[0])
+        first = min(files)
+        idx = re.search(pattern=pattern, string=first)
         if not idx:
-            log_message("error", f"{__name__}: Unexpected file format: {files[0]}")
+            log_message("error", f"{__name__}: Unexpected file format: {first}")
             sys.exit(1)
-        prefix = files[0][: idx.start() - 2]
+        prefix = first[: idx.start() - 2]
+        files = set(files)
 
         for month in range(1, 13):
             name = f"{prefix}{month:02d}_{self.start_year:04d}{month:02d}_{self.end_year:04d}{month:02d}_climo.nc"
@@ -817,31 +976,15 @@ class Dataset(object):
         """
         Given a list of CMIP files, find of all the files that should be there are
         """
-        # import ipdb; ipdb.set_trace()
         missing = []
-        files = sorted(files)
-        file_start, file_end = self.get_file_start_end(files[0])
-
-        if file_start != self.start_year:
-            msg = f"{self.dataset_id}-{self.start_year:04d}-{file_start:04d} -> expected case start doesnt match files start"
-            missing.append(msg)
-            prev_end = file_start - 1
-        else:
-            prev_end = self.start_year
-
-        for file in files:
-            file_start, file_end = self.get_file_start_end(file)
-            if file_start == self.start_year:
-                prev_end = file_end
-                continue
-            if file_start != prev_end + 1:
-                msg = f"{self.dataset_id}-{prev_end:04d}-{file_start:04d}"
-                missing.append(msg)
-            prev_end = file_end
-
-        file_start, file_end = self.get_file_start_end(files[-1])
-        if file_end != self.end_year:
-            msg = f"{self.dataset_id}-{file_end:04d}-{self.end_year:04d} -> expected case end doesnt match files end"
+        years = years_covered([self.get_file_start_end(x) for x in files])
+
+        for start, end in missing_ranges(years, self.start_year, self.end_year):
+            msg = f"{self.dataset_id}-{start:04d}-{end:04d}"
+            if start == self.start_year:
+                msg += " -> expected case start doesnt match files start"
+            elif end == self.end_year:
+                msg += " -> expected case end doesnt match files end"
             missing.append(msg)
         return missing
 
@@ -902,6 +1045,7 @@ class Dataset(object):
         return start, end
 
     def is_blocked(self, state):
+        self.ensure_status_file()
         if not self.status_path or not self.status_path.exists():
             log_message("error", f"{__name__}: Status file for {self.dataset_id} cannot be found")
             sys.exit(1)
@@ -939,36 +1083,57 @@ comm: {self.comm}"""
         read status file, convert lines "STAT:ts:PROCESS:status1:status2:..."
         into dictionary, key = STAT, rows are tuples (ts,'PROCESS:status1:status2:...')
         and for comments, key = COMM, rows are comment lines
-        """
-        self.comm = list()
 
+        Only the lines appended since the last call are parsed, the reader
+        keeps track of the inode and offset of the file
+        """
         if path is None:
             path = self.status_path
+        path = Path(path)
 
         if not path.exists():
             return dict()
+        if (
+            path != self.status_path
+            or self._status_reader is None
+            or self._status_reader.path != path
+        ):
+            self._status_reader = StatusFileReader(path)
+            self.comm = list()
+            self._last_status_line = None
         self.status_path = path
 
-        statbody = load_file_lines(path.resolve())
+        # the first read has the whole file, so it replaces whatever the store had for it
+        first_read = self._status_reader.inode is None
+        reset, statbody = self._status_reader.read()
+        if reset:
+            # the file was replaced or truncated, the reader starts over
+            self.comm = list()
+            self._last_status_line = None
+        if (statbody or reset or first_read) and self.status_store is not None:
+            self.status_store.add_lines(
+                self.dataset_id, statbody, self._status_reader.line_offsets, reset=reset or first_read
+            )
+
         for line in statbody:
-            line_info = line.split(":")
+            if "STAT" in line:
+                self._last_status_line = line
             # forge tuple (timestamp,residual_string), add to STAT list
-            if line_info[0] == "STAT":
-                timestamp = line_info[1]
-                major = line_info[2]
-                minor = line_info[3]
-
-                if major not in self.stat:
-                    self.stat[major] = {}
-                if minor not in self.stat[major]:
-                    self.stat[major][minor] = []
-                # if len(line_info) == 5:
-                #     message = (timestamp, ":".join(line_info[3:]))
-                # elif len(line_info) > 5:
-                message = (timestamp, ":".join(line_info[4:]))
-                # make sure not to load duplicate messages
-                if message not in self.stat[major][minor]:
-                    self.stat[major][minor].append(message)
-            else:
+            if (parsed := parse_status_line(line)) is None:
                 self.comm.append(line)
+                continue
+            timestamp, major, minor, message = parsed
+
+            # make sure not to load duplicate messages
+            key = (major, minor, timestamp, message)
+            if key in self._seen_messages:
+                continue
+            self._seen_messages.add(key)
+
+            if major not in self.stat:
+                self.stat[major] = {}
+            if minor not in self.stat[major]:
+                self.stat[major][minor] = []
+            self.stat[major][minor].append((timestamp, message))
+            self._track_binding(timestamp, major, minor, message)
         return
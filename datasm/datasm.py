@@ -1,27 +1,28 @@
 """The datasm module."""
-import fnmatch
 import inspect
 import os
 import sys
 import subprocess
+import traceback
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from pprint import pformat
+from queue import Empty, Queue
 from re import I
+from threading import Thread
 from time import sleep
 
-import ipdb
-import yaml
-from termcolor import colored, cprint
-from tqdm import tqdm
-
 import datasm.resources as resources
 import datasm.util as util
-from datasm.dataset import Dataset, DatasetStatus, DatasetStatusMessage
+from datasm import esgf_cache
+from datasm.dataset import Dataset, DatasetStatus, DatasetStatusMessage, VERSION_INDEX_STATS
 from datasm.listener import Listener
-from datasm.slurm import Slurm
+from datasm.executor import EXECUTORS, get_executor, parse_job_id
+from datasm.status import SQLiteStatusStore
 from datasm.util import get_dsm_paths, log_message, setup_logging, parent_native_dsid
+from datasm.spec import load_spec
 from datasm.workflows import Workflow
+from datasm.workflows.jobs import JobPool, RequirementIndex
 
 
 dsm_paths = get_dsm_paths()
@@ -34,10 +35,8 @@ DEFAULT_ARCHIVE_PATH = dsm_paths["ARCHIVE_STORAGE"]
 
 inner_resource_path, _ = os.path.split(resources.__file__)
 DEFAULT_CONF_PATH = os.path.join(inner_resource_path, "datasm_config.yaml")
-
-with open(DEFAULT_CONF_PATH, "r") as instream:
-    datasm_conf = yaml.load(instream, Loader=yaml.SafeLoader)
 NAME = "auto"
+DEFAULT_ARRAY_SIZE = 1000
 
 # -------------------------------------------------------------
 
@@ -59,6 +58,14 @@ class AutoDataSM:
         self.archive_path = Path(kwargs.get( "archive_path", DEFAULT_ARCHIVE_PATH))
         self.status_path = Path(kwargs.get("status_path", DEFAULT_STATUS_PATH))
 
+        # optionally mirror every status line into a SQLite store for bulk queries
+        self.status_store = None
+        if status_db := kwargs.get("status_db"):
+            self.status_store = SQLiteStatusStore(status_db)
+
+        if kwargs.get("no_cache") or kwargs.get("refresh"):
+            esgf_cache.configure(enabled=not kwargs.get("no_cache"), refresh=kwargs.get("refresh"))
+
         self.spec_path = Path(kwargs.get("spec_path", DEFAULT_SPEC_PATH))
 
         if self.spec_path != DEFAULT_SPEC_PATH:
@@ -74,6 +81,8 @@ class AutoDataSM:
             self.dataset_ids = [self.dataset_ids]
         self.report_missing = kwargs.get("report_missing")
         self.job_workers = kwargs.get("job_workers", 8)
+        # the most jobs of one kind to submit together as a job array, 1 turns arrays off
+        self.array_size = kwargs.get("array_size") or DEFAULT_ARRAY_SIZE
         self.datasets = None
         self.datasets_from_path = kwargs.get("datasets_from_path", False)
         os.makedirs(self.slurm_path, exist_ok=True)
@@ -108,23 +117,26 @@ class AutoDataSM:
 
             self.workflow.load_children()
             self.workflow.load_transitions()
+            self.workflow.compile_transitions()
 
-            # this is a list of WorkflowJob objects
-            self.job_pool = []
+            # the submitted WorkflowJob objects, by slurm job id
+            self.job_pool = JobPool()
 
-            # create the local Slurm object
-            self.slurm = Slurm()
+            # create the object that runs the job scripts, slurm unless asked otherwise
+            self.slurm = get_executor(
+                kwargs.get("executor") or "slurm", max_workers=kwargs.get("local_workers"))
 
         # dont setup the listener until after we've gathered the datasets
         self.listener = None
+        # dataset_ids whose status files have changed, see consume_status_events
+        self.status_events = Queue()
 
         if self.serial is True:
             log_message("info", "Running datasm in serial mode")
         else:
             log_message("info", f"Running datasm in parallel mode with {self.num_workers} workers")
 
-        with open(self.spec_path, "r") as instream:
-            self.dataset_spec = yaml.load(instream, Loader=yaml.SafeLoader)
+        self.dataset_spec = load_spec(self.spec_path)
 
     def __call__(self, check_esgf=True):
         try:
@@ -139,6 +151,7 @@ class AutoDataSM:
 
             # start a workflow for each dataset as needed
             self.start_datasets()
+            self.start_status_consumer()
 
             # wait around while jobs run
             while True:
@@ -147,9 +160,8 @@ class AutoDataSM:
                 sleep(10)
 
         except KeyboardInterrupt:
-            if listeners := self.listener:
-                for l in listeners:
-                    l.stop()
+            if self.listener is not None:
+                self.listener.stop()
             sys.exit(1)
 
         return 0
@@ -214,6 +226,7 @@ class AutoDataSM:
             pub_base=self.publication_path,
             warehouse_base=self.warehouse_path,
             archive_base=self.archive_path,
+            status_store=self.status_store,
             no_status_file=True)
 
         log_message("info", f"{__name__}: find_e3sm_source_dataset: tries dsid {dataset.dataset_id}, calls 'requires_dataset()'")
@@ -229,9 +242,7 @@ class AutoDataSM:
         return None
 
     def setup_datasets(self, check_esgf=True):
-        cmip6_ids = [x for x in self.collect_cmip_datasets()]
-        e3sm_ids = [x for x in self.collect_e3sm_datasets()]
-        all_dataset_ids = cmip6_ids + e3sm_ids
+        catalog = self.dataset_spec.catalog(self.testing)
 
         # if the user gave us a wild card, filter out anything
         # that doesn't match their pattern
@@ -240,13 +251,12 @@ class AutoDataSM:
             dataset_ids = []
             for dataset_pattern in self.dataset_ids:
                 log_message("info", f"setup_datasets: testing for pattern {dataset_pattern} in all_dataset_ids")
-                new_ids = fnmatch.filter(all_dataset_ids, dataset_pattern)
-                log_message("info", f"setup_datasets: matches are: {new_ids}")
-                if new_ids := fnmatch.filter(all_dataset_ids, dataset_pattern):
-                    dataset_ids.extend(new_ids)
+                new_ids = catalog.match(dataset_pattern)
+                log_message("debug", lambda: f"setup_datasets: matches are: {new_ids}")
+                dataset_ids.extend(new_ids)
             self.dataset_ids = dataset_ids
         else:
-            self.dataset_ids = all_dataset_ids
+            self.dataset_ids = list(catalog.ids)
 
         if not self.dataset_ids:
 
@@ -268,40 +278,35 @@ class AutoDataSM:
                 pub_base=self.publication_path,
                 warehouse_base=self.warehouse_path,
                 archive_base=self.archive_path,
+                status_store=self.status_store,
             )
             for dataset_id in self.dataset_ids
         }
 
         # fill in the start and end year for each dataset
         for dataset_id, dataset in self.datasets.items():
-            if dataset.project == "CMIP6":
-                start_year = self.dataset_spec["project"]["CMIP6"][dataset.activity][dataset.institution][dataset.model_version][dataset.experiment]["start"]
-                end_year = self.dataset_spec["project"]["CMIP6"][dataset.activity][dataset.institution][dataset.model_version][dataset.experiment]["end"]
-            else:
-                start_year = self.dataset_spec["project"]["E3SM"][dataset.model_version][dataset.experiment]["start"]
-                end_year = self.dataset_spec["project"]["E3SM"][dataset.model_version][dataset.experiment]["end"]
-
-            dataset.start_year = start_year
-            dataset.end_year = end_year
+            dataset.start_year, dataset.end_year = self.dataset_spec.year_range(dataset_id)
 
         # if the dataset is a time-series, find out what
         # its data variables are [must have project=E3SM]
         for dataset in self.datasets.values():
             if "time-series" in dataset.data_type:
                 facets = dataset.dataset_id.split(".")
-                realm_vars = self.dataset_spec["time-series"][dataset.realm]
-                exclude = self.dataset_spec["project"]["E3SM"][facets[1]][facets[2]].get("except")
-                if exclude:
-                    dataset.datavars = [x for x in realm_vars if x not in exclude]
-                else:
-                    dataset.datavars = realm_vars
+                dataset.datavars = self.dataset_spec.time_series_variables(facets[1], facets[2], dataset.realm)
 
         # find the state of each dataset
         if check_esgf:
-            # import ipdb; ipdb.set_trace()
+            from tqdm import tqdm
+
+            # look up the published files for every dataset in a few batched
+            # searches, anything missing from the result is searched for by the dataset
+            esgf_files = util.resolve_esgf_files(list(self.datasets.keys()))
             if not self.serial:
                 pool = ProcessPoolExecutor(max_workers=self.num_workers)
-                futures = [pool.submit(x.find_status) for x in self.datasets.values()]
+                futures = [
+                    pool.submit(x.find_status, esgf_files.get(x.dataset_id))
+                    for x in self.datasets.values()
+                ]
                 for future in tqdm(
                     as_completed(futures),
                     total=len(futures),
@@ -314,7 +319,7 @@ class AutoDataSM:
                     self.datasets[dataset_id].missing = missing
             else:
                 for dataset in tqdm(self.datasets.values()):
-                    dataset_id, status, _ = dataset.find_status()
+                    dataset_id, status, _ = dataset.find_status(esgf_files.get(dataset.dataset_id))
                     if isinstance(status, DatasetStatus):
                         status = status.value
                     self.datasets[dataset_id].status = status
@@ -340,20 +345,60 @@ class AutoDataSM:
             "info", f"Dataset {dataset.dataset_id} SUCCEEDED from {dataset.status}"
         )
 
-    def status_was_updated(self, path):
+    def status_was_updated(self, path, dataset_id=None):
         """
-        This should be called whenever a datasets status file is updated
-        Parameters: path (str) -> the path to the directory containing the status file
+        This should be called whenever a datasets status file is updated, the
+        change is queued and handled by the status event consumer thread
+        Parameters:
+            path (str) -> the path to the status file
+            dataset_id (str) -> the dataset the status file belongs to, if not given its read from the file
         """
-        dataset_id = None
-
-        with open(path, "r") as instream:
-            for line in instream.readlines():
-                if "DATASETID" in line:
-                    dataset_id = line.split("=")[-1].strip()
         if dataset_id is None:
-            log_message("error", "setup_datasets: Unable to find dataset ID in status file")
+            with open(path, "r") as instream:
+                for line in instream.readlines():
+                    if "DATASETID" in line:
+                        dataset_id = line.split("=")[-1].strip()
+        if dataset_id is None:
+            log_message("error", f"status_was_updated: Unable to find dataset ID in status file {path}")
+            return
+        self.status_events.put(dataset_id)
 
+    def consume_status_events(self):
+        """
+        The single consumer of the status event queue. Each pass takes every
+        queued event, collapses repeats for the same dataset, brings those
+        datasets up to date, and then runs one scheduling pass for all of them.
+        Status lines written while a batch is being handled are picked up by
+        the next batch instead of re-entering this one.
+        """
+        while not self.should_exit:
+            try:
+                batch = {self.status_events.get(timeout=1): None}
+            except Empty:
+                continue
+            while True:
+                try:
+                    batch[self.status_events.get_nowait()] = None
+                except Empty:
+                    break
+            log_message("debug", f"consume_status_events: handling {len(batch)} updated datasets")
+
+            try:
+                datasets = {}
+                for dataset_id in batch:
+                    datasets[dataset_id] = self.update_from_status(dataset_id)
+
+                # start the transition change for the datasets
+                self.start_datasets(datasets)
+            except Exception as e:
+                log_message("error", f"consume_status_events: failed to handle {list(batch)}: {repr(e)}\n{traceback.format_exc()}")
+
+    def update_from_status(self, dataset_id):
+        """
+        Bring a dataset up to date with its status file, and release the
+        job pool entry of any job that has finished
+        Returns: the dataset
+        """
         dataset = self.datasets[dataset_id]
         dataset.update_from_status_file()
         dataset.unlock(dataset.latest_warehouse_dir)
@@ -368,20 +413,15 @@ class AutoDataSM:
             latest_attrs = latest.split(":")
             second_latest_attrs = second_latest.split(":")
             if "slurm_id" in second_latest_attrs[-1]:
-                job_id = int(
+                job_id = parse_job_id(
                     second_latest_attrs[-1][second_latest_attrs[-1].index(
                         "=") + 1:]
                 )
                 # if the job names are the same
                 if second_latest_attrs[-3] == latest_attrs[-3]:
                     if "Pass" in latest_attrs[-2] or "Fail" in latest_attrs[-2]:
-                        for job in self.job_pool:
-                            if job.job_id == job_id:
-                                self.job_pool.remove(job)
-                                break
-
-        # start the transition change for the dataset
-        self.start_datasets({dataset_id: dataset})
+                        self.job_pool.pop(job_id)
+        return dataset
 
     def start_datasets(self, datasets=None):
         """
@@ -408,6 +448,9 @@ class AutoDataSM:
         if datasets is None:
             datasets = self.datasets
 
+        # built on first use, once for the whole pass
+        requirement_index = None
+
         for dataset_id, dataset in datasets.items():
 
             log_message("debug", f"start_datasets: working datasets_id {dataset_id} from datasets.items()")
@@ -493,14 +536,16 @@ class AutoDataSM:
                     if params:
                         msg += f" with params {params}"
                     log_message("info", msg)
-                    log_message("debug", msg, self.debug)
+                    log_message("debug", msg)
                     dataset.status = (new_state, params)
 
             if not engaged_states:
                 continue
 
+            if requirement_index is None:
+                requirement_index = RequirementIndex(self.datasets.values())
+
             for state, workflow, params in engaged_states:
-                # import ipdb; ipdb.set_trace()
                 # Triggers workflow __init__ get_job to call job init
                 log_message("info", f"start_datasets: instantiating newjob = self.workflow.get_job() for dataset {dataset.dataset_id}")
                 newjob = self.workflow.get_job(
@@ -513,8 +558,8 @@ class AutoDataSM:
                     job_workers=self.job_workers,
                     spec=self.dataset_spec,
                     debug=self.debug,
-                    config=datasm_conf,
-                    other_datasets=list(self.datasets.values()),
+                    config=util.get_datasm_conf(),
+                    requirement_index=requirement_index,
                     serial=self.serial,
                     tmpdir=self.tmpdir,
                 )
@@ -530,6 +575,8 @@ class AutoDataSM:
                     matching_job.setup_requisites(newjob.dataset)
 
         zpasses = 0
+        # prepared jobs by WorkflowJob.array_key, so that each kind can be submitted at once
+        ready_jobs = {}
         # start the jobs in the job_pool if they're ready
         for job in new_jobs:
             zpasses = zpasses + 1
@@ -554,13 +601,12 @@ class AutoDataSM:
                 job_reqs_met = job.meets_requirements()
                 log_message("info", f"start_datasets: job_reqs_met={job_reqs_met}") # True/False
             if job.job_id is None and job_reqs_met:
-                log_message("info", f"start_datasets: (job.job_id={job.job_id}) Job {job_name} meets its input dataset requirements, calling job(self.slurm)")
-                job_id = job(self.slurm)        # WARNING:  If job script exits prematurely, this call never returns and datasm hangs.
-                log_message("info", f"start_datasets: DGB: got job_id {job_id} from job(self.slurm)")
-                if job_id is not None:
-                    log_message("info",f"Adding job with job_id {job_id} to self.job_pool")
-                    job.job_id = job_id
-                    self.job_pool.append(job)
+                log_message("info", f"start_datasets: (job.job_id={job.job_id}) Job {job_name} meets its input dataset requirements, calling job.prepare(self.slurm)")
+                script_path = job.prepare(self.slurm)
+                log_message("info", f"start_datasets: DGB: got script {script_path} from job.prepare(self.slurm)")
+                if script_path is not None:
+                    # submitted below, together with the other ready jobs of the same kind
+                    ready_jobs.setdefault(job.array_key(), []).append((job, str(script_path)))
                 else:
                     log_message("error", f"Error starting up job {job}. EXIT if serial.")
                     if Exit_On_Bad_Job and self.serial:
@@ -575,6 +621,7 @@ class AutoDataSM:
                 for attr in attributes:
                     print(f"{attr} = {getattr(job,attr)}")
             log_message("info", f"start_datasets: (bottom loop: for job in new_jobs)")
+        self.submit_jobs(ready_jobs)
         job_pool_size = len(self.job_pool)
         if len(self.job_pool) == 0:
             log_message("info", f"Job Pool contains No jobs, pass={zpasses}:  datasm NOT exiting.")
@@ -582,19 +629,51 @@ class AutoDataSM:
         log_message("info", f"start_datasets: Return: Job Pool contains {job_pool_size} jobs, pass={zpasses}") # try to exit if no jobs
         return
 
+    def submit_jobs(self, ready_jobs):
+        """
+        Submit prepared jobs, each group of jobs that ask for the same resources
+        as job arrays of up to array_size tasks, and add them to the job pool
+        Parameters: ready_jobs dict of WorkflowJob.array_key to a list of (job, script_path)
+        """
+        for key, group in ready_jobs.items():
+            size = max(self.array_size, 1)
+            for start in range(0, len(group), size):
+                chunk = group[start:start + size]
+                if len(chunk) == 1:
+                    job_ids = [self.slurm.sbatch(chunk[0][1])]
+                else:
+                    job_ids = self.slurm.sbatch_array([script for _, script in chunk], name=key[1])
+                for (job, script), job_id in zip(chunk, job_ids):
+                    if not job_id:
+                        # sbatch failed, leave the dataset where it was so it can be started again
+                        log_message("error", f"submit_jobs: failed to submit {job} from {script}")
+                        job.dataset.unlock(job.dataset.latest_warehouse_dir)
+                        continue
+                    job.job_id = job.submitted(job_id)
+                    log_message("info", f"Adding job with job_id {job_id} to self.job_pool")
+                    self.job_pool.add(job)
+
     def start_listener(self):
         """
-        Starts a file change listener for the status file
-        for each of the datasets.
+        Starts one file change listener that watches the status files
+        for all of the datasets.
         """
-        self.listener = []
-        for _, dataset in self.datasets.items():
-            log_message("info", f"starting listener for {dataset.status_path}")
-            listener = Listener(warehouse=self, file_path=dataset.status_path)
-            listener.start()
-            self.listener.append(listener)
+        self.listener = Listener(warehouse=self)
+        for dataset_id, dataset in self.datasets.items():
+            dataset.ensure_status_file()
+            self.listener.add(dataset.status_path, dataset_id)
+        self.listener.start()
         log_message("info", "Listener setup complete")
 
+    def start_status_consumer(self):
+        """
+        Starts the thread that handles the queued status file changes, call this
+        once the first start_datasets pass has returned, so that start_datasets
+        only ever runs on one thread. Changes made during the first pass stay
+        queued until then.
+        """
+        Thread(target=self.consume_status_events, name="status-events", daemon=True).start()
+
     def check_done(self):
         """
         Checks all the datasets to see if they're in the Pass or Fail state,
@@ -609,17 +688,18 @@ class AutoDataSM:
             ):
                 all_done = False
         if all_done:
-            for listener in self.listener:
-                listener.observer.stop()
+            if self.listener is not None:
+                self.listener.observer.stop()
             self.should_exit = True
+            log_message("info", f"Version directory index: {VERSION_INDEX_STATS}")
             log_message("info", "All datasets complete, exiting")
             sys.exit(0)
         return
 
     def find_matching_job(self, searchjob):
         """
-        Given a job object to searh for, looks at all jobs
-        in the job_pool to find a job with the matching characteristics.
+        Given a job object to searh for, looks up the jobs in the job_pool
+        with the same name, experiment, model_version and ensemble.
         Additionally checks if the job, and the searching job, meet their
         dataset input requirements.
 
@@ -628,16 +708,14 @@ class AutoDataSM:
         Returns:
             WorkflowJob: the matching job
         """
-        log_message("info", "find_matching_job: searching all job in self.job_pool")
-        for job in self.job_pool:
-            log_message("info", f"find_matching_job:     trying job {job.name} against searchjob {searchjob.name}")
+        if not (candidates := self.job_pool.similar(searchjob)):
+            return
+        if searchjob.meets_requirements():
+            return
+        log_message("info", f"find_matching_job: trying {len(candidates)} jobs against searchjob {searchjob.name}")
+        for job in candidates:
             if (
-                job.name == searchjob.name
-                and job.dataset.experiment == searchjob.dataset.experiment
-                and job.dataset.model_version == searchjob.dataset.model_version
-                and job.dataset.ensemble == searchjob.dataset.ensemble
-                and not job.meets_requirements()
-                and not searchjob.meets_requirements()
+                not job.meets_requirements()
                 and job.requires_dataset(searchjob.dataset)
                 and searchjob.requires_dataset(job.dataset)
             ):
@@ -647,44 +725,10 @@ class AutoDataSM:
         return
 
     def collect_cmip_datasets(self, **kwargs):
-
-        for activity_name, activity_val in self.dataset_spec["project"]["CMIP6"].items():
-            if activity_name == "test" and not self.testing:
-                continue
-            for institution_id, institution_branch in activity_val.items():
-                for version_name, version_value in institution_branch.items():    # version_name is CMIP6 Source_ID
-                    for experimentname, experimentvalue in version_value.items():
-                        for ensemble in experimentvalue["ens"]:
-                            for table_name, table_value in self.dataset_spec["tables"].items():
-                                for variable in table_value:
-                                    if (
-                                        variable in experimentvalue["except"]
-                                        or table_name in experimentvalue["except"]
-                                        or variable == "all"
-                                    ):
-                                        continue
-                                    dataset_id = f"CMIP6.{activity_name}.{institution_id}.{version_name}.{experimentname}.{ensemble}.{table_name}.{variable}.gr"
-                                    yield dataset_id
+        yield from self.dataset_spec.cmip6_dataset_ids(self.testing)
 
     def collect_e3sm_datasets(self, **kwargs):
-        for version in self.dataset_spec["project"]["E3SM"]:
-            if version == "test" and not self.testing:
-                continue
-            for experiment, experimentinfo in self.dataset_spec["project"]["E3SM"][
-                version
-            ].items():
-                for ensemble in experimentinfo["ens"]:
-                    for res in experimentinfo["resolution"]:
-                        for comp in experimentinfo["resolution"][res]:
-                            for item in experimentinfo["resolution"][res][comp]:
-                                for data_type in item["data_types"]:
-                                    if (
-                                        item.get("except")
-                                        and data_type in item["except"]
-                                    ):
-                                        continue
-                                    dataset_id = f"E3SM.{version}.{experiment}.{res}.{comp}.{item['grid']}.{data_type}.{ensemble}"
-                                    yield dataset_id
+        yield from self.dataset_spec.e3sm_dataset_ids(self.testing)
 
     @staticmethod
     def add_args(
@@ -739,12 +783,37 @@ class AutoDataSM:
             default=DEFAULT_STATUS_PATH,
             help=f"The path to where to store dataset status files, default={DEFAULT_STATUS_PATH}",
         )
+        p.add_argument(
+            "--status-db",
+            required=False,
+            help="Path to a SQLite database that mirrors all status file lines, for querying many datasets at once",
+        )
+        esgf_cache.add_cache_args(p)
         p.add_argument(
             "--job-workers",
             type=int,
             default=8,
             help="number of parallel workers each job should create when running, default=8",
         )
+        p.add_argument(
+            "--executor",
+            choices=EXECUTORS,
+            default="slurm",
+            help="How to run the job scripts: submit them to slurm, or run them on this machine (local), default=slurm",
+        )
+        p.add_argument(
+            "--local-workers",
+            type=int,
+            required=False,
+            help="With --executor local, the number of job scripts to run at once, default is the number of cpus",
+        )
+        p.add_argument(
+            "--array-size",
+            type=int,
+            default=DEFAULT_ARRAY_SIZE,
+            required=False,
+            help=f"Submit ready jobs of the same kind together as slurm job arrays of up to this many tasks, 1 submits every job on its own, default={DEFAULT_ARRAY_SIZE}",
+        )
         p.add_argument(
             "--testing", action="store_true", help="run the datasm in testing mode"
         )
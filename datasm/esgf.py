@@ -0,0 +1,221 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+from datasm import esgf_cache
+
+
+DEFAULT_INDEX_NODE = "esgf-node.llnl.gov"
+
+# what each query type returns when the caller doesnt ask for specific fields,
+# the full documents are many times larger than anything datasm looks at
+DEFAULT_FIELDS = {
+    "Dataset": "id,master_id,instance_id,title,version,data_node,number_of_files,latest",
+    "File": "id,title,dataset_id,instance_id,size,checksum,checksum_type,url",
+}
+
+# responses worth trying again, anything else is returned to the caller
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class ESGFSearchError(ValueError):
+    pass
+
+
+class ESGFClient(object):
+    """
+    A client for the ESGF search API.
+
+    All requests go through one pooled requests.Session with a timeout,
+    failed requests are retried with jittered exponential backoff, and each
+    response body is decoded once. Successful responses are kept in the
+    on-disk search cache (see datasm.esgf_cache).
+
+    Parameters:
+        node (str): the esgf index node to query
+        timeout (tuple): (connect, read) timeouts in seconds
+        retries (int): how many times to retry a failed request
+        backoff (float): base delay in seconds between retries, doubled each attempt
+        page_size (int): the number of docs to ask for per page, the index allows at most 10000
+        pool_size (int): the number of connections to keep open to the index node
+    """
+
+    def __init__(
+        self,
+        node=DEFAULT_INDEX_NODE,
+        timeout=(10, 120),
+        retries=4,
+        backoff=1.0,
+        page_size=10000,
+        pool_size=16,
+    ):
+        self.node = node
+        self.url = f"https://{node}/esg-search/search/"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.page_size = page_size
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                # requests is slow to import, only pay for it when a search is made
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def get(self, params):
+        """
+        Send one search request, using the cache when possible
+
+        Parameters:
+            params (list): (key, value) pairs for the query string, keys may repeat
+        Returns:
+            the decoded json response
+        """
+        url = f"{self.url}?{urlencode(params)}"
+
+        cache = esgf_cache.get_cache()
+        if cache is not None and not esgf_cache.refreshing():
+            try:
+                if (body := cache.get(url)) is not None:
+                    return json.loads(body)
+            except (sqlite3.Error, ValueError):
+                cache = None
+
+        from requests import ConnectionError, Timeout
+
+        for attempt in range(self.retries + 1):
+            try:
+                res = self.session.get(url, timeout=self.timeout)
+            except (ConnectionError, Timeout) as e:
+                if attempt == self.retries:
+                    raise ESGFSearchError(f"ESGF search request failed: {e}: {url}")
+            else:
+                if res.status_code == 200:
+                    break
+                if res.status_code not in RETRY_STATUS or attempt == self.retries:
+                    raise ESGFSearchError(f"ESGF search request failed: (stat_code {res.status_code}) {url}")
+            time.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+        try:
+            response = json.loads(res.text)
+        except ValueError:
+            raise ESGFSearchError(f"ESGF search returned a response that is not json: {url}")
+
+        if response.get("responseHeader", {}).get("status", 0) != 0:
+            raise ESGFSearchError(
+                f"ESGF search request returned status code: {response['responseHeader']['status']}: {url}"
+            )
+
+        if cache is not None and response["response"]["numFound"] > 0:
+            try:
+                cache.put(url, res.text)
+            except sqlite3.Error:
+                pass
+        return response
+
+    def search_page(self, facets, qtype="Dataset", fields=None, offset=0, limit=None, latest="true"):
+        """
+        Run a single page of a search
+
+        Parameters:
+            facets (dict): facet names to values, a list value is sent as repeated keys,
+                which the index ORs together
+            qtype (str): The query type, one of "Dataset" (default), "File" or "Aggregate",
+                or None to leave it to the facets
+            fields (str): a comma-separated string of field names to return, defaults to DEFAULT_FIELDS
+                for the query type, use "*" for everything
+            offset (int): offset into the results
+            limit (int): number of results to return, defaults to the page_size
+            latest (str): boolean (true/false not True/False) to search for only the latest version,
+                or None to not filter on it
+        Returns:
+            (docs, numFound)
+        """
+        params = [
+            ("offset", offset),
+            ("limit", limit if limit is not None else self.page_size),
+            ("format", "application/solr+json"),
+        ]
+        if qtype is not None:
+            params.append(("type", qtype))
+        if latest is not None:
+            params.append(("latest", latest))
+
+        if fields is None:
+            fields = DEFAULT_FIELDS.get(qtype or facets.get("type"))
+        if fields is not None and fields != "*":
+            params.append(("fields", fields))
+
+        for key, value in facets.items():
+            if isinstance(value, (list, tuple, set)):
+                params.extend((key, x) for x in value)
+            else:
+                params.append((key, value))
+
+        response = self.get(params)["response"]
+        return response["docs"], response["numFound"]
+
+    def pages(self, facets, qtype="Dataset", fields=None, latest="true"):
+        """
+        Walk through every page of a search, yielding (docs, numFound) as each page arrives
+        """
+        offset = 0
+        while True:
+            docs, num_found = self.search_page(
+                facets, qtype=qtype, fields=fields, offset=offset, latest=latest
+            )
+            yield docs, num_found
+            offset += len(docs)
+            if not docs or offset >= num_found:
+                return
+
+    def iter_docs(self, facets, qtype="Dataset", fields=None, latest="true"):
+        """
+        Yield every doc that matches the search, fetching pages as they are needed
+        """
+        for docs, _ in self.pages(facets, qtype=qtype, fields=fields, latest=latest):
+            yield from docs
+
+    def search(self, facets, qtype="Dataset", fields=None, latest="true"):
+        """
+        Returns the list of every doc that matches the search
+        """
+        return list(self.iter_docs(facets, qtype=qtype, fields=fields, latest=latest))
+
+
+_clients = {}
+
+
+def get_client(node=DEFAULT_INDEX_NODE, **kwargs):
+    """
+    Returns the shared ESGFClient for an index node, so every caller in the
+    process reuses the same connection pool. Any kwargs are passed to the
+    ESGFClient when it is first made, e.g. a larger pool_size for callers
+    that search from many threads
+    """
+    # forked workers get their own client, sockets cant be shared between processes
+    key = (node, os.getpid())
+    if (client := _clients.get(key)) is None:
+        client = _clients[key] = ESGFClient(node, **kwargs)
+    return client
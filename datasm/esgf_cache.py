@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+DEFAULT_CACHE_PATH = Path(
+    os.environ.get("XDG_CACHE_HOME", Path(Path.home(), ".cache")), "datasm", "esgf_search.db"
+)
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# DATASM_ESGF_CACHE=off turns the cache off, DATASM_ESGF_CACHE_PATH moves it
+_config = {
+    "enabled": os.environ.get("DATASM_ESGF_CACHE", "").lower() != "off",
+    "refresh": False,
+    "path": os.environ.get("DATASM_ESGF_CACHE_PATH") or DEFAULT_CACHE_PATH,
+    "ttl": int(os.environ.get("DATASM_ESGF_CACHE_TTL", DEFAULT_TTL)),
+    "max_bytes": int(os.environ.get("DATASM_ESGF_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+}
+_cache = None
+
+
+def normalize_url(url):
+    """
+    Put a search URL into a canonical form so that the same query always
+    maps to the same cache entry, regardless of parameter order or quoting
+    """
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", urlencode(query), "")
+    )
+
+
+class ESGFCache(object):
+    """
+    An on-disk cache of ESGF search responses, keyed by normalized URL.
+
+    Entries older than ttl seconds are ignored, and once the cache grows past
+    max_bytes the least recently used entries are dropped. Only successful
+    responses that found something are stored, so a dataset that is not yet
+    indexed is always asked for again.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # sqlite connections cant be shared with other threads or forked worker processes
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            local.conn = sqlite3.connect(str(self.path), timeout=60)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            with local.conn:
+                local.conn.execute(
+                    """CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        url TEXT,
+                        stored REAL,
+                        used REAL,
+                        size INTEGER,
+                        body TEXT)"""
+                )
+                local.conn.execute("CREATE INDEX IF NOT EXISTS responses_by_use ON responses (used)")
+            local.pid = os.getpid()
+        return local.conn
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def get(self, url):
+        """
+        Returns the cached body for the url, or None if its missing or expired
+        """
+        key = self.key(url)
+        row = self.conn.execute("SELECT stored, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[0] > self.ttl:
+            return None
+        with self.conn as conn:
+            conn.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+        return row[1]
+
+    def put(self, url, body):
+        now = time.time()
+        with self.conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, stored, used, size, body) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(url), normalize_url(url), now, now, len(body), body),
+            )
+        self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones until the cache fits in max_bytes
+        """
+        with self.conn as conn:
+            conn.execute("DELETE FROM responses WHERE stored < ?", (time.time() - self.ttl,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def invalidate(self, text):
+        """
+        Drop every entry whose URL mentions text, for example a dataset_id that was just published
+        """
+        with self.conn as conn:
+            conn.execute("DELETE FROM responses WHERE instr(url, ?) > 0", (text,))
+
+    def clear(self):
+        with self.conn as conn:
+            conn.execute("DELETE FROM responses")
+
+
+def configure(enabled=None, refresh=None, path=None, ttl=None, max_bytes=None):
+    """
+    Change how the ESGF search cache behaves for the rest of the process, tools call this
+    with their --no-cache and --refresh flags
+    """
+    global _cache
+    for name, value in (("enabled", enabled), ("refresh", refresh), ("path", path), ("ttl", ttl), ("max_bytes", max_bytes)):
+        if value is not None:
+            _config[name] = value
+    _cache = None
+
+
+def add_cache_args(parser):
+    """
+    Add the --no-cache and --refresh options to an argparse parser or argument group
+    """
+    parser.add_argument("--no-cache", action="store_true", dest="no_cache", required=False,
+        help="do not read or write the on-disk ESGF search cache")
+    parser.add_argument("--refresh", action="store_true", dest="refresh", required=False,
+        help="ignore any cached ESGF search results, and replace them with fresh ones")
+
+
+def get_cache():
+    """
+    Returns the process wide ESGFCache, or None if caching is turned off
+    """
+    global _cache
+    if not _config["enabled"]:
+        return None
+    if _cache is None:
+        _cache = ESGFCache(_config["path"], ttl=_config["ttl"], max_bytes=_config["max_bytes"])
+    return _cache
+
+
+def refreshing():
+    """
+    True if cached results should be replaced instead of used
+    """
+    return _config["refresh"]
+
+
+def master_id(dataset_id):
+    """
+    Strip the data node and the version off a dataset instance id,
+    "<master_id>.vYYYYMMDD|<data_node>" becomes "<master_id>". Ids without
+    a version are returned as they are
+    """
+    return re.sub(r"\.v\d+$", "", dataset_id.split("|")[0])
+
+
+def invalidate(dataset_id):
+    """
+    Drop every cached search that mentions the dataset, in any version
+    """
+    text = master_id(dataset_id)
+    if (cache := get_cache()) is not None:
+        try:
+            cache.invalidate(text)
+        except sqlite3.Error:
+            pass
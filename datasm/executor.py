@@ -0,0 +1,221 @@
+import itertools
+import os
+import shlex
+import signal
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import Popen, STDOUT
+from threading import Lock
+
+from datasm.util import log_message
+
+
+class Executor(object):
+    """
+    What AutoDataSM and the WorkflowJobs need from the thing that runs their
+    job scripts: render_script, sbatch, sbatch_array, queue and cancel. Slurm is one,
+    LocalExecutor runs the scripts on this machine instead.
+    """
+
+    def render_script(self, cmd, script_path, slurm_opts=[], **kwargs):
+        """
+        Write out an executable bash script
+        Parameters:
+            cmd (string) : a bash command to run
+            script_path (string) : the path to where to store the sbatch script
+            slurm_opts List[(str, str)] : a list of slurm argument key value pairs
+        """
+
+        with open(script_path, "w") as outstream:
+            outstream.write("#!/bin/bash\n\n")
+            for key, val in slurm_opts:
+                outstream.write(f"#SBATCH {key} {val}\n")
+            outstream.write(cmd + "\n")
+        st = os.stat(script_path)
+        os.chmod(script_path, st.st_mode | stat.S_IEXEC)
+
+    def sbatch(self, cmd, sbatch_args=None):
+        """
+        Submit a script to run
+        Returns:
+            job id of the new job (int), or 0 if it couldnt be submitted
+        """
+        raise NotImplementedError
+
+    def sbatch_array(self, scripts, name="array"):
+        """
+        Submit several rendered scripts that ask for the same resources together.
+        Executors without job arrays submit them one at a time
+        Parameters:
+            scripts (List[str]): paths to the rendered scripts
+            name (str): a name for the group
+        Returns:
+            the job id of each script, in the same order
+        """
+        return [self.sbatch(script) for script in scripts]
+
+    def queue(self):
+        """
+        Returns: list of the pending and running jobs, as dicts with JOBID, NAME, COMMAND and STATE
+        """
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        """
+        Returns: True if the job was cancelled
+        """
+        raise NotImplementedError
+
+
+def parse_job_id(text):
+    """
+    Turn a job id back into what sbatch or sbatch_array returned for it,
+    an int for a single job, or "<array id>_<index>" for a job array task
+    """
+    text = str(text).strip()
+    if "_" in text:
+        return text
+    return int(text)
+
+
+def script_options(script_path):
+    """
+    Read the #SBATCH options out of a rendered script
+    Returns: dict of option to value, e.g. {"-o": "/path/to/output", "-N": "1"}
+    """
+    options = {}
+    with open(script_path, "r") as instream:
+        for line in instream:
+            if not line.startswith("#SBATCH"):
+                continue
+            parts = shlex.split(line[len("#SBATCH"):])
+            if not parts:
+                continue
+            if parts[0].startswith("--") and "=" in parts[0]:
+                key, val = parts[0].split("=", 1)
+            else:
+                key, val = parts[0], " ".join(parts[1:])
+            options[key] = val
+    return options
+
+
+class LocalExecutor(Executor):
+    """
+    Runs the job scripts on this machine, at most max_workers at a time,
+    instead of submitting them to slurm. Each script runs in its own bash
+    process with its output going to the script's "-o"/"--output" file,
+    and reports back through the dataset status file the same way it would
+    under slurm.
+
+    Parameters:
+        max_workers (int): how many scripts can run at once, defaults to the number of cpus
+    """
+
+    PENDING = "PD"
+    RUNNING = "R"
+    COMPLETED = "CD"
+    FAILED = "F"
+    CANCELLED = "CA"
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="local-job")
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+
+    def sbatch(self, cmd, sbatch_args=None):
+        options = script_options(cmd)
+        output = options.get("-o") or options.get("--output") or f"{Path(cmd).with_suffix('')}.out"
+        with self._lock:
+            job_id = next(self._ids)
+            self._jobs[job_id] = {
+                "JOBID": job_id,
+                "NAME": options.get("-J") or options.get("--job-name") or Path(cmd).name,
+                "COMMAND": cmd,
+                "STATE": self.PENDING,
+                "EXITCODE": None,
+                "proc": None,
+            }
+        self._jobs[job_id]["future"] = self._pool.submit(self._run, job_id, cmd, output)
+        log_message("info", f"LocalExecutor: queued {cmd} as job {job_id}")
+        return job_id
+
+    def _run(self, job_id, cmd, output):
+        job = self._jobs[job_id]
+        with self._lock:
+            if job["STATE"] == self.CANCELLED:
+                return
+            job["STATE"] = self.RUNNING
+        try:
+            with open(output, "a") as outstream:
+                job["proc"] = Popen(
+                    ["bash", cmd], stdout=outstream, stderr=STDOUT, start_new_session=True
+                )
+                if job["STATE"] == self.CANCELLED:
+                    # cancelled while the process was starting
+                    os.killpg(job["proc"].pid, signal.SIGTERM)
+                returncode = job["proc"].wait()
+        except OSError as e:
+            log_message("error", f"LocalExecutor: unable to run job {job_id} {cmd}: {repr(e)}")
+            returncode = -1
+        with self._lock:
+            job["EXITCODE"] = returncode
+            if job["STATE"] != self.CANCELLED:
+                job["STATE"] = self.COMPLETED if returncode == 0 else self.FAILED
+        log_message("info", f"LocalExecutor: job {job_id} finished with state {job['STATE']}")
+
+    def state(self, job_id):
+        """
+        Returns: the state of a job, one of PD, R, CD, F or CA, or None if its not known
+        """
+        if (job := self._jobs.get(job_id)) is None:
+            return None
+        return job["STATE"]
+
+    def queue(self):
+        with self._lock:
+            return [
+                {key: job[key] for key in ["JOBID", "NAME", "COMMAND", "STATE"]}
+                for job in self._jobs.values()
+                if job["STATE"] in [self.PENDING, self.RUNNING]
+            ]
+
+    def cancel(self, job_id):
+        job_id = int(job_id)
+        if (job := self._jobs.get(job_id)) is None:
+            return False
+        with self._lock:
+            if job["STATE"] not in [self.PENDING, self.RUNNING]:
+                return False
+            job["STATE"] = self.CANCELLED
+            proc = job["proc"]
+        if proc is not None and proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        return True
+
+    def shutdown(self, wait=True):
+        """
+        Stop taking new jobs, and optionally wait for the queued ones to finish
+        """
+        self._pool.shutdown(wait=wait)
+
+
+EXECUTORS = ["slurm", "local"]
+
+
+def get_executor(name="slurm", **kwargs):
+    """
+    Make the executor with the given name, kwargs are passed to LocalExecutor
+    """
+    if name == "slurm":
+        from datasm.slurm import Slurm
+
+        return Slurm()
+    if name == "local":
+        return LocalExecutor(**kwargs)
+    raise ValueError(f"Unknown executor {name}, expected one of {EXECUTORS}")
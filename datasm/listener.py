@@ -1,47 +1,84 @@
-from time import sleep
+import os
+from threading import Lock, Timer
 from watchdog.observers import Observer
-from watchdog.events import RegexMatchingEventHandler
-from datasm.util import setup_logging, log_message
+from watchdog.events import FileSystemEventHandler
+from datasm.util import log_message
 
 
-class Listener(object):
-    def __init__(self, warehouse, file_path, **kwargs):
+class Listener(FileSystemEventHandler):
+    """
+    Watches the directories holding the dataset status files with a single
+    watchdog Observer, instead of one Observer (and one inotify watch) per file.
+
+    Events are matched to datasets through a dict of status file path to
+    dataset_id, every other file in the directories is ignored. A single
+    "echo >>" can fire several modify events, so events are collected for
+    `debounce` seconds after the first one arrives, and then each dataset
+    that changed is handed to warehouse.status_was_updated once.
+    """
+
+    def __init__(self, warehouse, debounce=0.5, **kwargs):
         super().__init__(**kwargs)
         self.warehouse = warehouse
-        self.file_path = file_path
+        self.debounce = debounce
         self.observer = None
+        self.paths = {}
+        self._pending = {}
+        self._timer = None
+        self._lock = Lock()
+        self._flush_lock = Lock()
 
-        patterns = str(self.file_path)
-        ignore_patterns = ""
-        ignore_directories = True
-        case_sensitive = True
-        self.my_event_handler = RegexMatchingEventHandler(
-            patterns, ignore_patterns, ignore_directories, case_sensitive
-        )
-
-        self.my_event_handler.on_created = self.on_created
-        self.my_event_handler.on_modified = self.on_modified
-        setup_logging("debug", f"listener.log")
+    def add(self, file_path, dataset_id):
+        """
+        Start watching the status file at file_path for the given dataset
+        """
+        self.paths[os.path.abspath(file_path)] = dataset_id
 
     def start(self):
-        # log_message("info", "Starting up filesystem listener")
         self.observer = Observer()
-        self.observer.schedule(self.my_event_handler, self.file_path, recursive=False)
+        directories = {os.path.dirname(x) for x in self.paths}
+        for directory in sorted(directories):
+            self.observer.schedule(self, directory, recursive=False)
         self.observer.start()
+        log_message("info", f"Watching {len(self.paths)} status files in {len(directories)} directories")
 
     def stop(self):
         log_message("info", "Shutting down filesystem listener")
-        self.observer.stop()
-        self.observer.join()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self.observer is not None:
+            self.observer.stop()
+            if self.observer.is_alive():
+                self.observer.join()
 
     def on_created(self, event):
-        log_message("info", f"{event.src_path} has been created")
+        self._queue(event.src_path)
 
     def on_modified(self, event):
-        # log_message("info", f"{event.src_path} has been changed")
-        self.warehouse.status_was_updated(event.src_path)
+        self._queue(event.src_path)
+
+    def on_moved(self, event):
+        # status files that get rewritten through a temp file show up as a move
+        self._queue(event.dest_path)
 
+    def _queue(self, src_path):
+        path = os.path.abspath(src_path)
+        if (dataset_id := self.paths.get(path)) is None:
+            return
+        with self._lock:
+            self._pending[path] = dataset_id
+            if self._timer is None:
+                self._timer = Timer(self.debounce, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
 
-if __name__ == "__main__":
-    listener = Listener(warehouse=None)
-    listener()
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+        # only one batch is handed to the warehouse at a time
+        with self._flush_lock:
+            for path, dataset_id in pending.items():
+                self.warehouse.status_was_updated(path, dataset_id)
@@ -27,6 +27,7 @@ from datasm.util import get_first_nc_file
 from datasm.util import ensure_status_file_for_dsid
 from datasm.util import get_UTC_TS
 from datasm.util import tss
+from datasm.spec import load_spec
 
 helptext = '''
     Usage: dsmgen_cmip <runmode> <file_of_cmip6_dataset_ids> [--dryrun] [alternate_dataset_spec.yaml]
@@ -294,19 +295,8 @@ def get_metadata_file_version(metadata):
         return json_in["version"]
 
 def get_sim_years(dsid: str, altspec: str):
-    dsm_paths = get_dsm_paths()
-    if altspec:
-        spec_path = altspec
-    else:
-        resource_path = dsm_paths['STAGING_RESOURCE']
-        spec_path = os.path.join(resource_path, 'dataset_spec.yaml')
-
-    with open(spec_path, 'r') as instream:
-        dataset_spec = yaml.load(instream, Loader=yaml.SafeLoader)
-    dc = dsid.split(".")
-    the_experiment_record = dataset_spec['project'][dc[0]][dc[1]][dc[2]]
-
-    return the_experiment_record['start'], the_experiment_record['end']
+    # parsed once, then looked up for every dsid
+    return load_spec(altspec or None).year_range(dsid)
 
 def get_namefile(dsid: str):
     headpart = dsid.split('.')[0:6]
@@ -792,6 +782,7 @@ for segspec in segment_specs:
     seg_cmdspec['segname'] = segname
     seg_cmdspec['seg_cmd'] = cmd_2
     seg_cmdspec['jobname'] = f"e2c_{caseid}_{{the_var_name}}_{{segname}}"
+    seg_cmdspec['outdir'] = "{result_dir}"
     cmd_2_group.append(seg_cmdspec)
 """
 
@@ -832,6 +823,7 @@ for segspec in segment_specs:
     seg_cmdspec['segname'] = segname
     seg_cmdspec['seg_cmd'] = cmd_2
     seg_cmdspec['jobname'] = f"e2c_{caseid}_{{the_var_name}}_{{segname}}"
+    seg_cmdspec['outdir'] = "{result_dir}"
     cmd_2_group.append(seg_cmdspec)
 """
             fappend(escript, f"{DynaCode_4_NON_MPAS}")
@@ -1,11 +1,12 @@
 from esgcet.pub_client import publisherClient
 import sys
-import json
-import requests
 import argparse
 import configparser as cfg
 from pathlib import Path
+from urllib.parse import parse_qsl
 from datasm.util import con_message
+from datasm import esgf_cache
+from datasm.esgf import ESGFSearchError, get_client
 
 
 DEFAULT_INDEX_NODE = "esgf-node.llnl.gov"
@@ -66,8 +67,10 @@ def main():
     parser.add_argument(
         "--verbose", action="store_true", help="Print more verbose status messages"
     )
+    esgf_cache.add_cache_args(parser)
 
     args = parser.parse_args()
+    esgf_cache.configure(enabled=not args.no_cache, refresh=args.refresh)
 
     if args.cert:
         cert_path = args.cert
@@ -84,19 +87,18 @@ def main():
         key, value = item.split("=")
         facets[key] = value
 
-    # url = f"https://{index_node}/esg-search/search/?offset=0&limit=10000&type=Dataset&format=application%2Fsolr%2Bjson&latest=true&{search}"
-    url = f"https://{index_node}/esg-search/search/?offset=0&limit=10000&type=Dataset&format=application%2Fsolr%2Bjson&{search}"
+    # same as the search URL "...&type=Dataset&{search}", without the latest=true filter
+    search_facets = {}
+    for key, value in parse_qsl(search, keep_blank_values=True):
+        search_facets.setdefault(key, []).append(value)
     if verbose:
-        con_message("info", url)
-    res = requests.get(url)
-
-    if not res.status_code == 200:
-        con_message("error", f"query return code: {res.status_code}")
+        con_message("info", f"searching {index_node} for {search_facets}")
+    try:
+        docs = get_client(index_node).search(search_facets, qtype="Dataset", latest=None)
+    except ESGFSearchError as e:
+        con_message("error", f"query failed: {e}")
         return 1
 
-    res = json.loads(res.text)
-
-    docs = res["response"]["docs"]
     if len(docs) == 0:
         con_message("warning", f"Unable to find records matching search {search}")
         return 1
@@ -132,6 +134,8 @@ def main():
         if verbose:
             con_message("info", f"update_record = {update_record}")
         client.update(update_record)
+        # the cached search results for this dataset no longer match the index
+        esgf_cache.invalidate(dataset_id)
 
         rec_count += 1
 
@@ -7,6 +7,7 @@ from subprocess import Popen
 from tempfile import TemporaryDirectory
 from datasm.util import con_message, log_message
 from datasm.util import search_esgf
+from datasm import esgf_cache
 
 
 def parse_args():
@@ -28,6 +29,7 @@ def parse_args():
         default=default_log_path,
         help=f"Path where to store publisher logs, default = {default_log_path}",
     )
+    esgf_cache.add_cache_args(parser)
     return parser.parse_args()
 
 
@@ -115,11 +117,16 @@ def publish_dataset(args):
 
         log_message("info", f"{__name__}: Return code {str(proc.returncode)} on cmd: {cmd}")
 
+        if proc.returncode == 0:
+            # anything cached about this dataset is now out of date
+            esgf_cache.invalidate(dataset_id)
+
         return proc.returncode
 
 
 def main():
     parsed_args = parse_args()
+    esgf_cache.configure(enabled=not parsed_args.no_cache, refresh=parsed_args.refresh)
 
     if not validate_args(parsed_args):
         sys.exit(1)
@@ -6,10 +6,13 @@ from time import sleep
 import json
 import os
 import stat
+from tempfile import mkstemp
+from datasm.executor import Executor, script_options
+from datasm.slurm_poller import get_poller
 from datasm.util import print_debug, log_message
 
 
-class Slurm(object):
+class Slurm(Executor):
     """
     A python interface for slurm using subprocesses
     """
@@ -26,23 +29,6 @@ class Slurm(object):
 
     # -----------------------------------------------
 
-    def render_script(self, cmd, script_path, slurm_opts=[], **kwargs):
-        """
-        Write out an executable bash script
-        Parameters:
-            cmd (string) : a bash command to run
-            script_path (string) : the path to where to store the sbatch script
-            slurm_opts List[(str, str)] : a list of slurm argument key value pairs
-        """
-
-        with open(script_path, "w") as outstream:
-            outstream.write("#!/bin/bash\n\n")
-            for key, val in slurm_opts:
-                outstream.write(f"#SBATCH {key} {val}\n")
-            outstream.write(cmd + "\n")
-        st = os.stat(script_path)
-        os.chmod(script_path, st.st_mode | stat.S_IEXEC)
-
     def sbatch(self, cmd, sbatch_args=None):
         """
         Submit to the batch queue in non-interactive mode
@@ -77,6 +63,58 @@ class Slurm(object):
 
     # -----------------------------------------------
 
+    def sbatch_array(self, scripts, name="array"):
+        """
+        Submit rendered scripts that ask for the same resources as one job array.
+
+        The path of each script and its "-o" output file go one per line into
+        a parameter file next to the first script, and array task N runs the
+        script on line N+1 with its output going where it would have if the
+        script had been submitted by itself. Each script still writes its own
+        STAT line to its datasets status file.
+
+        Parameters:
+            scripts (List[str]): paths to the rendered scripts, from WorkflowJob.prepare
+            name (str): the job name of the array
+        Returns:
+            the job id of each task, "<array id>_<index>", in the same order as scripts
+        """
+        if len(scripts) == 1:
+            return [self.sbatch(scripts[0])]
+
+        options = script_options(scripts[0])
+        outdir = Path(scripts[0]).parent
+        fd, array_script = mkstemp(prefix=f"{name}-array-", suffix=".sh", dir=outdir)
+        os.close(fd)
+        params_path = Path(array_script).with_suffix(".params")
+
+        with open(params_path, "w") as outstream:
+            for script in scripts:
+                script_opts = script_options(script)
+                output = script_opts.get("-o") or script_opts.get("--output") or f"{Path(script).with_suffix('')}.out"
+                outstream.write(f"{script}\t{output}\n")
+
+        array_opts = [
+            (key, val) for key, val in options.items()
+            if key not in ("-o", "--output", "-J", "--job-name", "--array", "-a")
+        ]
+        array_opts.extend([
+            ("-J", name),
+            ("--array", f"0-{len(scripts) - 1}"),
+            ("-o", str(Path(array_script).with_suffix("")) + "-%a.out"),
+        ])
+        cmd = f"""IFS=$'\\t' read -r script output < <(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {params_path})
+bash "$script" >> "$output" 2>&1"""
+        self.render_script(cmd, array_script, array_opts)
+
+        array_id = self.sbatch(array_script)
+        if not array_id:
+            return [array_id] * len(scripts)
+        log_message("info", f"Slurm: submitted {len(scripts)} {name} jobs as array {array_id}")
+        return [f"{array_id}_{index}" for index in range(len(scripts))]
+
+    # -----------------------------------------------
+
     def _submit(self, subtype, cmd, sargs=None):
 
         cmd = [subtype, cmd, sargs] if sargs is not None else [subtype, cmd]
@@ -92,7 +130,7 @@ class Slurm(object):
                 tries += 1
                 sleep(tries * 2)
 
-                qinfo = self.queue()
+                qinfo = get_poller().queue(max_age=0)
                 for job in qinfo:
                     if job.get("COMMAND") == cmd[1]:
                         return "Submitted batch job {}".format(job["JOBID"]), None
@@ -107,7 +145,7 @@ class Slurm(object):
 
     def showjob(self, jobid):
         """
-        A wrapper around scontrol show job
+        Look a job up in the shared pollers cached squeue and sacct states
 
         Parameters:
             jobid (str): the job id to get information about
@@ -116,39 +154,17 @@ class Slurm(object):
         """
         if not isinstance(jobid, str):
             jobid = str(jobid)
-        success = False
-        while not success:
-            try:
-                proc = Popen(
-                    ["scontrol", "show", "job", jobid],
-                    shell=False,
-                    stderr=PIPE,
-                    stdout=PIPE,
-                )
-                out, err = proc.communicate()
-                out = out.decode("utf-8")
-                if err:
-                    err = err.decode("utf-8")
-                    print_debug(err, status="err")
-                    if err == "slurm_load_jobs error: Invalid job id specified":
-                        raise ValueError(f"Unable to find slurm job with id {jobid}")
-                    sleep(1)
-                else:
-                    success = True
-            except:
-                success = False
-                sleep(1)
+        poller = get_poller()
+        record = next((x for x in poller.queue() if x["JOBID"] == jobid), None)
+        if record is None:
+            if (record := poller.job(jobid)) is None:
+                raise ValueError(f"Unable to find slurm job with id {jobid}")
+            record = dict(record, RUNTIME=record["ELAPSED"])
 
         job_info = JobInfo()
-        for item in out.split("\n"):
-            for j in item.split(" "):
-                index = j.find("=")
-                if index <= 0:
-                    continue
-                attribute = self.slurm_to_jobinfo(j[:index])
-                if attribute is None:
-                    continue
-                job_info.set_attr(attr=attribute, val=j[index + 1 :])
+        for attribute in ["JOBID", "NAME", "STATE", "PARTITION", "USER", "RUNTIME", "COMMAND"]:
+            if attribute in record:
+                job_info.set_attr(attr=attribute, val=record[attribute])
         return job_info
 
     # -----------------------------------------------
@@ -194,44 +210,11 @@ class Slurm(object):
 
     def queue(self):
         """
-        Get job queue status
+        Get job queue status, from the shared poller so that squeue runs at most once an interval
 
         Returns: list of jobs in the queue
         """
-        tries = 0
-        while tries != 10:
-            try:
-                cmd = ["squeue", "-u", os.environ["USER"], "-o", "%i|%j|%o|%t"]
-                proc = Popen(cmd, shell=False, stderr=PIPE, stdout=PIPE)
-                out, err = proc.communicate()
-                out = out.decode("utf-8")
-                err = err.decode("utf-8")
-                if err or not out:
-                    tries += 1
-                    sleep(tries)
-                    print(err)
-                else:
-                    break
-            except:
-                sleep(1)
-        if tries == 10:
-            raise Exception("SLURM ERROR: Unable to communicate with squeue")
-            os._exit(1)
-
-        queueinfo = []
-        for item in out.split(b"\n")[1:]:
-            if not item:
-                break
-            line = [x for x in item.split(b"|") if x]
-            queueinfo.append(
-                {
-                    "JOBID": line[0],
-                    "NAME": line[1],
-                    "COMMAND": line[2],
-                    "STATE": line[3],
-                }
-            )
-        return queueinfo
+        return get_poller().queue()
 
     # -----------------------------------------------
 
@@ -249,6 +232,7 @@ class Slurm(object):
                     tries += 1
                     sleep(tries)
                 else:
+                    get_poller().invalidate()
                     return True
             except Exception as e:
                 print_debug(e)
@@ -324,21 +308,21 @@ class JobInfo(object):
 
     @property
     def state(self):
-        return self.state
+        return self._state
 
     # -----------------------------------------------
 
     @state.setter
     def state(self, state):
         if state in ["Q", "W", "PD", "PENDING"]:
-            self.state = "PENDING"
+            self._state = "PENDING"
         elif state in ["R", "RUNNING"]:
-            self.state = "RUNNING"
+            self._state = "RUNNING"
         elif state in ["E", "CD", "CG", "COMPLETED", "COMPLETING"]:
-            self.state = "COMPLETED"
+            self._state = "COMPLETED"
         elif state in ["FAILED", "F"]:
-            self.state = "FAILED"
+            self._state = "FAILED"
         else:
-            self.state = state
+            self._state = state
 
     # -----------------------------------------------
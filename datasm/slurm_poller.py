@@ -0,0 +1,214 @@
+import os
+import subprocess
+import threading
+import time
+
+
+DEFAULT_INTERVAL = float(os.environ.get("DATASM_SLURM_POLL_INTERVAL", 10))
+
+SQUEUE_FORMAT = "%i|%j|%o|%t|%P|%u|%M"
+SQUEUE_FIELDS = ["JOBID", "NAME", "COMMAND", "STATE", "PARTITION", "USER", "RUNTIME"]
+SACCT_FORMAT = "JobID,JobName,State,ElapsedRaw,ExitCode,Reason,Partition,User,NodeList"
+SACCT_FIELDS = ["JOBID", "NAME", "STATE", "ELAPSED", "EXITCODE", "REASON", "PARTITION", "USER", "NODES"]
+
+_poller = None
+
+
+class SlurmPoller(object):
+    """
+    Keeps the state of the slurm jobs datasm cares about, so that asking
+    about a job doesnt cost a squeue, scontrol or sacct call of its own.
+
+    Jobs are tracked by id or by name. Once the cached states are older than
+    interval seconds, the next question about a job runs a single sacct for
+    every tracked id and a single sacct for every tracked name, and the
+    answers come from the parsed result until it is stale again. The squeue
+    listing of the users queue is cached the same way. A job that was
+    tracked since the last query forces a new one, so it is never reported
+    missing just because it hasnt been asked about yet. If sacct cant be
+    reached the previous states are kept, and the next question tries again.
+
+    slurm is queried outside the lock that guards the cached states, one
+    query at a time. While one is running, callers asking about jobs that
+    are already known get the cached state instead of waiting for it.
+
+    Parameters:
+        interval (float): the most often, in seconds, slurm is asked for job states
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._query_lock = threading.Lock()
+        self._ids = set()
+        self._names = set()
+        self._unseen = set()
+        self._by_id = {}
+        self._by_name = {}
+        self._sacct_time = 0
+        self._queue = []
+        self._queue_time = 0
+
+    def track(self, job_id=None, name=None):
+        """
+        Include a job id and/or job name in the batched sacct queries
+        """
+        with self._lock:
+            if job_id is not None:
+                job_id = str(job_id)
+                if job_id not in self._ids:
+                    self._ids.add(job_id)
+                    self._unseen.add(("id", job_id))
+            if name is not None and name not in self._names:
+                self._names.add(name)
+                self._unseen.add(("name", name))
+
+    def untrack(self, job_id=None, name=None):
+        """
+        Stop asking about a job, for example once its finished and been tallied
+        """
+        with self._lock:
+            if job_id is not None:
+                self._ids.discard(str(job_id))
+                self._unseen.discard(("id", str(job_id)))
+                self._by_id.pop(str(job_id), None)
+            if name is not None:
+                self._names.discard(name)
+                self._unseen.discard(("name", name))
+                self._by_name.pop(name, None)
+
+    def job(self, job_id, max_age=None):
+        """
+        Returns the sacct record of a job id, as a dict with the SACCT_FIELDS
+        keys, or None if slurm doesnt know about it
+        """
+        job_id = str(job_id)
+        self.track(job_id=job_id)
+        self._refresh(("id", job_id), max_age)
+        return self._by_id.get(job_id)
+
+    def job_by_name(self, name, max_age=None):
+        """
+        Returns the sacct record of the latest job with the given name, or None
+        """
+        self.track(name=name)
+        self._refresh(("name", name), max_age)
+        return self._by_name.get(name)
+
+    def queue(self, max_age=None):
+        """
+        Returns the users pending and running jobs from squeue, as dicts with the SQUEUE_FIELDS keys
+        """
+        max_age = self.interval if max_age is None else max_age
+        with self._query_lock:
+            if time.monotonic() - self._queue_time >= max_age:
+                queue = self._squeue()
+                with self._lock:
+                    self._queue = queue
+                    self._queue_time = time.monotonic()
+            return list(self._queue)
+
+    def invalidate(self):
+        """
+        Forget the cached states, so the next question asks slurm again
+        """
+        with self._lock:
+            self._sacct_time = 0
+            self._queue_time = 0
+
+    def _stale(self, key, max_age):
+        with self._lock:
+            return key in self._unseen or time.monotonic() - self._sacct_time >= max_age
+
+    def _refresh(self, key, max_age):
+        max_age = self.interval if max_age is None else max_age
+        if not self._stale(key, max_age):
+            return
+        if not self._query_lock.acquire(blocking=key in self._unseen):
+            # someone else is already asking, the cached state will do until they are done
+            return
+        try:
+            # the query we waited on may have answered for us
+            if not self._stale(key, max_age):
+                return
+            with self._lock:
+                ids, names = set(self._ids), set(self._names)
+
+            by_id = by_name = None
+            if ids and (records := self._sacct(["-j", ",".join(sorted(ids))])) is not None:
+                by_id = {}
+                for record in records:
+                    job_id = record["JOBID"]
+                    if job_id in ids:
+                        by_id[job_id] = record
+                    elif (parent := job_id.split(".")[0]) in ids:
+                        # only the steps of the job came back
+                        by_id.setdefault(parent, record)
+            if names and (records := self._sacct([f"--name={','.join(sorted(names))}"])) is not None:
+                by_name = {}
+                for record in records:
+                    # like sacct --name for a single job, the last record for a name wins
+                    if record["NAME"] in names:
+                        by_name[record["NAME"]] = record
+
+            with self._lock:
+                failed = (ids and by_id is None) or (names and by_name is None)
+                # keep what we knew about jobs a failed query couldnt answer for
+                if by_id is not None:
+                    self._by_id = {x: y for x, y in by_id.items() if x in self._ids}
+                    self._unseen -= {("id", x) for x in ids}
+                if by_name is not None:
+                    self._by_name = {x: y for x, y in by_name.items() if x in self._names}
+                    self._unseen -= {("name", x) for x in names}
+                # after a failure the cached states are stale, so the next question asks again
+                self._sacct_time = 0 if failed else time.monotonic()
+        finally:
+            self._query_lock.release()
+
+    @staticmethod
+    def _run(cmd, tries=10):
+        from datasm.util import log_message
+
+        for attempt in range(1, tries + 1):
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True)
+            except OSError as e:
+                log_message("error", f"SlurmPoller: unable to run {cmd[0]}: {repr(e)}")
+                return None
+            if result.returncode == 0 and not result.stderr:
+                return result.stdout
+            log_message("warning", f"SlurmPoller: {cmd[0]} failed, attempt {attempt} of {tries}: {result.stderr.strip()}")
+            time.sleep(attempt)
+        return None
+
+    def _sacct(self, selection):
+        # None if sacct couldnt be run, so callers can tell that apart from no jobs
+        out = self._run(
+            ["sacct", *selection, "-P", "--noheader", "--delimiter=|", f"--format={SACCT_FORMAT}"], tries=3)
+        if out is None:
+            return None
+        return [
+            dict(zip(SACCT_FIELDS, line.split("|")))
+            for line in out.splitlines()
+            if line.strip()
+        ]
+
+    def _squeue(self):
+        out = self._run(["squeue", "-u", os.environ["USER"], "-h", "-o", SQUEUE_FORMAT])
+        if out is None:
+            raise Exception("SLURM ERROR: Unable to communicate with squeue")
+        return [
+            dict(zip(SQUEUE_FIELDS, line.split("|")))
+            for line in out.splitlines()
+            if line.strip()
+        ]
+
+
+def get_poller():
+    """
+    Returns the process wide SlurmPoller
+    """
+    global _poller
+    if _poller is None:
+        _poller = SlurmPoller()
+    return _poller
@@ -0,0 +1,320 @@
+import fnmatch
+import hashlib
+import os
+import pickle
+import re
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+# where the parsed copies of the spec files are kept, set DATASM_SPEC_CACHE=off to not keep them
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get("XDG_CACHE_HOME", Path(Path.home(), ".cache")), "datasm", "spec"
+)
+SPEC_CACHE = os.environ.get("DATASM_SPEC_CACHE") or DEFAULT_CACHE_DIR
+
+# bump this when the pickled layout changes
+CACHE_FORMAT = 1
+
+# parsed specs for this process, by absolute path
+_specs = {}
+
+
+def load_yaml(path):
+    """
+    Parse a yaml file with the libyaml based loader when pyyaml was built with it
+    """
+    with open(path, "r") as instream:
+        return yaml.load(instream, Loader=SafeLoader)
+
+
+def default_spec_path():
+    """
+    The dataset_spec.yaml under the STAGING_RESOURCE path
+    """
+    from datasm.util import get_dsm_paths
+
+    return os.path.join(get_dsm_paths()["STAGING_RESOURCE"], "dataset_spec.yaml")
+
+
+class DatasetSpec(dict):
+    """
+    A parsed dataset_spec, used exactly like the dict yaml.load returns, plus
+    lookup tables built once for the questions that get asked per dataset:
+
+        experiments: (project, <facets>..., experiment) -> experiment record, where the
+            facets are (model_version,) for E3SM and (activity, institution, source_id) for CMIP6
+        cmip_cases: (model_version, experiment) -> the cmip_case of an E3SM experiment
+        ts_variables: realm -> the time-series variables of the realm
+    """
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.experiments = {}
+        self.cmip_cases = {}
+
+        for model_version, experiments in self.get("project", {}).get("E3SM", {}).items():
+            for experiment, record in experiments.items():
+                self.experiments[("E3SM", model_version, experiment)] = record
+                if cmip_case := record.get("cmip_case"):
+                    self.cmip_cases[(model_version, experiment)] = cmip_case
+
+        for activity, institutions in self.get("project", {}).get("CMIP6", {}).items():
+            for institution, sources in institutions.items():
+                for source_id, experiments in sources.items():
+                    for experiment, record in experiments.items():
+                        self.experiments[("CMIP6", activity, institution, source_id, experiment)] = record
+
+        self.ts_variables = self.get("time-series", {})
+        self._catalogs = {}
+
+    def experiment(self, dsid):
+        """
+        Returns the experiment record for a dataset_id, or None if its not in the spec
+        """
+        facets = dsid.split(".")
+        if facets[0] == "E3SM":
+            return self.experiments.get(tuple(facets[:3]))
+        if facets[0] == "CMIP6":
+            return self.experiments.get(tuple(facets[:5]))
+        return None
+
+    def year_range(self, dsid):
+        """
+        Returns the (start, end) years of the experiment of a dataset_id
+        """
+        if (record := self.experiment(dsid)) is None:
+            raise KeyError(dsid)
+        return record["start"], record["end"]
+
+    def time_series_variables(self, model_version, experiment, realm):
+        """
+        Returns the time-series variables of a realm, leaving out any the experiment excepts
+        """
+        realm_vars = self.ts_variables[realm]
+        exclude = self.experiments[("E3SM", model_version, experiment)].get("except")
+        if exclude:
+            return [x for x in realm_vars if x not in exclude]
+        return realm_vars
+
+    def cmip6_dataset_ids(self, testing=False):
+        """
+        Yield the dataset_id of every CMIP6 dataset in the spec
+        """
+        for activity_name, activity_val in self["project"]["CMIP6"].items():
+            if activity_name == "test" and not testing:
+                continue
+            for institution_id, institution_branch in activity_val.items():
+                for version_name, version_value in institution_branch.items():    # version_name is CMIP6 Source_ID
+                    for experimentname, experimentvalue in version_value.items():
+                        for ensemble in experimentvalue["ens"]:
+                            for table_name, table_value in self["tables"].items():
+                                for variable in table_value:
+                                    if (
+                                        variable in experimentvalue["except"]
+                                        or table_name in experimentvalue["except"]
+                                        or variable == "all"
+                                    ):
+                                        continue
+                                    yield f"CMIP6.{activity_name}.{institution_id}.{version_name}.{experimentname}.{ensemble}.{table_name}.{variable}.gr"
+
+    def e3sm_dataset_ids(self, testing=False):
+        """
+        Yield the dataset_id of every E3SM dataset in the spec
+        """
+        for version, experiments in self["project"]["E3SM"].items():
+            if version == "test" and not testing:
+                continue
+            for experiment, experimentinfo in experiments.items():
+                for ensemble in experimentinfo["ens"]:
+                    for res in experimentinfo["resolution"]:
+                        for comp in experimentinfo["resolution"][res]:
+                            for item in experimentinfo["resolution"][res][comp]:
+                                for data_type in item["data_types"]:
+                                    if item.get("except") and data_type in item["except"]:
+                                        continue
+                                    yield f"E3SM.{version}.{experiment}.{res}.{comp}.{item['grid']}.{data_type}.{ensemble}"
+
+    def catalog(self, testing=False):
+        """
+        Returns the DatasetCatalog of every dataset_id in the spec, CMIP6 first
+        """
+        if (catalog := self._catalogs.get(testing)) is None:
+            catalog = self._catalogs[testing] = DatasetCatalog(
+                list(self.cmip6_dataset_ids(testing)) + list(self.e3sm_dataset_ids(testing))
+            )
+        return catalog
+
+
+class _FacetNode(object):
+    """
+    One facet in a DatasetCatalog tree, with the catalog positions of the
+    dataset_ids that end here, and the fewest and most facets left in the
+    dataset_ids that pass through it
+    """
+
+    __slots__ = ("children", "ends", "min_depth", "max_depth")
+
+    def __init__(self):
+        self.children = {}
+        self.ends = []
+        self.min_depth = None
+        self.max_depth = None
+
+
+class DatasetCatalog(object):
+    """
+    A list of dataset_ids, also kept as a tree of their facets so that
+    patterns can be resolved one facet at a time.
+
+    match() gives the same result as fnmatch.filter over the whole list, but
+    only visits the branches the pattern can reach. Literal parts of the
+    pattern are looked up directly, and wildcard parts are matched against
+    one facet at a time, as long as every dataset_id under the branch has
+    exactly one facet per remaining part of the pattern (so a "*" can't
+    stand in for several facets). Otherwise the rest of the pattern is
+    matched against the dataset_ids under the branch, so
+    "E3SM.2_0.*.*.atmos.*" only looks at the 2_0 datasets
+    """
+
+    def __init__(self, dataset_ids):
+        self.ids = dataset_ids
+        self.tree = _FacetNode()
+        for position, dataset_id in enumerate(dataset_ids):
+            facets = dataset_id.split(".")
+            node = self.tree
+            path = [node]
+            for facet in facets:
+                node = node.children.get(facet) or node.children.setdefault(facet, _FacetNode())
+                path.append(node)
+            node.ends.append(position)
+            for depth, node in enumerate(path):
+                left = len(facets) - depth
+                if node.min_depth is None or left < node.min_depth:
+                    node.min_depth = left
+                if node.max_depth is None or left > node.max_depth:
+                    node.max_depth = left
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _positions(node):
+        """
+        The catalog positions of the dataset_ids under a branch, not counting the ones that end at it
+        """
+        stack = list(node.children.values())
+        while stack:
+            node = stack.pop()
+            yield from node.ends
+            stack.extend(node.children.values())
+
+    def match(self, pattern):
+        """
+        Returns the dataset_ids that match a glob pattern, in catalog order
+        """
+        full_match = re.compile(fnmatch.translate(pattern)).match
+        if "[" in pattern:
+            # a bracket expression can match a "." so the parts dont line up with the facets
+            return [x for x in self.ids if full_match(x)]
+
+        segments = pattern.split(".")
+        last = len(segments) - 1
+        matches = set()
+
+        def match_rest(node, depth):
+            if segments[depth:] == ["*"]:
+                matches.update(self._positions(node))
+            else:
+                matches.update(i for i in self._positions(node) if full_match(self.ids[i]))
+
+        def walk(node, depth):
+            parts = last - depth + 1
+            if node.max_depth is None or parts > node.max_depth:
+                # more parts left in the pattern than facets in the dataset_ids
+                return
+            segment = segments[depth]
+            if not any(x in segment for x in "*?"):
+                # a literal part can only match a whole facet
+                if (child := node.children.get(segment)) is not None:
+                    if depth == last:
+                        matches.update(child.ends)
+                    else:
+                        walk(child, depth + 1)
+            elif node.min_depth == node.max_depth == parts:
+                facet_match = re.compile(fnmatch.translate(segment)).match
+                for facet, child in node.children.items():
+                    if segment == "*" or facet_match(facet):
+                        if depth == last:
+                            matches.update(child.ends)
+                        else:
+                            walk(child, depth + 1)
+            else:
+                match_rest(node, depth)
+
+        walk(self.tree, 0)
+        return [self.ids[x] for x in sorted(matches)]
+
+
+def _cache_path(path):
+    return Path(SPEC_CACHE, hashlib.sha256(str(path).encode()).hexdigest() + ".pickle")
+
+
+def _read_cache(path, stamp):
+    try:
+        with open(_cache_path(path), "rb") as instream:
+            cached = pickle.load(instream)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if cached.get("format") != CACHE_FORMAT or cached.get("stamp") != stamp:
+        return None
+    return cached["data"]
+
+
+def _write_cache(path, stamp, data):
+    cache_path = _cache_path(path)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a reader never sees half a file
+        with NamedTemporaryFile("wb", dir=cache_path.parent, delete=False) as outstream:
+            pickle.dump({"format": CACHE_FORMAT, "stamp": stamp, "data": data}, outstream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(outstream.name, cache_path)
+    except OSError:
+        pass
+
+
+def load_spec(path=None):
+    """
+    Load a dataset_spec file, the first time in a process from the on-disk
+    parsed copy if the file hasnt changed since it was made, and every time
+    after that from memory
+
+    Parameters:
+        path (str): path to the spec, defaults to the dataset_spec.yaml under STAGING_RESOURCE
+    Returns:
+        DatasetSpec
+    """
+    path = os.path.abspath(path if path is not None else default_spec_path())
+    info = os.stat(path)
+    stamp = (info.st_mtime_ns, info.st_size)
+
+    if (known := _specs.get(path)) is not None and known[0] == stamp:
+        return known[1]
+
+    use_cache = str(SPEC_CACHE) != "off"
+    data = _read_cache(path, stamp) if use_cache else None
+    if data is None:
+        data = load_yaml(path)
+        if use_cache:
+            _write_cache(path, stamp, data)
+
+    spec = DatasetSpec(data)
+    _specs[path] = (stamp, spec)
+    return spec
@@ -0,0 +1,271 @@
+import os
+import sqlite3
+from pathlib import Path
+
+
+non_binding_status = ["Blocked:", "Unblocked:", "Approved:", "Unapproved:"]
+
+
+def parse_status_line(line):
+    """
+    Split a status line of the form "STAT:ts:MAJOR:minor:message..." into
+    its parts
+
+    Returns:
+        (timestamp, major, minor, message) for STAT lines, otherwise None
+    """
+    line_info = line.split(":")
+    if line_info[0] != "STAT" or len(line_info) < 4:
+        return None
+    return line_info[1], line_info[2], line_info[3], ":".join(line_info[4:])
+
+
+class StatusFileReader(object):
+    """
+    Incremental reader for a dataset status file.
+
+    Status files are append-only, so the reader remembers the inode and the
+    byte offset it last parsed up to, and on each call to read() only returns
+    the complete lines that have been appended since. If the file is replaced
+    (new inode) or truncated, the reader starts again from the top and
+    reports that it was reset. After each read(), line_offsets holds the
+    byte offset in the file where each of the returned lines starts.
+    """
+
+    def __init__(self, path, offset=0, inode=None):
+        self.path = Path(path)
+        self.offset = offset
+        self.inode = inode
+        self.line_offsets = []
+
+    def read(self):
+        """
+        Returns:
+            (reset, lines) where reset is True if the file was re-read from
+            the start, and lines is the list of new complete lines
+        """
+        self.line_offsets = []
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False, []
+
+        reset = False
+        if self.inode != st.st_ino or st.st_size < self.offset:
+            reset = self.inode is not None
+            self.inode = st.st_ino
+            self.offset = 0
+
+        if st.st_size == self.offset:
+            return reset, []
+
+        with open(self.path, "rb") as instream:
+            instream.seek(self.offset)
+            chunk = instream.read()
+
+        # a writer may be part way through a line, leave it for the next read
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return reset, []
+
+        lines = []
+        start = self.offset
+        for raw in chunk[:end].split(b"\n"):
+            if raw:
+                lines.append(raw.decode("utf-8", errors="replace"))
+                self.line_offsets.append(start)
+            start += len(raw) + 1
+        self.offset += end + 1
+        return reset, lines
+
+
+class SQLiteStatusStore(object):
+    """
+    A transactional SQLite store for dataset status lines, keyed by
+    dataset_id, timestamp and major/minor state.
+
+    The per-dataset .status files remain the source of truth (the slurm job
+    scripts append to them directly), the store keeps a copy of every line
+    so that questions across many datasets can be answered with one indexed
+    query. Lines keep the "STAT:ts:MAJOR:minor:..." format, and can be
+    written back out to flat files with export().
+
+    Lines read from a status file are keyed by their byte offset in it, so
+    the same line read twice is stored once while a line that legitimately
+    repeats is kept every time it appears.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS status (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            dataset_id TEXT NOT NULL,
+            offset INTEGER,
+            timestamp TEXT,
+            major TEXT,
+            minor TEXT,
+            message TEXT,
+            line TEXT NOT NULL,
+            UNIQUE (dataset_id, offset))""",
+        "CREATE INDEX IF NOT EXISTS status_by_dataset ON status (dataset_id, timestamp)",
+        """CREATE TABLE IF NOT EXISTS latest (
+            dataset_id TEXT PRIMARY KEY,
+            timestamp TEXT,
+            major TEXT,
+            minor TEXT,
+            message TEXT)""",
+        "CREATE INDEX IF NOT EXISTS latest_by_state ON latest (major, minor)",
+        """CREATE TABLE IF NOT EXISTS offsets (
+            dataset_id TEXT PRIMARY KEY,
+            inode INTEGER,
+            offset INTEGER)""",
+    ]
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._conn = None
+
+    def __getstate__(self):
+        # connections cant cross process boundaries, each process opens its own
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        return state
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            with self._conn:
+                for statement in self.SCHEMA:
+                    self._conn.execute(statement)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add_lines(self, dataset_id, lines, offsets=None, reset=False):
+        """
+        Append status file lines for a dataset in a single transaction
+
+        Parameters:
+            offsets (list): the byte offset of each line in the status file, lines
+                already stored at the same offset are ignored. Lines without an
+                offset are always appended
+            reset (bool): the status file was replaced or truncated, drop what
+                was stored for the dataset before adding the lines
+        """
+        if offsets is None:
+            offsets = [None] * len(lines)
+        rows = []
+        latest = None
+        for line, offset in zip(lines, offsets):
+            parsed = parse_status_line(line)
+            if parsed is None:
+                rows.append((dataset_id, offset, None, None, None, None, line))
+                continue
+            timestamp, major, minor, message = parsed
+            rows.append((dataset_id, offset, timestamp, major, minor, message, line))
+            if message in non_binding_status:
+                continue
+            if latest is None or timestamp >= latest[1]:
+                latest = (dataset_id, timestamp, major, minor, message)
+
+        with self.conn as conn:
+            if reset:
+                conn.execute("DELETE FROM status WHERE dataset_id = ?", (dataset_id,))
+                conn.execute("DELETE FROM latest WHERE dataset_id = ?", (dataset_id,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO status (dataset_id, offset, timestamp, major, minor, message, line) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if latest is not None:
+                conn.execute(
+                    "INSERT INTO latest (dataset_id, timestamp, major, minor, message) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (dataset_id) DO UPDATE SET "
+                    "timestamp=excluded.timestamp, major=excluded.major, "
+                    "minor=excluded.minor, message=excluded.message "
+                    "WHERE excluded.timestamp >= latest.timestamp",
+                    latest,
+                )
+
+    def ingest(self, dataset_id, path):
+        """
+        Copy any lines appended to a flat status file since the last ingest
+        into the store. Returns the number of new lines read.
+        """
+        row = self.conn.execute(
+            "SELECT inode, offset FROM offsets WHERE dataset_id = ?", (dataset_id,)
+        ).fetchone()
+        if row is None:
+            reader = StatusFileReader(path)
+        else:
+            reader = StatusFileReader(path, offset=row[1], inode=row[0])
+        reset, lines = reader.read()
+        if lines or reset:
+            self.add_lines(dataset_id, lines, reader.line_offsets, reset=reset)
+        with self.conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO offsets (dataset_id, inode, offset) VALUES (?, ?, ?)",
+                (dataset_id, reader.inode, reader.offset),
+            )
+        return len(lines)
+
+    def ingest_directory(self, status_root):
+        """
+        Ingest every <dataset_id>.status file in the given directory
+        """
+        count = 0
+        for entry in os.scandir(status_root):
+            if not entry.name.endswith(".status") or not entry.is_file():
+                continue
+            count += self.ingest(entry.name[: -len(".status")], entry.path)
+        return count
+
+    def lines(self, dataset_id):
+        return [
+            x[0]
+            for x in self.conn.execute(
+                "SELECT line FROM status WHERE dataset_id = ? ORDER BY seq", (dataset_id,)
+            )
+        ]
+
+    def latest(self, dataset_id):
+        """
+        Returns the latest binding "MAJOR:minor:message" for the dataset, or None
+        """
+        row = self.conn.execute(
+            "SELECT major, minor, message FROM latest WHERE dataset_id = ?", (dataset_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return ":".join(row)
+
+    def datasets_in_state(self, major, minor=None):
+        """
+        Returns the dataset_ids whose latest binding state is MAJOR:minor
+        """
+        if minor is None:
+            query, args = "SELECT dataset_id FROM latest WHERE major = ?", (major,)
+        else:
+            query, args = "SELECT dataset_id FROM latest WHERE major = ? AND minor = ?", (major, minor)
+        return sorted(x[0] for x in self.conn.execute(query, args))
+
+    def dataset_ids(self):
+        return [x[0] for x in self.conn.execute("SELECT DISTINCT dataset_id FROM status ORDER BY dataset_id")]
+
+    def export(self, dataset_id, path):
+        """
+        Write the stored lines for a dataset back out as a flat status file
+        """
+        with open(path, "w") as outstream:
+            for line in self.lines(dataset_id):
+                outstream.write(line + "\n")
+
+    def export_directory(self, status_root):
+        for dataset_id in self.dataset_ids():
+            self.export(dataset_id, Path(status_root, f"{dataset_id}.status"))
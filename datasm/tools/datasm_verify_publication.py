@@ -1,20 +1,25 @@
 import sys, os
 import json
+import asyncio
+import functools
 import argparse
 from argparse import RawTextHelpFormatter
 
 import traceback
 import inspect
 import logging
-import requests
 import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
 from subprocess import Popen, PIPE
 from pathlib import Path
 from datetime import datetime, timezone
 from termcolor import colored, cprint
 from datasm.util import get_dsm_paths
+from datasm import esgf_cache
+from datasm.esgf import ESGFSearchError, get_client
 
 
 # -----------------------------------------------
@@ -41,6 +46,13 @@ helptext = '''
         If the dataset is pub_root but appears unpublished, or other elements do not match,
             Then report "PUBLICATION:Verification_Fail:<reasons>" to the status file.
         If the dataset is NOT in pub_root, issue warnings but do not update the status file, irrespective of "-u".
+
+    With --async, up to --workers (default 16) dataset_ids are verified at once. The publication directories are
+    read by a thread pool while the ESGF queries wait for a free slot, and the results are reported in input order,
+    exactly as they would be without --async.
+
+    ESGF search results are cached on disk for DATASM_ESGF_CACHE_TTL seconds (default 3600).
+    --refresh ignores any cached results, --no-cache does not use the cache at all.
 '''
 
 dsm_paths = get_dsm_paths()
@@ -61,6 +73,9 @@ def assess_args():
     optional.add_argument('--data_node', action='store', dest="the_data_node", required=False, default="esgf-node.llnl.gov")
     optional.add_argument('--unrestricted', action='store_true', dest="unrestricted", required=False)
     optional.add_argument('--update-status', action='store_true', dest="updatestatus", required=False)
+    optional.add_argument('--async', action='store_true', dest="use_async", required=False)
+    optional.add_argument('--workers', action='store', dest="workers", type=int, required=False, default=16)
+    esgf_cache.add_cache_args(optional)
 
     args = parser.parse_args()
 
@@ -145,6 +160,17 @@ def load_file_lines(file_path):
 
 # -----------------------------------------------
 
+def report_search_error(message, errors=None):
+    """
+    Print a search error, or keep it for the caller to log when it was given an errors list
+    """
+    if errors is None:
+        print(f"ERROR: {message}")
+    else:
+        errors.append(message)
+
+# -----------------------------------------------
+
 def raw_search_esgf(
     facets,
     offset="0",
@@ -153,6 +179,7 @@ def raw_search_esgf(
     qtype="Dataset",
     fields="*",
     latest="true",
+    errors=None,
 ):
     """
     Make a search request to an ESGF node and return information about the datasets that match the search parameters
@@ -165,34 +192,19 @@ def raw_search_esgf(
         qtype (str)  : The query type, one of "Dataset" (default), "File" or "Aggregate"
         fields (str) : a comma-separated string of metadata field names, default '*' MUST be overridden.
         latest (str) : boolean (true/false not True/False) to search for only the latest version of a dataset
+        errors (list): if given, error messages are appended to it instead of printed
     """
 
     if fields == "*":
-        print("ERROR: Must specify string of one or more CSV fieldnames with fields=string")
+        report_search_error("Must specify string of one or more CSV fieldnames with fields=string", errors)
         return None
 
-    if len(facets):
-        url = f"https://{node}/esg-search/search/?offset={offset}&limit={limit}&type={qtype}&format=application%2Fsolr%2Bjson&latest={latest}&fields={fields}&{'&'.join([f'{k}={v}' for k,v in facets.items()])}"
-    else:
-        url = f"https://{node}/esg-search/search/?offset={offset}&limit={limit}&type={qtype}&format=application%2Fsolr%2Bjson&latest={latest}&fields={fields}"
-
-    # print(f"Executing URL: {url}")
-    req = requests.get(url)
-    # print(f"BIG_DEBUG: type req = {type(req)}, req.json()={req.json()}")
-    retcode = req.json()["responseHeader"]["status"]
-    # print(f"BIG_DEBUG: retcode = {retcode}")
-
-    if retcode != 0:
-        print(f"ERROR: ESGF search request returned status code: {retcode}")
+    try:
+        docs, numFound = get_client(node).search_page(facets, qtype=qtype, fields=fields, offset=offset, limit=limit, latest=latest)
+    except ESGFSearchError as e:
+        report_search_error(f"{e}", errors)
         return list(), 0
 
-    numFound = req.json()["response"]["numFound"]
-
-    docs = [
-        {k: v for k, v in doc.items()}
-        for doc in req.json()["response"]["docs"]
-    ]
-
     return docs, numFound
 
 # ----------------------------------------------
@@ -203,6 +215,7 @@ def safe_search_esgf(
     qtype="Dataset",
     fields="*",
     latest="true",
+    errors=None,
 ):
     """
     Make a search request to an ESGF node and return information about the datasets that match the search parameters
@@ -214,23 +227,18 @@ def safe_search_esgf(
         qtype (str)  : The query type, one of "Dataset" (default), "File" or "Aggregate"
         fields (str) : a comma-separated string of metadata field names, default '*' MUST be overridden.
         latest (str) : boolean (true/false not True/False) to search for only the latest version of a dataset
+        errors (list): if given, error messages are appended to it instead of printed
     """
 
     full_docs = list()
     full_found = 0
 
-    qlimit = 10000
-    curr_offset = 0
-
-    while True:
-        docs, numFound = raw_search_esgf(facets, offset=curr_offset, limit=f"{qlimit}", qtype=f"{qtype}", fields=f"{fields}", latest=f"{latest}")
-        # print(f"DEBUG: raw_search returned {len(docs)} records")
-        full_docs = full_docs + docs
-        full_found = full_found + numFound
-        if len(docs) < qlimit:
-            return full_docs, full_found
-        curr_offset += qlimit
-        # time.sleep(1)
+    try:
+        for docs, numFound in get_client().pages(facets, qtype=qtype, fields=fields, latest=latest):
+            full_docs.extend(docs)
+            full_found = numFound
+    except ESGFSearchError as e:
+        report_search_error(f"{e}", errors)
 
     return full_docs, full_found
 
@@ -292,148 +300,257 @@ def set_last_status_value(statfile,status_str):
 
 # -----------------------------------------------
 
-def main():
+def get_statfile(dsid, log):
+    ''' return the status file for dsid, or None if it has no status file entries '''
+    stat_root = Path(gv_stat_root)      # must do this per dsid - may encounter both internal and external dataset_ids
+    if is_dsid_external(dsid):
+        stat_root = Path(gv_stat_root_ext)
+
+    statname = f"{dsid}.status"
+    statfile = stat_root / statname
+    statents = load_file_lines(statfile)
+    if not statents:
+        log("error", f"datasm_verify_publication: No status file or status file entries in file: {statfile}")
+        return None
+    got_sfile = True
+    got_stats = len(get_last_status_value(statents)) > 0
+
+    log("info", f"Processing:{dsid}: statfile={got_sfile},stat_ents={got_stats}")
+    return statfile
+
+def inventory_publication(dsid, pub_root, log):
+    ''' return (p_ver, p_set, p_len) for the latest version of dsid in the publication directory '''
+    facet_path = Path(dsid.replace('.', '/'))
+    ds_path = pub_root / facet_path
+    dsp = f"{ds_path}"
+    p_set = set()
+    p_len = 0
+    p_ver = ""
+    if not os.path.exists(dsp):
+        log("warning", f"{dsid}: No dataset publication path exists {dsp}")
+    else:
+        v_list = next(os.walk(dsp))[1]
+        p_ver = maxversion(v_list)
+        if p_ver != "vNONE":
+            pub_path = ds_path / Path(p_ver)
+            pfiles = get_path_files(pub_path)
+            if not pfiles or len(pfiles) == 0:
+                log("warning", f"{dsid}: No dataset publication path files exist in {dsp}")
+            else:
+                p_set = set(pfiles)
+                p_len = len(p_set)
+    return p_ver, p_set, p_len
 
-    pargs = assess_args()
-    do_stats = pargs.updatestatus
+def dataset_query_facets(dsid, unrestricted):
+    ''' return (project, facets) for the ESGF Dataset query of dsid '''
+    # establish project
+    project = dsid.split(".")[0]
+    if project == "E3SM":
+        project = project.lower()       # required to satisfy esgf tables ...
+    add_facet = dict()
+    if project == "CMIP6" and not unrestricted:
+        institution = dsid.split(".")[2]
+        add_facet = { "institution_id": institution }
 
-    dsid_list = load_file_lines(pargs.thedsidlist)
+    facets = {"project": f"{project}", "master_id": dsid, "replica": "False"}
+    facets.update(add_facet)
+    return project, facets
+
+def choose_latest_record(dsid, docs, log):
+    ''' return the highest version record with latest=True, or None '''
+    if not docs:
+        reason = f"Dataset query returned empty docs"
+        log("error", f"{dsid}: {reason}")
+        return None
 
-    the_data_node = pargs.the_data_node
+    # ENSURE we are examining the highest version of "latest=True" ONLY.
+    latest_versions = list()
+    for record in docs:
+        log("info", f"DEBUG: Dataset Query returned version {record['version']}, {record['data_node']}, latest={record['latest']}")
+        if record['latest'] == True:
+            latest_versions.append(record['version'])
+    latest_versions.sort()
+    if len(latest_versions) < 1:
+        log("error", f"datasm_verify_publication: No 'latest=True' version for dataset {dsid}")
+        return None
+    max_latest_version = latest_versions[-1]
+    for record in docs:
+        if record['latest'] == True and record['version'] == max_latest_version:
+            best_record = record
+            break
+
+    log("info", f"DEBUG: Dataset Query returned data_node {best_record['data_node']} for best record")
+    return best_record
+
+def assess_files(dsid, version, docs, p_set, p_len, log):
+    ''' return the PUBLICATION status message comparing the ESGF file list to the publication files '''
+    if not docs:
+        reason = f"File query returned empty docs"
+        log("error", f"{dsid}: {reason}")
+        return None
 
-    # print(f"Found {len(dsid_list)} dataset ids.  do_stats = {do_stats}")
+    s_set = set({ f"{item['title']}" for item in docs })
+    s_len = len(s_set)
 
-    pub_root = Path(gv_pub_root)
-    
-    for dsid in dsid_list:
-
-        stat_root = Path(gv_stat_root)      # must do this per dsid - may encounter both internal and external dataset_ids
-        if is_dsid_external(dsid):
-            stat_root = Path(gv_stat_root_ext)
-
-        # establish project
-        project = dsid.split(".")[0]
-        if project == "E3SM":
-            project = project.lower()       # required to satisfy esgf tables ...
-        add_facet = dict()
-        if project == "CMIP6" and not pargs.unrestricted:
-            institution = dsid.split(".")[2]
-            add_facet = { "institution_id": institution }
-
-        got_sfile = False
-        got_stats = False
-        if do_stats:
-            statname = f"{dsid}.status"
-            statfile = stat_root / statname
-            # print(f"statfile = {statfile}")
-            statents = load_file_lines(statfile)
-            if not statents:
-                log_message("error", f"datasm_verify_publication: No status file or status file entries in file: {statfile}")
-                continue
-            got_sfile = True
-            last_stats = get_last_status_value(statents)
-            if len(last_stats):
-                got_stats = True
-
-            log_message("info", f"Processing:{dsid}: statfile={got_sfile},stat_ents={got_stats}")
-
-        facet_path = Path(dsid.replace('.', '/'))
-        ds_path = pub_root / facet_path
-        dsp = f"{ds_path}"
-        p_set = set()
-        p_len = 0
-        p_ver = ""
-        if not os.path.exists(dsp):
-            log_message("warning", f"{dsid}: No dataset publication path exists {dsp}")
+    if s_len > 0 and s_set == p_set:   # publication verified
+        statmsg = f"PUBLICATION:Verified:{version}"
+    else:
+        if( not s_set or s_len == 0 ):
+            reason = f"No ESGF publication found for {dsid}"
         else:
-            v_list = next(os.walk(dsp))[1]
-            p_ver = maxversion(v_list)
-            if p_ver != "vNONE":
-                pub_path = ds_path / Path(p_ver)
-                # print(f"pub_path = {pub_path}")
-                pfiles = get_path_files(pub_path)
-                if not pfiles or len(pfiles) == 0:
-                    log_message("warning", f"{dsid}: No dataset publication path files exist in {dsp}")
-                else:
-                    p_set = set(pfiles)
-                    p_len = len(p_set)
-
-        # obtain data from ESGF search API
-        facets = {"project": f"{project}", "master_id": dsid, "replica": "False"}
-        facets.update(add_facet)
-
-        docs, numFound = safe_search_esgf(facets, qtype="Dataset", node=the_data_node, fields="version,data_node,latest")
-        if not docs:
-            reason = f"Dataset query returned empty docs"
-            log_message("error", f"{dsid}: {reason}")
-            continue
+            if s_len != p_len:
+                reason = f"MismatchedFilecount:pubroot;esgf={p_len};{s_len}"
+            else:
+                reason = "MismatchedFileLists"
+        statmsg = f"PUBLICATION:Verification_Fail:{reason}"
+    return statmsg
 
-        # ENSURE we are examining the highest version of "latest=True" ONLY.
-        latest_versions = list()
-        for record in docs:
-            log_message("info", f"DEBUG: Dataset Query returned version {record['version']}, {record['data_node']}, latest={record['latest']}")
-            if record['latest'] == True:
-                latest_versions.append(record['version'])
-        latest_versions.sort()
-        if len(latest_versions) < 1:
-            log_message("error", f"datasm_verify_publication: No 'latest=True' version for dataset {dsid}")
-            continue
-        max_latest_version = latest_versions[-1]
-        for record in docs:
-            if record['latest'] == True and record['version'] == max_latest_version:
-                best_record = record
+def log_search_errors(errors, log):
+    """
+    Log, and clear, the errors collected from safe_search_esgf
+    """
+    for message in errors:
+        log("error", message)
+    errors.clear()
+
+def verify_dsid(dsid, pargs, pub_root, log=log_message):
+    '''
+    Verify the publication of one dsid, one step after another.
+    Returns (statfile, statmsg), statfile is None without --update-status, or None if there is nothing to report
+    '''
+    statfile = None
+    if pargs.updatestatus:
+        statfile = get_statfile(dsid, log)
+        if statfile is None:
+            return None
+
+    p_ver, p_set, p_len = inventory_publication(dsid, pub_root, log)
+
+    # obtain data from ESGF search API
+    project, facets = dataset_query_facets(dsid, pargs.unrestricted)
+    errors = list()
+    docs, numFound = safe_search_esgf(facets, qtype="Dataset", node=pargs.the_data_node, fields="version,data_node,latest", errors=errors)
+    log_search_errors(errors, log)
+    best_record = choose_latest_record(dsid, docs, log)
+    if best_record is None:
+        return None
+
+    version = f"v{best_record['version']}"
+    if version != p_ver:    # inconsistent "max" versions
+        reason = f"MismatchedVersions:p_ver;s_ver={p_ver};{version}"
+        return statfile, f"PUBLICATION:Verification_Fail:{reason}"
+
+    dataset_id = f"{dsid}.{version}|{best_record['data_node']}"
+    errors = list()
+    docs, numFound = safe_search_esgf({"project": f"{project}", "dataset_id": dataset_id}, qtype="File", fields="title", errors=errors)
+    log_search_errors(errors, log)
+    statmsg = assess_files(dsid, version, docs, p_set, p_len, log)
+    if statmsg is None:
+        return None
+    return statfile, statmsg
+
+async def verify_dsid_async(dsid, pargs, pub_root, esgf_limit, io_pool, esgf_pool):
+    '''
+    The same steps as verify_dsid, with the publication directory inventory running in
+    io_pool while the Dataset query waits its turn for one of the esgf_limit query slots.
+    Log messages are collected and returned with the result, so that they can be
+    replayed in input order.
+    Returns (messages, result)
+    '''
+    loop = asyncio.get_running_loop()
+    messages = list()
+    log = lambda level, message: messages.append((level, message))
+
+    errors = list()
+
+    def search(*args, **kwargs):
+        # errors are logged by this coroutine, not the worker thread, to keep them in order
+        return loop.run_in_executor(esgf_pool, functools.partial(safe_search_esgf, *args, errors=errors, **kwargs))
+
+    statfile = None
+    if pargs.updatestatus:
+        statfile = await loop.run_in_executor(io_pool, get_statfile, dsid, log)
+        if statfile is None:
+            return messages, None
+
+    inventory = loop.run_in_executor(io_pool, inventory_publication, dsid, pub_root, log)
+
+    project, facets = dataset_query_facets(dsid, pargs.unrestricted)
+    async with esgf_limit:
+        docs, numFound = await search(facets, qtype="Dataset", node=pargs.the_data_node, fields="version,data_node,latest")
+    p_ver, p_set, p_len = await inventory
+    log_search_errors(errors, log)
+
+    best_record = choose_latest_record(dsid, docs, log)
+    if best_record is None:
+        return messages, None
+
+    version = f"v{best_record['version']}"
+    if version != p_ver:    # inconsistent "max" versions
+        reason = f"MismatchedVersions:p_ver;s_ver={p_ver};{version}"
+        return messages, (statfile, f"PUBLICATION:Verification_Fail:{reason}")
+
+    dataset_id = f"{dsid}.{version}|{best_record['data_node']}"
+    async with esgf_limit:
+        docs, numFound = await search({"project": f"{project}", "dataset_id": dataset_id}, qtype="File", fields="title")
+    log_search_errors(errors, log)
+    statmsg = assess_files(dsid, version, docs, p_set, p_len, log)
+    if statmsg is None:
+        return messages, None
+    return messages, (statfile, statmsg)
+
+def report(dsid, result):
+    if result is None:
+        return
+    statfile, statmsg = result
+    if statfile is not None:
+        set_last_status_value(statfile, statmsg)
+    print(f"{dsid}:{statmsg}", flush=True)
+
+async def verify_all_async(dsid_list, pargs, pub_root):
+    '''
+    Verify every dsid concurrently, reporting the results in input order as they become available
+    '''
+    esgf_limit = asyncio.Semaphore(pargs.workers)
+    with ThreadPoolExecutor(max_workers=pargs.workers) as io_pool, ThreadPoolExecutor(max_workers=pargs.workers) as esgf_pool:
+        pending = deque()
+        dsids = iter(dsid_list)
+        # keep a bounded window of dsids in flight, so a 20k list doesnt hold every result in memory
+        for dsid in dsids:
+            pending.append((dsid, asyncio.ensure_future(verify_dsid_async(dsid, pargs, pub_root, esgf_limit, io_pool, esgf_pool))))
+            if len(pending) >= 4 * pargs.workers:
                 break
+        while pending:
+            dsid, task = pending.popleft()
+            messages, result = await task
+            for level, message in messages:
+                log_message(level, message)
+            report(dsid, result)
+            if (dsid := next(dsids, None)) is not None:
+                pending.append((dsid, asyncio.ensure_future(verify_dsid_async(dsid, pargs, pub_root, esgf_limit, io_pool, esgf_pool))))
 
-        version = f"v{best_record['version']}"
-        data_node = best_record['data_node']
-        log_message("info", f"DEBUG: Dataset Query returned data_node {data_node} for best record")
-
-        if version != p_ver:    # inconsistent "max" versions
-            reason = f"MismatchedVersions:p_ver;s_ver={p_ver};{version}"
-            statmsg = f"PUBLICATION:Verification_Fail:{reason}"
-            verbmsg = statmsg
-            if do_stats:
-                set_last_status_value(statfile, statmsg)
-            print(f"{dsid}:{verbmsg}")
-            continue
-        
-        dataset_id = f"{dsid}.{version}|{data_node}"
+# -----------------------------------------------
 
-        facets = {"project": f"{project}", "dataset_id": dataset_id}
-        facets.update(add_facet)
+def main():
 
-        docs, numFound = safe_search_esgf({"project": f"{project}", "dataset_id": dataset_id}, qtype="File", fields="title")
-        if not docs:
-            reason = f"File query returned empty docs"
-            log_message("error", f"{dsid}: {reason}")
-            continue
+    pargs = assess_args()
+    esgf_cache.configure(enabled=not pargs.no_cache, refresh=pargs.refresh)
 
-        s_set = set({ f"{item['title']}" for item in docs })
-        s_len = len(s_set)
+    dsid_list = load_file_lines(pargs.thedsidlist)
 
-        if s_len > 0 and s_set == p_set:   # publication verified
-            statmsg = f"PUBLICATION:Verified:{version}"
-            verbmsg = statmsg
-        else:
-            if( not s_set or s_len == 0 ):
-                reason = f"No ESGF publication found for {dsid}"
-            else:
-                if s_len != p_len:
-                    reason = f"MismatchedFilecount:pubroot;esgf={p_len};{s_len}"
-                else:
-                    reason = "MismatchedFileLists"               
-            statmsg = f"PUBLICATION:Verification_Fail:{reason}"
-            verbmsg = statmsg
+    # print(f"Found {len(dsid_list)} dataset ids.  do_stats = {pargs.updatestatus}")
 
-        if do_stats:
-            set_last_status_value(statfile, statmsg)
-        print(f"{dsid}:{verbmsg}")
+    pub_root = Path(gv_pub_root)
 
+    if pargs.use_async:
+        get_client(pool_size=pargs.workers)
+        asyncio.run(verify_all_async(dsid_list, pargs, pub_root))
+    else:
+        for dsid in dsid_list:
+            report(dsid, verify_dsid(dsid, pargs, pub_root))
 
     sys.exit(0)
         
 
 if __name__ == "__main__":
   sys.exit(main())
-
-
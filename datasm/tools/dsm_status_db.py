@@ -0,0 +1,72 @@
+import os, sys, argparse
+from argparse import RawTextHelpFormatter
+from datasm.status import SQLiteStatusStore
+from datasm.util import get_dsm_paths
+
+
+helptext = '''
+    Usage:  python dsm_status_db.py --db <status.db> [--ingest [status_dir ...]] [--state MAJOR[:minor]] [--latest dsid] [--export export_dir]
+
+    Maintains a SQLite mirror of the dataset status files, and answers questions across many datasets at once.
+
+        --ingest:  copy any new status file lines from the given status directories into the database.
+                   If no directories are given, the STAGING_STATUS and [DSM_STAGING]/status_ext directories are used.
+        --state:   list the dataset_ids whose latest (binding) state is MAJOR or MAJOR:minor,
+                   for example "PUBLICATION:Verification_Fail"
+        --latest:  print the latest (binding) state of the given dataset_id
+        --export:  write every dataset in the database back out as a flat <dataset_id>.status file
+'''
+
+def assess_args():
+
+    parser = argparse.ArgumentParser(description=helptext, prefix_chars='-', formatter_class=RawTextHelpFormatter)
+    parser._action_groups.pop()
+    required = parser.add_argument_group('required arguments')
+    optional = parser.add_argument_group('optional arguments')
+    required.add_argument('--db', action='store', dest="thedb", type=str, required=True)
+    optional.add_argument('--ingest', action='store', dest="ingest", nargs='*', required=False)
+    optional.add_argument('--state', action='store', dest="state", type=str, required=False)
+    optional.add_argument('--latest', action='store', dest="latest", type=str, required=False)
+    optional.add_argument('--export', action='store', dest="export", type=str, required=False)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+
+    pargs = assess_args()
+
+    store = SQLiteStatusStore(pargs.thedb)
+
+    if pargs.ingest is not None:
+        status_dirs = pargs.ingest
+        if not status_dirs:
+            dsm_paths = get_dsm_paths()
+            status_dirs = [ dsm_paths['STAGING_STATUS'], os.path.join(dsm_paths['DSM_STAGING'], "status_ext") ]
+        for status_dir in status_dirs:
+            if not os.path.isdir(status_dir):
+                print(f"WARNING: status directory {status_dir} does not exist", file=sys.stderr)
+                continue
+            count = store.ingest_directory(status_dir)
+            print(f"Ingested {count} new status lines from {status_dir}", file=sys.stderr)
+
+    if pargs.state:
+        major, _, minor = pargs.state.partition(':')
+        for dsid in store.datasets_in_state(major, minor if minor else None):
+            print(f"{dsid}")
+
+    if pargs.latest:
+        print(f"{pargs.latest}:{store.latest(pargs.latest)}")
+
+    if pargs.export:
+        os.makedirs(pargs.export, exist_ok=True)
+        store.export_directory(pargs.export)
+
+    store.close()
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import os, sys, argparse
 import yaml
 from argparse import RawTextHelpFormatter
+from datasm import spec
 
 
 helptext = '''
@@ -155,8 +156,7 @@ def contract_dsspec_branches(dataset_spec):
 
         
 def load_yaml(yaml_path):
-    with open(yaml_path, 'r') as instream:
-        in_yaml = yaml.load(instream, Loader=yaml.SafeLoader)
+    in_yaml = spec.load_yaml(yaml_path)
 
     return in_yaml
 
@@ -1,6 +1,7 @@
 import os, sys, argparse
 import yaml
 from argparse import RawTextHelpFormatter
+from datasm.spec import load_yaml
 
 
 helptext = '''
@@ -123,8 +124,7 @@ def expand_dataset_spec(dataset_spec):
         
 
 def load_yaml_spec(yaml_spec_path):
-    with open(yaml_spec_path, 'r') as instream:
-        yaml_spec = yaml.load(instream, Loader=yaml.SafeLoader)
+    yaml_spec = load_yaml(yaml_spec_path)
 
     return yaml_spec
 
@@ -2,6 +2,7 @@ import os, sys, argparse
 import yaml
 from argparse import RawTextHelpFormatter
 from datasm.util import get_dsm_paths
+from datasm.spec import load_spec
 
 
 helptext = '''
@@ -45,9 +46,7 @@ def putFileLines(afile,lines):
 
 
 def load_yaml(inpath):
-    with open(inpath, 'r') as instream:
-        in_yaml = yaml.load(instream, Loader=yaml.SafeLoader)
-    return in_yaml
+    return load_spec(inpath)
 
 # CMIP6: Project.Activity.Institution.SourceID.Experiment.VariantLabel.RealmFreq.VarName.Grid
 
@@ -9,16 +9,23 @@ import yaml
 import traceback
 import inspect
 import logging
-import psutil
-import requests
+import atexit
+import math
+import selectors
 import time
-import xarray as xr
 
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
+from queue import SimpleQueue
 from tempfile import NamedTemporaryFile
 from subprocess import Popen, PIPE
 from pathlib import Path
 from datetime import datetime, timezone
-from termcolor import colored, cprint
+from functools import lru_cache
+
+from datasm.esgf import ESGFSearchError, get_client
+from datasm.slurm_poller import get_poller
+from datasm.spec import load_spec, load_yaml
 
 
 def tss():
@@ -87,6 +94,8 @@ def force_symlink(target, link_name):
     os.symlink(target, link_name)
 
 def not_running(process_name):
+    import psutil
+
     for proc in psutil.process_iter(['cmdline']):
         try:
             # proc.info['cmdline'] is a list of command arguments
@@ -103,55 +112,163 @@ def not_running(process_name):
 def get_srun_status(srun_stat):
     job_name = srun_stat['job_name']
     # log_message("info", f"DEBUG: dsm util: srun_status gets job_name {job_name}")
-    cmd = ['sacct', f'--name={job_name}',  '-P', '--delimiter=,', '--format=jobid,state,elapsedraw']
-    # log_message("info", f"DEBUG_UTIL: dsm util: srun_status issues {cmd}")
-    cmd_result = subprocess.run(cmd, capture_output=True, text=True)
-    if cmd_result.returncode != 0:
-        log_message("info", f"ERROR: get_srun_status() FAIL to obtain sacct info for job {job_name}")
-        log_message("info", f"STDERR: {cmd_result.stderr}")
-        return False
-    linelist = cmd_result.stdout.rsplit('\n',1)
-    lastline = cmd_result.stdout.strip().splitlines()[-1]
-    if not lastline:
+    # every tracked job name is looked up in one sacct call per poll interval
+    record = get_poller().job_by_name(job_name)
+    if record is None:
         log_message("info", f"get_srun_status(): No sacct record found for job {job_name}")
         return False
-    # log_message("info", f"DEBUG_UTIL: dsm util: srun_status returned {lastline}")
-    statlist = lastline.split(',')
-    srun_stat['job_id'] = statlist[0]
-    srun_stat['status'] = statlist[1]
-    srun_stat['elapse'] = statlist[2]
+    srun_stat['job_id'] = record['JOBID']
+    srun_stat['status'] = record['STATE']
+    srun_stat['elapse'] = record['ELAPSED']
     if "CANCELLED" in srun_stat['status']:
         srun_stat['status'] = "CANCELLED"
     if "FAILED" in srun_stat['status']:
-        job_id = srun_stat['job_id']
-        cmd = ['sacct', '-j', f'{job_id}', '--format=ExitCode,Reason']
-        cmd_result = subprocess.run(cmd, capture_output=True, text=True)
-        linelist = cmd_result.stdout.rsplit('\n',1)
-        lastline = cmd_result.stdout.strip().splitlines()[-1]
-        srun_stat['reason'] = f"ExitCode={lastline}"
-        
+        srun_stat['reason'] = f"ExitCode={record['EXITCODE']} {record['REASON']}"
+
     return True
 
 
 def force_srun_scancel(srun_stat):
     job_id = srun_stat['job_id']
+    if job_id == "UNKNOWN" and (record := get_poller().job_by_name(srun_stat['job_name'])) is not None:
+        job_id = srun_stat['job_id'] = record['JOBID']
+    if job_id == "UNKNOWN":
+        # never showed up in sacct, stopping srun cancels its job step
+        if (process := srun_stat.get('process')) is not None and process.poll() is None:
+            process.terminate()
+        return
     cmd = ['scancel', f"{job_id}"]
     cmd_result = subprocess.run(cmd, capture_output=True, text=True)
-    
+
+
+# how often, in seconds, slurm_srun_manager wakes up to check runtimes when no segment finishes
+SRUN_POLL_MIN = 2
+SRUN_POLL_MAX = 300
+
+# a segment that has run longer than STRAGGLER_FACTOR times this percentile of the
+# finished segments gets a backup copy on another node, once STRAGGLER_MIN_DONE have finished
+STRAGGLER_PERCENTILE = 90
+STRAGGLER_FACTOR = 1.5
+STRAGGLER_MIN_DONE = 3
+
+# failed segments are launched again, each at most SRUN_MAX_RETRIES times, while the
+# batch has retries left, by default SRUN_RETRY_FRACTION of the number of segments
+SRUN_MAX_RETRIES = 2
+SRUN_RETRY_FRACTION = 0.2
+
+
+def runtime_percentile(durations, percentile):
+    """
+    The nearest-rank percentile of a list of runtimes
+    """
+    ordered = sorted(durations)
+    rank = max(math.ceil(percentile / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def srun_poll_interval(durations, minwait):
+    """
+    How long slurm_srun_manager should wait for a segment to finish before
+    checking runtimes again: a tenth of the median runtime of the segments
+    done so far, or of minwait before any are
+    """
+    if durations:
+        base = runtime_percentile(durations, 50) / 10
+    else:
+        base = minwait / 10
+    return min(max(base, SRUN_POLL_MIN), SRUN_POLL_MAX)
+
+
+def _launch_srun(seg_spec, attempt, slurm_timeout, selector, exclude=None):
+    # every copy of a segment gets its own job name, so sacct can tell them apart
+    job_name = seg_spec["jobname"] if attempt == 0 else f"{seg_spec['jobname']}-{attempt}"
+
+    srun_stat = dict()
+    srun_stat['job_id'] = "UNKNOWN"
+    srun_stat['job_name'] = job_name
+    srun_stat['process'] = None
+    srun_stat['status'] = "UNKNOWN"
+    srun_stat['reason'] = "UNKNOWN"
+    srun_stat['start_sec'] = tss()
+    srun_stat['elapse'] = 0
+    srun_stat['stderr'] = deque(maxlen=20)
+    srun_stat['staging'] = None
+
+    seg_cmd = list(seg_spec['seg_cmd'])
+    if outdir := seg_spec.get('outdir'):
+        # write into a private directory next to the outputs, moved into place if this copy wins
+        staging = os.path.join(outdir, f".{job_name}.partial")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        seg_cmd = [staging if x == outdir else x for x in seg_cmd]
+        srun_stat['staging'] = staging
+
+    srun_cmd = ["srun", "--exclusive", "-t", f"{slurm_timeout}", "--job-name", f"{job_name}"]
+    if exclude:
+        srun_cmd.extend(["--exclude", exclude])
+    srun_cmd.extend(seg_cmd)
+    # log_message("info", f"DEBUG: seg_cmd = {srun_cmd}")
+    process = subprocess.Popen(
+        srun_cmd,
+        shell=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    srun_stat['process'] = process
+    srun_stat['status'] = "RUNNING"
+    srun_stat['open_pipes'] = 2
+    selector.register(process.stdout, selectors.EVENT_READ, srun_stat)
+    selector.register(process.stderr, selectors.EVENT_READ, srun_stat)
+    # the sacct accounting for all the segments is looked up in one query
+    get_poller().track(name=job_name)
+    return srun_stat
+
+
+def _promote_outputs(staging, outdir):
+    """
+    Move everything a segment wrote to its staging directory into outdir, one os.replace per file
+    """
+    for root, dirs, files in os.walk(staging):
+        target = os.path.join(outdir, os.path.relpath(root, staging))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            os.replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(staging, ignore_errors=True)
+
+
 """
   Supplied "seg_list" must be a list of dictionaries, each providing
     segname:  A string uniquely identifying the segment
     seg_cmd:  A command-list ([ "app", "parm1", "parm2", ...]) to exec
               for each segment
     jobname:  Typically <app>_<tag>_<segname>
-  
+  and optionally
+    outdir:   The output directory as it appears in seg_cmd. Each copy of
+              the segment writes to its own directory instead, and only
+              the copy that finishes first has its outputs moved into
+              outdir. Only segments with an outdir get backup copies.
+
+  A segment is done when its srun exits, COMPLETED if it exited 0 and
+  FAILED otherwise. The srun output is read as it arrives, so the manager
+  wakes up as soon as a segment finishes, and otherwise every
+  srun_poll_interval() seconds to check on the running ones:
+
+    - a segment running longer than STRAGGLER_FACTOR times the
+      STRAGGLER_PERCENTILE runtime of the finished segments gets one backup
+      copy on another node, whichever copy finishes first is kept and the
+      other is cancelled
+    - segments that run too long (5x the mean, or maxw) are cancelled
+    - a failed segment is launched again while the retry budget lasts
+
+  sacct is only asked for accounting (job ids, nodes and elapsed time).
+
   NOTE:  This function will not return until all jobs are completed,
     failed, or auto-cancelled.
 
   returns #Segments_Passed, #Segments_Failed
 """
 
-def slurm_srun_manager(seg_list: list, minw: int, maxw: int):
+def slurm_srun_manager(seg_list: list, minw: int, maxw: int, retry_budget=None):
 
     MINWAIT = 300
     MAXWAIT = 7200
@@ -159,137 +276,178 @@ def slurm_srun_manager(seg_list: list, minw: int, maxw: int):
         MINWAIT = minw
     if maxw > 0:
         MAXWAIT = maxw
+    if retry_budget is None:
+        retry_budget = max(1, int(len(seg_list) * SRUN_RETRY_FRACTION))
 
     slurm_timeout_hours = 1 + int(MAXWAIT/3600)
     slurm_timeout = f"{slurm_timeout_hours}:0:0"
 
-    runstat_records = []
+    selector = selectors.DefaultSelector()
+    segments = []
+    runstat_records = []    # every srun launched, including backups and retries
+
+    def launch(segment, exclude=None):
+        rsrec = _launch_srun(segment['spec'], len(segment['attempts']), slurm_timeout, selector, exclude)
+        rsrec['segment'] = segment
+        segment['attempts'].append(rsrec)
+        runstat_records.append(rsrec)
+        return rsrec
 
     # Launch each command with srun
     for seg_spec in seg_list:
-        segname = seg_spec['segname']
-        job_name = seg_spec["jobname"]
-
-        srun_stat = dict()
-        srun_stat['job_id'] = "UNKNOWN"
-        srun_stat['job_name'] = job_name
-        srun_stat['process'] = None
-        srun_stat['status'] = "UNKNOWN"
-        srun_stat['reason'] = "UNKNOWN"
-        srun_stat['start_sec'] = tss()
-        srun_stat['elapse'] = 0
-
-        seg_cmd = ["srun", "--exclusive", "-t", f"{slurm_timeout}", "--job-name", f"{job_name}"]
-        seg_cmd.extend(seg_spec['seg_cmd'])
-        # log_message("info", f"DEBUG: seg_cmd = {seg_cmd}")
-        # log_message("info", f"Launching segment job: {segname} ({ypf} years): cmd={seg_cmd}")
-        process = subprocess.Popen(
-            seg_cmd,
-            shell=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        srun_stat['process'] = process
-        runstat_records.append(srun_stat)
-        time.sleep(5)
-        if not get_srun_status(srun_stat):
-            log_message("info", f"FAIL to obtain initial srun_status for job_name {job_name}")
-            continue
-        log_message("info", f"Obtained Job_ID {srun_stat['job_id']} for job {job_name}")
+        segment = {'spec': seg_spec, 'status': "RUNNING", 'attempts': [], 'retries': 0, 'backup': False}
+        segments.append(segment)
+        launch(segment)
+        log_message("info", f"Launched segment job: {seg_spec['segname']} as {seg_spec['jobname']}")
 
-    # Wait for all runstat_records to complete, kill any that take too long
+    # Wait for all segments to complete, back up the slow ones, kill any that take too long
 
     hist_completed = 0
     hist_failed = 0
     hist_cancelled = 0
-    sum_comp_et = 0.0
+    retries_used = 0
+    backups = 0
+    durations = []
     mean_et = 0.0
 
-    still_trying = True
-    while still_trying:
-        pending = 0
-        running = 0
-        other = 0
-        stat_fail = 0
-
-        # Pass 1:  Tally status values
-
-        job_count = len(runstat_records)
-        log_message("info", f"LOOPING on {job_count} runstat_records")
-        for i, rsrec in enumerate(runstat_records):
-            job_name = rsrec['job_name']
-            job_stat = rsrec['status']
-            # log_message("info", f"DEBUG_LOOP: Processing runstat_record {i}: jobname = {job_name}")
-            if rsrec['status'] in ['COMPLETED', 'FAILED', 'CANCELLED']: # terminal state already announced and tallied
-                continue
-            if not get_srun_status(rsrec):
-                log_message("info", f"FAIL to obtain srun_status for job_name {job_name}")
-                stat_fail += 1
-                continue
-            # log_message("info", f"DEBUG_LOOP: got job_stat {job_stat} for job_name {job_name}")
-            job_stat = rsrec['status'] # fresh status obtained
-            if job_stat == "COMPLETED":
-                hist_completed += 1
-                sum_comp_et += int(rsrec['elapse'])
-                log_message("info", f"COMPLETED job_name {job_name}, et={rsrec['elapse']}")
-            elif job_stat == "FAILED":
-                hist_failed += 1
-                log_message("info", f"FAILED job_name {job_name}, et={rsrec['elapse']}")
-                log_message("info", f"FAILED job_name {job_name}, Reason: {rsrec['reason']}")
-                # need to call code that elicidates the reason for the failure here
-            elif job_stat == "CANCELLED":
-                hist_cancelled += 1
-                log_message("info", f"CANCELLED job_name {job_name}, et={rsrec['elapse']}")
-            elif job_stat == "PENDING":
-                pending += 1
-                log_message("info", f"PENDING job_name {job_name}")
-            elif job_stat == "RUNNING":
-                running += 1
-                et = int(rsrec['elapse'])
-                log_message("info", f"RUNNING job_name {job_name} (et={et}, mean_et={mean_et} for {hist_completed} completed jobs)")
+    def finish(rsrec):
+        nonlocal hist_completed, hist_failed, hist_cancelled, retries_used, mean_et
+        job_name = rsrec['job_name']
+        segment = rsrec['segment']
+        returncode = rsrec['process'].wait()
+        et = tss() - rsrec['start_sec']
+        rsrec['elapse'] = et
+        if rsrec['status'] == "CANCELLING":
+            rsrec['status'] = "CANCELLED"
+            log_message("info", f"CANCELLED job_name {job_name}, et={et}")
+        elif returncode == 0:
+            rsrec['status'] = "COMPLETED"
+            log_message("info", f"COMPLETED job_name {job_name}, et={et}")
+        else:
+            rsrec['status'] = "FAILED"
+            last_err = rsrec['stderr'][-1] if rsrec['stderr'] else ""
+            rsrec['reason'] = f"ExitCode={returncode} {last_err}".strip()
+            log_message("info", f"FAILED job_name {job_name}, et={et}")
+            log_message("info", f"FAILED job_name {job_name}, Reason: {rsrec['reason']}")
+
+        if segment['status'] == "RUNNING" and rsrec['status'] == "COMPLETED":
+            try:
+                if rsrec['staging'] is not None:
+                    _promote_outputs(rsrec['staging'], segment['spec']['outdir'])
+            except OSError as e:
+                rsrec['status'] = "FAILED"
+                rsrec['reason'] = f"Unable to move outputs into place: {repr(e)}"
+                log_message("error", f"FAILED job_name {job_name}, Reason: {rsrec['reason']}")
             else:
-                other += 1
-                log_message("info", f"Unexpected srun_status ({job_stat}) for job_name {job_name}")
+                segment['status'] = "COMPLETED"
+                hist_completed += 1
+                durations.append(et)
+                mean_et = sum(durations)/len(durations)
+                for other in segment['attempts']:
+                    if other['status'] == "RUNNING":
+                        log_message("info", f"Issuing SCANCEL on the slower copy: job_name = {other['job_name']}")
+                        other['status'] = "CANCELLING"
+                        force_srun_scancel(other)
+                return
+
+        if rsrec['staging'] is not None:
+            shutil.rmtree(rsrec['staging'], ignore_errors=True)
+        if segment['status'] != "RUNNING":
+            return  # the other copy already finished the segment
+        if any(x['status'] in ['RUNNING', 'CANCELLING'] for x in segment['attempts']):
+            return  # still waiting on the other copy
+
+        if rsrec['status'] == "FAILED" and segment['retries'] < SRUN_MAX_RETRIES and retries_used < retry_budget:
+            segment['retries'] += 1
+            retries_used += 1
+            retry = launch(segment)
+            log_message("info", f"RETRYING job_name {segment['spec']['jobname']} as {retry['job_name']} ({retries_used} of {retry_budget} retries used)")
+            return
+
+        segment['status'] = rsrec['status']
+        if segment['status'] == "CANCELLED":
+            hist_cancelled += 1
+        else:
+            hist_failed += 1
+
+    running = len(runstat_records)
+    while running:
+        timeout = srun_poll_interval(durations, MINWAIT)
+        for key, _ in selector.select(timeout):
+            rsrec = key.data
+            data = os.read(key.fd, 65536)
+            if data:
+                if key.fileobj is rsrec['process'].stderr:
+                    rsrec['stderr'].extend(data.decode("utf-8", errors="replace").splitlines())
+                continue
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+            rsrec['open_pipes'] -= 1
+            if rsrec['open_pipes'] == 0:
+                finish(rsrec)
 
-        log_message("info", f"Completed pass of {job_count} jobs")
-        log_message("info", f"LOOP_SUMMARY:  COMPLETED={hist_completed}, FAILED={hist_failed}, CANCELLED={hist_cancelled}, RUNNING={running}, PENDING={pending}, StatFail={stat_fail}")
+        running = len([x for x in runstat_records if x['status'] in ['RUNNING', 'CANCELLING']])
+        log_message("info", f"LOOP_SUMMARY:  COMPLETED={hist_completed}, FAILED={hist_failed}, CANCELLED={hist_cancelled}, RUNNING={running}, BACKUPS={backups}, RETRIES={retries_used}")
 
-        # Pass 2:  Determine Loop Status
+        # Back up the stragglers and cancel the segments that have run too long. The wall clock
+        # time since launch includes any time spent pending, so sacct has the final word on the run time
 
-        if hist_completed > 0:
-            mean_et = sum_comp_et/hist_completed
+        straggler_et = None
+        if len(durations) >= STRAGGLER_MIN_DONE:
+            straggler_et = STRAGGLER_FACTOR * runtime_percentile(durations, STRAGGLER_PERCENTILE)
 
-        for i, rsrec in enumerate(runstat_records):
+        now = tss()
+        for rsrec in list(runstat_records):
+            if rsrec['status'] != "RUNNING":
+                continue
+            segment = rsrec['segment']
+            wall_et = now - rsrec['start_sec']
+            backup_due = (
+                straggler_et is not None
+                and wall_et > straggler_et
+                and segment['spec'].get('outdir')
+                and not segment['backup']
+            )
+            if wall_et <= MINWAIT and not backup_due:
+                continue
             job_name = rsrec['job_name']
-            job_stat = rsrec['status']
-            if job_stat == "RUNNING":
-                et = int(rsrec['elapse'])
-                if et > MINWAIT and et < MAXWAIT and hist_completed > 2:
-                    if et > 5*mean_et:
-                        log_message("info", f"Issuing SCANCEL on extended relative runtime: job_name = {job_name}")
-                        force_srun_scancel(rsrec)
-                elif et > MAXWAIT:
-                    log_message("info", f"Issuing SCANCEL on extended absolute runtime: job_name = {job_name}")
+            if (record := get_poller().job_by_name(job_name)) is None or record['STATE'] != "RUNNING":
+                continue
+            rsrec['job_id'] = record['JOBID']
+            et = int(record['ELAPSED'] or 0)
+
+            if backup_due and et > straggler_et:
+                segment['backup'] = True
+                backups += 1
+                backup = launch(segment, exclude=record['NODES'])
+                log_message("info", f"STRAGGLER job_name {job_name} (et={et} > {straggler_et}), launched backup copy {backup['job_name']} excluding {record['NODES']}")
+
+            if et > MINWAIT and et < MAXWAIT and hist_completed > 2:
+                if et > 5*mean_et:
+                    log_message("info", f"Issuing SCANCEL on extended relative runtime: job_name = {job_name}")
+                    rsrec['status'] = "CANCELLING"
                     force_srun_scancel(rsrec)
+            elif et > MAXWAIT:
+                log_message("info", f"Issuing SCANCEL on extended absolute runtime: job_name = {job_name}")
+                rsrec['status'] = "CANCELLING"
+                force_srun_scancel(rsrec)
+
+        running = len([x for x in runstat_records if x['status'] in ['RUNNING', 'CANCELLING']])
 
-        if not (running or pending or stat_fail):
-            # ALL must be COMPLETED, FAILED, or "other"
-            log_message("info", f"DEBUG_LOOP: No jobs remain.")
-            log_message("info", f"Completed pass of {job_count} jobs: mean_et={mean_et} for {hist_completed} completed jobs")
-            still_trying = False
-            break   # save a sleep
-        log_message("info", f"SLEEPing 300")
-        time.sleep(300)
+    selector.close()
+    log_message("info", f"Completed {len(segments)} segments in {len(runstat_records)} jobs: mean_et={mean_et} for {hist_completed} completed segments, {backups} backups, {retries_used} retries")
 
-    # Nothing left to wait on
+    # Nothing left to wait on, fill in the slurm accounting of each segment
 
-    for i, rsrec in enumerate(runstat_records):
-        # force cleanup in case any job remains with strange status
-        force_srun_scancel(rsrec)
+    for rsrec in runstat_records:
+        if (record := get_poller().job_by_name(rsrec['job_name'])) is not None:
+            rsrec['job_id'] = record['JOBID']
+            rsrec['elapse'] = record['ELAPSED']
+        get_poller().untrack(name=rsrec['job_name'])
 
     passed = hist_completed
-    failed = len(runstat_records) - passed
-    
+    failed = len(segments) - passed
+
     return passed, failed
 
 """
@@ -522,42 +680,69 @@ def collision_free_name(apath, abase):
 
 DSM_ROOT_PATHS = dict()
 
+def parse_dsm_root_paths(text):
+    """
+    Parse "root_tag:root_path" lines, as found in the .dsm_root_paths file
+    """
+    root_paths = dict()
+    for aline in text.split('\n'):
+        aline = aline.strip()
+        if not aline or aline.startswith('#') or ':' not in aline:
+            continue
+        path_key, path_val = aline.split(':', 1)
+        root_paths[path_key] = path_val
+    return root_paths
+
 def get_dsm_paths():
+    """
+    Returns the dict of root_tag to root_path for this site. The first call in a
+    process looks, in order, at
+        the DSM_ROOT_PATHS environment variable ("root_tag:root_path" lines),
+        the .dsm_root_paths file that sits beside the $DSM_GETPATH script,
+        the output of "$DSM_GETPATH ALL"
+    and then sets DSM_ROOT_PATHS, so the scripts and jobs started from here skip the lookup
+    """
     global DSM_ROOT_PATHS
 
     if len(DSM_ROOT_PATHS) > 0:
         return DSM_ROOT_PATHS
 
+    if env_paths := os.environ.get('DSM_ROOT_PATHS'):
+        DSM_ROOT_PATHS.update(parse_dsm_root_paths(env_paths))
+        return DSM_ROOT_PATHS
+
     gp = os.environ['DSM_GETPATH']
-    path_lines = subprocess.run([gp, "ALL"],stdout=subprocess.PIPE,text=True).stdout.strip()
-    path_lines = path_lines.split('\n')
+    paths_file = os.path.join(os.path.dirname(gp), '.dsm_root_paths')
+    if os.path.isfile(paths_file):
+        with open(paths_file, 'r') as instream:
+            path_lines = instream.read()
+    else:
+        path_lines = subprocess.run([gp, "ALL"],stdout=subprocess.PIPE,text=True).stdout
 
-    for aline in path_lines:
-        path_key, path_val = aline.split(':')
-        DSM_ROOT_PATHS[path_key] = path_val
+    DSM_ROOT_PATHS.update(parse_dsm_root_paths(path_lines))
+    os.environ['DSM_ROOT_PATHS'] = '\n'.join(f"{k}:{v}" for k, v in DSM_ROOT_PATHS.items())
 
     return DSM_ROOT_PATHS
 
-def get_dsspec_year_range(dsid):
-    dsm_paths = get_dsm_paths()
-    resource_path = dsm_paths['STAGING_RESOURCE']
-    DEFAULT_SPEC_PATH = os.path.join(resource_path, 'dataset_spec.yaml')
+@lru_cache(maxsize=None)
+def get_datasm_conf():
+    """
+    The datasm_config.yaml packaged with datasm, read the first time its needed
+    """
+    import datasm.resources as resources
 
-    with open(DEFAULT_SPEC_PATH, 'r') as instream:
-        dataset_spec = yaml.load(instream, Loader=yaml.SafeLoader)
+    return load_yaml(os.path.join(os.path.dirname(resources.__file__), 'datasm_config.yaml'))
 
+def get_dsspec_year_range(dsid):
     dc = dsid.split(".")    # E3SM:   0=project, 1=model, 2=exper, 3=resol, 4=realm, 5=
                             # CMIP6:  0=project, 1=Activity, 2=Institution, 3=SourceID, 4=Experiment
 
-    if dc[0] == "E3SM":  # native dsid
-        the_experiment_record = dataset_spec['project'][dc[0]][dc[1]][dc[2]]
-    elif dc[0] == "CMIP6":  # cmip dsid
-        the_experiment_record = dataset_spec['project'][dc[0]][dc[1]][dc[2]][dc[3]][dc[4]]
-    else:
+    if dc[0] not in ["E3SM", "CMIP6"]:
         log_message("error", f"Unknown project {dc[0]}")
         return 0,0
-    
-    return the_experiment_record['start'],the_experiment_record['end']
+
+    # the spec is parsed once per process, see datasm.spec
+    return load_spec().year_range(dsid)
 
 def ensure_status_file_for_dsid(dsid):
     dsm_paths = get_dsm_paths()
@@ -682,27 +867,62 @@ def print_debug(e):
 # -----------------------------------------------
 
 
+LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+}
+
+# the background thread that writes queued log records to the log file
+_log_listener = None
+_log_handler = None
+
+
 def setup_logging(loglevel, logpath):
-    if loglevel == "debug":
-        level = logging.DEBUG
-    elif loglevel == "error":
-        level = logging.ERROR
-    elif loglevel == "warning":
-        level = logging.WARNING
-    else:
-        level = logging.INFO
-    logging.basicConfig(
-        filename=logpath,
-        # format="%(asctime)s:%(levelname)s:%(module)s:%(message)s",
-        format="%(asctime)s_%(msecs)03d:%(levelname)s:%(message)s",
-        datefmt="%Y%m%d_%H%M%S",
-        level=level,
-    )
+    """
+    Send log records to the logpath file through a background thread, so
+    callers only pay for putting the record on a queue. Only the first call
+    in a process sets things up, later calls are ignored (the same as
+    logging.basicConfig)
+    """
+    global _log_listener, _log_handler
+
+    root = logging.getLogger()
+    if _log_listener is not None or root.handlers:
+        return
+
     logging.Formatter.converter = time.gmtime
+    _log_handler = logging.FileHandler(logpath)
+    _log_handler.setFormatter(logging.Formatter(
+        fmt="%(asctime)s_%(msecs)03d:%(levelname)s:%(module)s:%(message)s",
+        datefmt="%Y%m%d_%H%M%S",
+    ))
+    log_queue = SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(LOG_LEVELS.get(loglevel.upper(), logging.INFO))
+
+    _log_listener = QueueListener(log_queue, _log_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
     # should be a separate message call
     # logging.info(f"Starting up the warehouse with parameters: \n{pformat(self.__dict__)}")
 
 
+def _log_directly_after_fork():
+    # the listener thread does not survive a fork, so worker processes write to the log file themselves
+    root = logging.getLogger()
+    if _log_handler is None:
+        return
+    for handler in root.handlers[:]:
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(_log_handler)
+
+
+os.register_at_fork(after_in_child=_log_directly_after_fork)
+
+
 # -----------------------------------------------
 
 
@@ -722,48 +942,31 @@ def con_message(level, message):  # message ONLY to console (in color)
     tstamp = get_UTC_TS()
     # to the console
     msg = f"{tstamp}:{level}:{message}"
+    from termcolor import cprint
     cprint(msg, color)
 
 
 # -----------------------------------------------
 
 
-def log_message(level, message, user_level='INFO'):  # message BOTH to log file and to console (in color)
-
+def log_message(level, message, *args, user_level='INFO'):  # message to the log file
     """
-    process_stack = inspect.stack()[1]
-    parent_module = inspect.getmodule(process_stack[0])
-    
-    parent_name = parent_module.__name__.split(".")[-1].upper()
-    if parent_name == "__MAIN__":
-        parent_name = process_stack[1].split(".")[0].upper()
-    message = f"{parent_name}:{message}"
+    Log a message at the given level ("debug", "info", "warning" or "error").
+    Nothing is formatted unless the level is enabled, so for messages that are
+    expensive to build pass either %-style args, or a callable that returns the
+    message, e.g.
+        log_message("debug", "checking %s against %s", req, dataset.dataset_id)
+        log_message("debug", lambda: f"transitions = {pformat(transitions)}")
     """
-
-    level = level.upper()
-    colors = {"INFO": "white", "WARNING": "yellow", "ERROR": "red", "DEBUG": "cyan"}
-    color = colors.get(level, 'red')
-    tstamp = get_UTC_TS()
-    # first, print to logfile
-    if level == "DEBUG":
-        logging.debug(message)
-    elif level == "ERROR":
-        logging.error(message)
-    elif level == "WARNING":
-        logging.warning(message)
-    elif level == "INFO":
-        logging.info(message)
-    else:
+    if (levelno := LOG_LEVELS.get(level.upper())) is None:
         print(f"ERROR: {level} is not a valid log level")
-
-    """
-    if level == 'DEBUG' and user_level != level:
-        pass
-    else:
-        # now to the console
-        msg = f"{tstamp}:{level}:{message}"
-        cprint(msg, color)
-    """
+        return
+    if not logging.getLogger().isEnabledFor(levelno):
+        return
+    if callable(message):
+        message = message()
+    # stacklevel=2 credits the record, and its %(module)s, to the caller
+    logging.log(levelno, message, *args, stacklevel=2)
 
 
 # -----------------------------------------------
@@ -779,6 +982,7 @@ def search_esgf(
         "variable_units",
     ],
     latest="true",
+    fields=None,
 ):
     """
     Make a search request to an ESGF node and return information about the datasets that match the search parameters
@@ -789,21 +993,76 @@ def search_esgf(
         node (str): The esgf index node to querry
         filter_values (list): A list of string values to be filtered out of the return document
         latest (str): boolean (true/false not True/False) to search for only the latest version of a dataset
+        fields (str): comma-separated field names to return, defaults to the common fields for the facets "type"
     """
-    url = f"https://{node}/esg-search/search/?offset=0&limit=10000&project={project}&format=application%2Fsolr%2Bjson&latest={latest}&{'&'.join([f'{k}={v}' for k,v in facets.items()])}"
-    log_message("info", f"search_esgf: issues URL: {url}")
-    req = requests.get(url)
-    if req.status_code != 200:
-        log_message("error", f"util.py: search_esgf: ESGF search request failed: (stat_code {req.status_code}) {url}")
-        raise ValueError(f"ESGF search request failed: {url}")
-
+    log_message("info", f"search_esgf: searching {project} for {facets}")
     docs = [
         {k: v for k, v in doc.items() if k not in filter_values}
-        for doc in req.json()["response"]["docs"]
+        for doc in get_client(node).iter_docs(
+            {"project": project, **facets}, qtype=None, fields=fields, latest=latest
+        )
     ]
     log_message("info", f"util.py: search_esgf: returning docs len={len(docs)}")
     return docs
 
+
+def resolve_esgf_files(dataset_ids, node="esgf-node.llnl.gov", batch_size=50):
+    """
+    Look up the published files for many datasets with a handful of batched
+    searches, instead of two searches per dataset
+
+    Parameters:
+        dataset_ids (list): the master_ids to look up, CMIP6 and E3SM ids can be mixed
+        node (str): The esgf index node to querry
+        batch_size (int): how many master_ids (or ESGF dataset ids) to put in a single query
+    Returns:
+        dict of dataset_id -> list of published file names, the list is empty if the
+        dataset is not published. Datasets whose batch failed are left out, so the
+        caller can fall back to searching for them one at a time
+    """
+    by_project = {}
+    for dataset_id in dataset_ids:
+        project = "CMIP6" if "CMIP6" in dataset_id else "e3sm"
+        by_project.setdefault(project, []).append(dataset_id)
+
+    client = get_client(node)
+    resolved = {}
+    for project, ids in by_project.items():
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i : i + batch_size]
+            try:
+                docs = client.search(
+                    {"project": project, "master_id": batch},
+                    qtype="Dataset",
+                    fields="id,master_id,number_of_files",
+                )
+                # same as searching one at a time, the first doc returned for a master_id wins
+                esgf_ids = {}
+                for doc in docs:
+                    if doc["master_id"] not in esgf_ids and int(doc.get("number_of_files", 0)) > 0:
+                        esgf_ids[doc["master_id"]] = doc["id"]
+
+                files = {x: [] for x in esgf_ids.values()}
+                if files:
+                    docs = client.search(
+                        {"project": project, "dataset_id": list(files)},
+                        qtype="File",
+                        fields="title,dataset_id",
+                    )
+                    for doc in docs:
+                        if doc["dataset_id"] in files:
+                            files[doc["dataset_id"]].append(doc["title"])
+            except (ESGFSearchError, KeyError) as e:
+                log_message("warning", f"util.py: resolve_esgf_files: batch of {len(batch)} {project} datasets failed: {e}")
+                continue
+
+            for dataset_id in batch:
+                resolved[dataset_id] = files.get(esgf_ids.get(dataset_id), [])
+            log_message("info", f"util.py: resolve_esgf_files: resolved {i + len(batch)} of {len(ids)} {project} datasets")
+
+    return resolved
+
+
 # -----------------------------------------------
 
 def json_readfile(filename):
@@ -848,6 +1107,8 @@ def get_dataset_version_from_file_metadata(latest_dir):  # input latest_dir alre
 
     log_message("error", f"(Fake_Error) Testing for version in file {first_file}")
 
+    import xarray as xr
+
     ds = xr.open_dataset(first_file)
     if 'version' in ds.attrs.keys():
         ds_version = ds.attrs['version']
@@ -1,31 +1,92 @@
 
-import yaml
 import importlib
 import os
 import sys
 import inspect
+from functools import lru_cache
 from pprint import pformat
 from pathlib import Path
 
 import datasm.resources as resources
 from datasm.workflows import jobs
-from datasm.util import setup_logging, log_message
+from datasm.spec import load_yaml
+from datasm.util import get_datasm_conf, log_message
 
 
 resource_path, _ = os.path.split(resources.__file__)
 DEFAULT_SPEC_PATH = os.path.join(resource_path, 'dataset_spec.yaml')
 DEFAULT_CONF_PATH = os.path.join(resource_path, 'datasm_config.yaml')
 
-with open(DEFAULT_CONF_PATH, 'r') as instream:
-    datasm_conf = yaml.load(instream, Loader=yaml.SafeLoader)
-DEFAULT_WAREHOUSE_PATH = datasm_conf['DEFAULT_WAREHOUSE_PATH']
-DEFAULT_PUBLICATION_PATH = datasm_conf['DEFAULT_PUBLICATION_PATH']
-DEFAULT_ARCHIVE_PATH = datasm_conf['DEFAULT_ARCHIVE_PATH']
-DEFAULT_STATUS_PATH = datasm_conf['DEFAULT_STATUS_PATH']
-
 NAME = 'DataSM'
 
 
+@lru_cache(maxsize=None)
+def target_data_type(realm, grid, data_type, freq):
+    """
+    The key used in transitions.yaml for a dataset, e.g. "atmos-native-mon" or "seaice-cmip-mon"
+    """
+    realm_code = realm.replace("-", "")
+    if grid == "native":
+        return f'{realm_code}-native-{freq}'
+    return f'{realm_code}-{data_type.replace("-", "")}-{freq}'
+
+
+# The job and workflow classes, and the transitions, are found by scanning the
+# workflows package. These are done once per process and shared by every node
+# of the workflow tree.
+
+@lru_cache(maxsize=None)
+def job_classes():
+    """
+    NAME -> job class, for every module in workflows/jobs
+    """
+    modules = {}
+    jobs_path = Path(jobs.__file__).parent.absolute()
+
+    for file in jobs_path.glob('*.py'):     # only python modules allowed!
+        if file.name == '__init__.py' or file.is_dir():
+            continue
+        module_string = f'datasm.workflows.jobs.{file.stem}'
+        module = importlib.import_module(module_string)
+        job_class = getattr(module, module.NAME)
+        modules[module.NAME] = job_class
+    return modules
+
+
+@lru_cache(maxsize=None)
+def child_workflow_classes(my_path, top_level):
+    """
+    Returns a tuple of (NAME, workflow class) for each workflow package in the my_path directory
+    """
+    workflows = []
+    for d in os.scandir(my_path):
+        if not d.is_dir() or d.name == "jobs" or d.name == "__pycache__":
+            continue
+
+        module_path = Path(my_path, d.name, '__init__.py')
+        if not module_path.exists():
+            log_message('error', f"{module_path} doesnt exist, doesnt look like this is a well formatted workflow")
+            sys.exit(1)
+
+        workflows_string = f"datasm{os.sep}workflows"
+        idx = str(my_path.resolve()).find(workflows_string)
+        if top_level:
+            module_name = f'datasm.workflows.{d.name}'
+        else:
+            module_name = f'datasm.workflows{str(my_path)[idx+len(workflows_string):].replace(os.sep, ".")}.{d.name}'
+
+        log_message("info",f"load_children(): loading workflow module {module_name}")
+
+        module = importlib.import_module(module_name)
+        workflows.append((module.NAME.upper(), getattr(module, module.NAME)))
+    return tuple(workflows)
+
+
+@lru_cache(maxsize=None)
+def read_transitions(transition_path):
+    return load_yaml(transition_path)
+
+
 class Workflow(object):
 
     def __init__(self, parent=None, slurm_scripts='temp', **kwargs):
@@ -33,6 +94,9 @@ class Workflow(object):
         self.parent = parent
         self.transitions = {}
         self.children = {}
+        # see compile_transitions
+        self.transition_table = None
+        self._routes = {}
         self.slurm_scripts = slurm_scripts
         self.name = NAME.upper()
         self.jobs = self.load_jobs()
@@ -40,25 +104,13 @@ class Workflow(object):
         self.job_workers = kwargs.get('job_workers')
         self.debug = kwargs.get('debug')
 
-        setup_logging('info', 'DataSM.log')
         log_message("info", f"Workflow {self.name} initialized")
 
     def load_jobs(self):
         """
-        get the path to the jobs directory which should be a sibling
-        of the datasm.py file
+        The job classes, shared by every workflow in the tree, see job_classes
         """
-        modules = {}
-        jobs_path = Path(jobs.__file__).parent.absolute()
-
-        for file in jobs_path.glob('*.py'):     # only python modules allowed!
-            if file.name == '__init__.py' or file.is_dir():
-                continue
-            module_string = f'datasm.workflows.jobs.{file.stem}'
-            module = importlib.import_module(module_string)
-            job_class = getattr(module, module.NAME)
-            modules[module.NAME] = job_class
-        return modules
+        return job_classes()
 
     def get_status_prefix(self, prefix=""):
         """
@@ -79,9 +131,12 @@ class Workflow(object):
             idx (int) : The recursive depth index
         Returns the name of the next state to transition to given the current state of the dataset
         """
-        log_message("info", " ----- entered next_state() ----- ")
-        log_message("info", f"WF_init next_state: self.name = {self.name} for dataset {dataset.dataset_id}")
-        log_message("debug", f"WF_init next_state: current state = {state}")
+        if self.transition_table is not None:
+            return self.next_state_compiled(dataset, state, params)
+
+        log_message("debug", " ----- entered next_state() ----- ")
+        log_message("debug", "WF_init next_state: self.name = %s for dataset %s", self.name, dataset.dataset_id)
+        log_message("debug", "WF_init next_state: current state = %s", state)
         # import ipdb; ipdb.set_trace()
         self.print_debug(f"next_state: current = *{state}*")
         state_attrs = state.split(':')
@@ -94,27 +149,27 @@ class Workflow(object):
         state_attrs_curr = state_attrs[idx].upper()
 
         prefix = self.get_status_prefix()
-        log_message("info", f"WF_init next_state: status_prefix = {prefix}")
-        log_message("info", f"WF_init next_state: state_attrs = {state_attrs}")
-        log_message("info", f"WF_init next_state: curr test_state = {test_state}")
-        log_message("debug", f"WF_init next_state: self.transitions.keys = {self.transitions.keys()}")
-        log_message("debug", f"WF_init next_state: self.children.keys = {self.children.keys()}")
+        log_message("debug", "WF_init next_state: status_prefix = %s", prefix)
+        log_message("debug", "WF_init next_state: state_attrs = %s", state_attrs)
+        log_message("debug", "WF_init next_state: curr test_state = %s", test_state)
+        log_message("debug", "WF_init next_state: self.transitions.keys = %s", self.transitions.keys())
+        log_message("debug", "WF_init next_state: self.children.keys = %s", self.children.keys())
 
         if test_state in self.transitions.keys():
-            log_message("info", f"WF_init next_state: test_state {test_state} FOUND in self.transition.keys.")
-            log_message("debug", f"WF_init next_state: test_state {test_state} FOUND in self.transition.keys: leads to selection from {self.transitions[test_state]}")
+            log_message("debug", "WF_init next_state: test_state %s FOUND in self.transition.keys.", test_state)
+            log_message("debug", "WF_init next_state: test_state %s FOUND in self.transition.keys: leads to selection from %s", test_state, self.transitions[test_state])
             realm_code = dataset.realm.replace("-", "") #ALWAYS - but use a temp local variable here, not dataset.realm!
-            log_message("info", f"WF_init next_state: obtained realm_code {realm_code}")
+            log_message("debug", "WF_init next_state: obtained realm_code %s", realm_code)
             if dataset.grid == "native":
                 target_data_type = f'{realm_code}-native-{dataset.freq}'
             else:
                 target_data_type = f'{realm_code}-{dataset.data_type.replace("-", "")}-{dataset.freq}'
 
-            log_message("info", f"WF_init next_state: target_data_type = {target_data_type}")
+            log_message("debug", "WF_init next_state: target_data_type = %s", target_data_type)
             self.print_debug(f"target_data_type: {target_data_type}")
             # Obtain subsequent states for current test_state
             transitions = self.transitions[test_state].get(target_data_type)
-            log_message("info", f"WF_init next_state: transitions = {transitions}")
+            log_message("debug", "WF_init next_state: transitions = %s", transitions)
             if transitions is None:
                 try:
                     return [(f'{prefix}{x}:', self, params) for x in self.transitions[test_state]['default']]
@@ -123,7 +178,7 @@ class Workflow(object):
                     sys.exit(1)
             else:
                 ret_list = [(f'{prefix}{x}:', self, params) for x in transitions]
-                log_message("info", f"WF_init next_state: for {dataset.dataset_id} returning {ret_list}")
+                log_message("debug", "WF_init next_state: for %s returning %s", dataset.dataset_id, ret_list)
                 return ret_list
 
         elif state_attrs_curr == "DATASM":
@@ -131,7 +186,7 @@ class Workflow(object):
 
         # import ipdb; ipdb.set_trace()
         elif state_attrs_curr in self.children.keys():
-            log_message("info", f"WF_init next_state: state_attrs_curr {state_attrs_curr} FOUND in self.children.keys: leads to {self.children[state_attrs_curr]}")
+            log_message("debug", "WF_init next_state: state_attrs_curr %s FOUND in self.children.keys: leads to %s", state_attrs_curr, self.children[state_attrs_curr])
             return self.children[state_attrs_curr].next_state(dataset, state, params, idx + 1)  # recurse
 
         else:
@@ -142,6 +197,110 @@ class Workflow(object):
             return tuple(["no_state_change", "no_class", dict()])
             # os._exit(1) # should not be fatal
 
+    def compile_transitions(self):
+        """
+        Flatten the transitions of this workflow and all of its children into
+        one table, (workflow, test_state) -> {target_data_type: [(next state, workflow)]},
+        with the status prefixes already applied. After this next_state is a
+        couple of dict lookups instead of a walk down the workflow tree.
+        """
+        table = {}
+
+        def add(workflow):
+            prefix = workflow.get_status_prefix()
+            for test_state, by_type in workflow.transitions.items():
+                table[(workflow, test_state)] = {
+                    data_type: [(f'{prefix}{x}:', workflow) for x in next_states or []]
+                    for data_type, next_states in by_type.items()
+                }
+            for child in workflow.children.values():
+                add(child)
+
+        add(self)
+        self.transition_table = table
+        self._routes = {}
+        self.validate_transitions()
+        log_message("info", f"compile_transitions(): {len(table)} states compiled for {self.name}")
+
+    def resolve_state(self, state):
+        """
+        Returns the (workflow, test_state) whose transitions apply to a status,
+        found the same way the recursive next_state finds them, or None if no
+        workflow has a transition out of it
+        """
+        if (route := self._routes.get(state, False)) is not False:
+            return route
+
+        state_attrs = state.split(':')
+        if len(state_attrs) < 3:
+            test_state = state
+        else:
+            test_state = f"{state_attrs[-3]}:{state_attrs[-2]}"
+
+        route = None
+        workflow = self
+        for state_attr in state_attrs:
+            if test_state in workflow.transitions:
+                route = (workflow, test_state)
+                break
+            state_attr = state_attr.upper()
+            if state_attr in workflow.children:
+                workflow = workflow.children[state_attr]
+            elif state_attr != "DATASM":
+                break
+        else:
+            if test_state in workflow.transitions:
+                route = (workflow, test_state)
+
+        self._routes[state] = route
+        return route
+
+    def validate_transitions(self):
+        """
+        Warn about next states in the compiled table that no workflow has a
+        transition out of, and about states of the child workflows that no
+        transition leads to
+        """
+        done_states = [f"{self.name}:Pass:", f"{self.name}:Fail:"]
+        reachable = set()
+        for (workflow, test_state), by_type in self.transition_table.items():
+            for next_states in by_type.values():
+                for next_state, _ in next_states:
+                    if next_state in done_states:
+                        continue
+                    if next_state.endswith(":Engaged:"):
+                        # the job reports back with Pass or Fail
+                        for result in ["Pass", "Fail"]:
+                            if route := self.resolve_state(f"{next_state[:-len('Engaged:')]}{result}:"):
+                                reachable.add(route)
+                        continue
+                    if (route := self.resolve_state(next_state)) is None:
+                        log_message("warning", f"validate_transitions(): {workflow.name} {test_state} leads to {next_state}, which no workflow has a transition out of")
+                    else:
+                        reachable.add(route)
+
+        for workflow, test_state in self.transition_table:
+            if workflow is not self and (workflow, test_state) not in reachable:
+                log_message("warning", f"validate_transitions(): nothing leads to {workflow.name} {test_state}")
+
+    def next_state_compiled(self, dataset, state, params):
+        """
+        next_state, using the table made by compile_transitions
+        """
+        if (route := self.resolve_state(state)) is None:
+            log_message("warning", f"WF_init next_state: target state {state} is not present in the transition graph for {self.name}")
+            return tuple(["no_state_change", "no_class", dict()])
+
+        workflow, test_state = route
+        by_type = self.transition_table[route]
+        data_type = target_data_type(dataset.realm, dataset.grid, dataset.data_type, dataset.freq)
+        if (next_states := by_type.get(data_type)) is None:
+            if (next_states := by_type.get('default')) is None:
+                log_message('error', f"Dataset {dataset.dataset_id} tried to go to the 'default' transition from the {test_state}, but no default was found")
+                sys.exit(1)
+        log_message("debug", "WF_init next_state: for %s returning %s", dataset.dataset_id, next_states)
+        return [(next_state, owner, params) for next_state, owner in next_states]
+
     def get_job(self, dataset, state, params, scripts_path, slurm_out_path, workflow, job_workers=8, **kwargs):
         state_attrs = state.split(':')
         job_name = state_attrs[-3]
@@ -174,11 +333,12 @@ class Workflow(object):
 
         log_message('info', f"Workflow get_job: created job instance {job_instance} from job()")
 
-        other_datasets = [x for x in kwargs.get('other_datasets') if x.dataset_id != dataset.dataset_id]
-
-        if other_datasets == None:
+        if (requirement_index := kwargs.get('requirement_index')) is not None:
+            job_instance.setup_requisites(index=requirement_index)
+        elif (other_datasets := kwargs.get('other_datasets')) is None:
             log_message('info', f"get_job: no other_datasets from kwargs")
         else:
+            other_datasets = [x for x in other_datasets if x.dataset_id != dataset.dataset_id]
             log_message('info', f"get_job: found {len(other_datasets)} other_datasets from kwargs")
             job_instance.setup_requisites(other_datasets)
 
@@ -196,41 +356,20 @@ class Workflow(object):
     def load_transitions(self):
         transition_path = Path(Path(inspect.getfile(
             self.__class__)).parents[0], 'transitions.yaml')
-        with open(transition_path, 'r') as instream:
-            self.transitions = yaml.load(instream, Loader=yaml.SafeLoader)
-            log_message("info", f"load_transitions(): {self.name}")
-            log_message("debug", f"load_tansitions(): {self.name} loaded {self.transitions}")
+        self.transitions = read_transitions(transition_path)
+        log_message("info", f"load_transitions(): {self.name}")
+        log_message("debug", lambda: f"load_tansitions(): {self.name} loaded {self.transitions}")
 
     def load_children(self):
         my_path = Path(inspect.getfile(self.__class__)).parent.absolute()
         workflows = {}
-        for d in os.scandir(my_path):
-            if not d.is_dir() or d.name == "jobs" or d.name == "__pycache__":
-                continue
-
-            module_path = Path(my_path, d.name, '__init__.py')
-            if not module_path.exists():
-                log_message('error', f"{module_path} doesnt exist, doesnt look like this is a well formatted workflow")
-                sys.exit(1)
-
-            workflows_string = f"datasm{os.sep}workflows"
-            idx = str(my_path.resolve()).find(workflows_string)
-            if self.name == NAME:
-                module_name = f'datasm.workflows.{d.name}'
-            else:
-                module_name = f'datasm.workflows{str(my_path)[idx+len(workflows_string):].replace(os.sep, ".")}.{d.name}'
-
-            self.print_debug(f"loading workflow module {module_name}")
-            log_message("info",f"load_children(): loading workflow module {module_name}")
-
-            module = importlib.import_module(module_name)
-            workflow_class = getattr(module, module.NAME)
+        for name, workflow_class in child_workflow_classes(my_path, self.name == NAME):
             workflow_instance = workflow_class(
                 parent=self,
                 slurm_scripts=self.slurm_scripts)
             workflow_instance.load_children()
             workflow_instance.load_transitions()
-            workflows[module.NAME.upper()] = workflow_instance
+            workflows[name] = workflow_instance
         self.children = workflows
 
     def toString(self):
@@ -253,6 +392,7 @@ class Workflow(object):
 
     @staticmethod
     def add_args(parser):
+        datasm_conf = get_datasm_conf()
         parser.add_argument(
             '-d', '--dataset-id',
             nargs="*",
@@ -278,20 +418,20 @@ class Workflow(object):
             help='number of parallel workers each job should create when running, default is 8')
         parser.add_argument(
             '-w', '--warehouse-path',
-            default=DEFAULT_WAREHOUSE_PATH,
-            help=f"The root path for pre-publication dataset staging, default={DEFAULT_WAREHOUSE_PATH}")
+            default=datasm_conf['DEFAULT_WAREHOUSE_PATH'],
+            help=f"The root path for pre-publication dataset staging, default={datasm_conf['DEFAULT_WAREHOUSE_PATH']}")
         parser.add_argument(
             '-p', '--publication-path',
-            default=DEFAULT_PUBLICATION_PATH,
-            help=f"The root path for data publication, default={DEFAULT_PUBLICATION_PATH}")
+            default=datasm_conf['DEFAULT_PUBLICATION_PATH'],
+            help=f"The root path for data publication, default={datasm_conf['DEFAULT_PUBLICATION_PATH']}")
         parser.add_argument(
             '-a', '--archive-path',
-            default=DEFAULT_ARCHIVE_PATH,
-            help=f"The root path for the data archive, default={DEFAULT_ARCHIVE_PATH}")
+            default=datasm_conf['DEFAULT_ARCHIVE_PATH'],
+            help=f"The root path for the data archive, default={datasm_conf['DEFAULT_ARCHIVE_PATH']}")
         parser.add_argument(
             '--status-path',
-            default=DEFAULT_STATUS_PATH,
-            help=f'The path to where to store dataset status files, default={DEFAULT_STATUS_PATH}')
+            default=datasm_conf['DEFAULT_STATUS_PATH'],
+            help=f"The path to where to store dataset status files, default={datasm_conf['DEFAULT_STATUS_PATH']}")
         parser.add_argument(
             '--debug',
             action='store_true',
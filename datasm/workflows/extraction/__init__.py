@@ -4,7 +4,7 @@ from datasm.workflows import Workflow
 #     ExtractionValidate,
 #     ZstashExtract
 # )
-from datasm.util import setup_logging, log_message
+from datasm.util import log_message
 
 COMMAND = 'extract'
 NAME = 'Extraction'
@@ -6,6 +6,149 @@ from tempfile import NamedTemporaryFile
 from datasm.util import log_message
 
 
+# source models that can feed a job for any model version (v1_Large_Ensemble and v2_Large_Ensemble)
+ANY_TARGET_MODELS = ["E3SM-1-0-LE", "E3SM-2-0-LE"]
+
+
+def normalize_model_version(model_version):
+    """
+    E3SM model versions like "1_0" become the CMIP6 source_id "E3SM-1-0"
+    """
+    if '_' in model_version:
+        return 'E3SM-' + '-'.join(model_version.split('_'))
+    return model_version
+
+
+def normalize_ensemble(ensemble):
+    """
+    E3SM ensembles like "ens1" become the CMIP6 variant "r1i1p1f1"
+    """
+    if 'ens' in ensemble:
+        return f"r{ensemble[3:]}i1p1f1"
+    return ensemble
+
+
+def parse_requirement(req):
+    """
+    Split a job requirement "realm-grid-freq" into its three parts, the
+    realm "sea-ice" becomes "seaice" to match the dataset codes
+    """
+    req_attrs = req.split('-')
+    if len(req_attrs) > 3 and req_attrs[0] == 'sea':    # adjust for hyphennated sea-ice
+        req_attrs = [req_attrs[0] + req_attrs[1], req_attrs[2], req_attrs[3]]
+    return req_attrs[0], req_attrs[1], req_attrs[2]
+
+
+class RequirementIndex(object):
+    """
+    The datasets of a scheduling pass, indexed by the facets that
+    WorkflowJob.requires_dataset compares: normalized model version and
+    ensemble number, then experiment, then the realm, grid and freq codes.
+
+    Build it once per pass and hand it to setup_requisites, so each job only
+    runs requires_dataset against the handful of datasets that can match
+    instead of every dataset being managed.
+    """
+
+    def __init__(self, datasets):
+        self._index = {}
+        for position, dataset in enumerate(datasets):
+            model = normalize_model_version(dataset.model_version)
+            if model in ANY_TARGET_MODELS:
+                model = None
+            key = (model, normalize_ensemble(dataset.ensemble)[0:3])
+            codes = tuple((x or '').replace('-', '') for x in (dataset.realm, dataset.grid, dataset.freq))
+            self._index.setdefault(key, {}).setdefault(dataset.experiment, []).append((position, dataset, codes))
+
+    def candidates(self, job):
+        """
+        Returns the datasets, other than the jobs own dataset, that could
+        satisfy one of the jobs unmet requirements, in the order they were
+        given to the index
+        """
+        target = job.dataset
+        patterns = [parse_requirement(req) for req, ds in job.requires.items() if ds is None]
+        if not patterns:
+            return []
+
+        ensemble = normalize_ensemble(target.ensemble)[0:3]
+        entries = []
+        for key in [(normalize_model_version(target.model_version), ensemble), (None, ensemble)]:
+            by_experiment = self._index.get(key, {})
+            # E3SM jobs need the same experiment, CMIP6 jobs match E3SM experiments through the cmip_case
+            if target.project == 'E3SM':
+                entries.extend(by_experiment.get(target.experiment, []))
+            else:
+                for experiment_entries in by_experiment.values():
+                    entries.extend(experiment_entries)
+        entries.sort(key=lambda x: x[0])
+
+        return [
+            dataset
+            for _, dataset, codes in entries
+            if dataset.dataset_id != target.dataset_id
+            and any(
+                all(want == '*' or want == have for want, have in zip(pattern, codes))
+                for pattern in patterns
+            )
+        ]
+
+
+class JobPool(object):
+    """
+    The jobs that have been submitted to slurm and not yet finished, indexed
+    by slurm job id and by (job name, experiment, model_version, ensemble),
+    so completion and the duplicate job search dont scan every job in flight
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_key = {}
+
+    @staticmethod
+    def key(job):
+        return (job.name, job.dataset.experiment, job.dataset.model_version, job.dataset.ensemble)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __contains__(self, job_id):
+        return job_id in self._by_id
+
+    def add(self, job):
+        """
+        Add a submitted job, the job_id must already be set
+        """
+        if not job.job_id:
+            raise ValueError(f"Cant add {job} to the job pool without a job id")
+        self._by_id[job.job_id] = job
+        self._by_key.setdefault(self.key(job), {})[job.job_id] = job
+
+    def pop(self, job_id):
+        """
+        Remove the job with the given slurm job id from the pool
+        Returns: the job, or None if it wasnt in the pool
+        """
+        if (job := self._by_id.pop(job_id, None)) is None:
+            return None
+        key = self.key(job)
+        if (bucket := self._by_key.get(key)) is not None:
+            bucket.pop(job_id, None)
+            if not bucket:
+                del self._by_key[key]
+        return job
+
+    def similar(self, job):
+        """
+        Returns the jobs in the pool with the same name, experiment, model_version
+        and ensemble as the given job, in the order they were added
+        """
+        return list(self._by_key.get(self.key(job), {}).values())
+
+
 class WorkflowJob(object):
 
     def __init__(self, dataset, state, scripts_path, slurm_out_path, slurm_opts=[], params={}, **kwargs):
@@ -42,6 +185,20 @@ class WorkflowJob(object):
         return f"{self.parent}:{self.name}:{self.dataset.dataset_id}"
 
     def __call__(self, slurm):
+        if (script_path := self.prepare(slurm)) is None:
+            return None
+        if not (job_id := slurm.sbatch(str(script_path))):
+            log_message("error", f"Failed to submit {self} from {script_path}")
+            self.dataset.unlock(self.dataset.latest_warehouse_dir)
+            return None
+        return self.submitted(job_id)
+
+    def prepare(self, slurm):
+        """
+        Resolve the command, lock the working directory and render the job script,
+        everything short of submitting it
+        Returns: the path to the rendered script, or None if the job cant be started
+        """
         if not self.meets_requirements():
             log_message("error", f"Job does not meet requirements! {self.requires}")
             return None
@@ -84,12 +241,27 @@ class WorkflowJob(object):
         self.add_cmd_suffix()
         log_message("info", f"init:render_script: self,cmd={self.cmd}, script_path={str(script_path)}")
         slurm.render_script(self.cmd, str(script_path), self._slurm_opts)
-        self._job_id = slurm.sbatch(str(script_path))
+        return script_path
+
+    def submitted(self, job_id):
+        """
+        Record the job id the script was submitted under, and mark the dataset as engaged
+        Returns: the job id
+        """
+        self._job_id = job_id
         log_message("info", f"init: _call_: setting status to {self._parent}:{self.name}:Engaged: for {self.dataset.dataset_id}")
         self.dataset.status = (f"{self._parent}:{self.name}:Engaged:",
                                {"slurm_id": self.job_id})
         return self._job_id
 
+    def array_key(self):
+        """
+        Jobs with the same key ask for the same resources, and can be submitted
+        together as one job array. Only valid after prepare()
+        """
+        return (type(self), self.name, tuple(
+            (key, str(val)) for key, val in self._slurm_opts if key not in ("-o", "--output")))
+
     def get_slurm_output_script_name(self):
         return f'{self.dataset.dataset_id}-{self.name}.out'
 
@@ -111,13 +283,14 @@ fi
 """
         self._cmd = self._cmd + suffix
 
-    def setup_requisites(self, input_datasets=None):
+    def setup_requisites(self, input_datasets=None, index=None):
         """
         Checks that the self.dataset matches the jobs requirements, as well
-        as an optional list of additional datasets
+        as an optional list of additional datasets, or the candidates for
+        this job from a RequirementIndex
         """
-        # cprint(f"incomming datasets {[x.dataset_id for x in input_datasets]}", "yellow")
-        # ipdb.set_trace()
+        if index is not None:
+            input_datasets = index.candidates(self)
 
         for req, _ in self._requires.items():
             log_message("info", f"init: setup_requisites: DBG_REQ: self {self.name} has req {req}")
@@ -163,12 +336,12 @@ fi
         # if self.dataset.dataset_id == dataset.dataset_id:
         #     return None
 
-        log_message("info", f"requires_dataset: self.dataset={self.dataset.dataset_id}, dataset={dataset.dataset_id}")
+        log_message("debug", "requires_dataset: self.dataset=%s, dataset=%s", self.dataset.dataset_id, dataset.dataset_id)
 
         for req, _ in self._requires.items():
-            log_message("info", f"requires_dataset: DBG_REQ: self {self.name} has req {req}")
+            log_message("debug", "requires_dataset: DBG_REQ: self %s has req %s", self.name, req)
 
-        log_message("info", f"init: requires_dataset(): (STEP 1) trying dataset.experiment={dataset.experiment}, self.dataset.experiment={self.dataset.experiment}")
+        log_message("debug", "init: requires_dataset(): (STEP 1) trying dataset.experiment=%s, self.dataset.experiment=%s", dataset.experiment, self.dataset.experiment)
 
         # for project E3SM jobs, the "sought" dataset must match the job's (self.)dataset.
         if self.dataset.project == 'E3SM':
@@ -176,70 +349,64 @@ fi
                 return None
         else:
             dataset_facets = dataset.dataset_id.split('.')
-            log_message("info", f"init: requires_dataset(): dataset.dataset_id = {dataset.dataset_id}")
+            log_message("debug", "init: requires_dataset(): dataset.dataset_id = %s", dataset.dataset_id)
             if self.dataset.project == 'CMIP6' and dataset.project == 'E3SM':
-                e3sm_cmip_case = self._spec['project']['E3SM'][dataset_facets[1]][dataset_facets[2]].get('cmip_case')
+                e3sm_cmip_case = self._spec.cmip_cases.get((dataset_facets[1], dataset_facets[2]))
                 # reject if this E3SM dataset does not have a "cmip_case" in the dataset_spec.
                 if not e3sm_cmip_case:
-                    log_message("info", f"init: requires_dataset: No cmip_case found.")
+                    log_message("debug", "init: requires_dataset: No cmip_case found.")
                     return None
 
-                log_message("info", f"init: requires_dataset: found cmip_case = {e3sm_cmip_case}")
+                log_message("debug", "init: requires_dataset: found cmip_case = %s", e3sm_cmip_case)
                 dst_dataset_facets = self.dataset.dataset_id.split('.')
                 dst_case_attrs = '.'.join(dst_dataset_facets[:5])
                 # reject if the found cmip_case does not match the job's dataset major facets.
                 if not dst_case_attrs == e3sm_cmip_case:
                     return None
 
-        log_message("info", f"init: requires_dataset(): Experiment ({dataset.experiment}) Aligns");
+        log_message("debug", "init: requires_dataset(): Experiment (%s) Aligns", dataset.experiment);
 
-        src_dataset_model = dataset.model_version
-        dst_dataset_model = self.dataset.model_version
-        if '_' in src_dataset_model:
-            src_dataset_model = 'E3SM-' + '-'.join(dataset.model_version.split('_'))
-        if '_' in dst_dataset_model:
-            dst_dataset_model = 'E3SM-' + '-'.join(self.dataset.model_version.split('_'))
+        src_dataset_model = normalize_model_version(dataset.model_version)
+        dst_dataset_model = normalize_model_version(self.dataset.model_version)
         if src_dataset_model != dst_dataset_model:
-            if src_dataset_model not in [ "E3SM-1-0-LE", "E3SM-2-0-LE" ] : # HACK to accommodate v1_Large_Ensemble and v2_Large_Ensemble
-                log_message("info", f"init: requires_dataset: ERR: src_dataset_model = {src_dataset_model} but dst_dataset_model = {dst_dataset_model}")
+            if src_dataset_model not in ANY_TARGET_MODELS: # HACK to accommodate v1_Large_Ensemble and v2_Large_Ensemble
+                log_message("debug", "init: requires_dataset: ERR: src_dataset_model = %s but dst_dataset_model = %s", src_dataset_model, dst_dataset_model)
                 # reject if (translated) model does not match
                 return None
 
-        log_message("info", f"init: requires_dataset(): Model_version ({src_dataset_model}) Aligns");
+        log_message("debug", "init: requires_dataset(): Model_version (%s) Aligns", src_dataset_model);
 
         src_dataset_ensemble = dataset.ensemble
         dst_dataset_ensemble = self.dataset.ensemble
-        log_message("info", f"init: requires_dataset(): src_ens = {src_dataset_ensemble}, dst_ens = {dst_dataset_ensemble}")
-        if 'ens' in src_dataset_ensemble:
-            src_dataset_ensemble = f"r{dataset.ensemble[3:]}i1p1f1"
-        if 'ens' in dst_dataset_ensemble:
-            dst_dataset_ensemble = f"r{self.dataset.ensemble[3:]}i1p1f1"
+        log_message("debug", "init: requires_dataset(): src_ens = %s, dst_ens = %s", src_dataset_ensemble, dst_dataset_ensemble)
+        src_dataset_ensemble = normalize_ensemble(src_dataset_ensemble)
+        dst_dataset_ensemble = normalize_ensemble(dst_dataset_ensemble)
         if src_dataset_ensemble[0:3] != dst_dataset_ensemble[0:3]:
             # reject if N in E3SM "ensN" does not match the N in the job's "rNi1p1f1"
-            log_message("info", f"init: requires_dataset: ERR: src_dataset_ensemble = {src_dataset_ensemble} but dst_dataset_ensemble = {dst_dataset_ensemble}")
+            log_message("debug", "init: requires_dataset: ERR: src_dataset_ensemble = %s but dst_dataset_ensemble = %s", src_dataset_ensemble, dst_dataset_ensemble)
             return None
 
-        log_message("info", f"init: requires_dataset(): Ensemble ({src_dataset_ensemble}) Aligns");
+        log_message("debug", "init: requires_dataset(): Ensemble (%s) Aligns", src_dataset_ensemble);
 
-        log_message("info", f"init: requires_dataset(): === ")
-        log_message("info", f"init: requires_dataset(): Trying all self._requires.items() for dataset_id {self.dataset.dataset_id}")
+        log_message("debug", "init: requires_dataset(): === ")
+        log_message("debug", "init: requires_dataset(): Trying all self._requires.items() for dataset_id %s", self.dataset.dataset_id)
 
         for req, ds in self._requires.items():
             if ds:
-                log_message("info", f"init: requires_dataset(): already satisfied (req: ds) = {req}:{ds.dataset_id}")
+                log_message("debug", "init: requires_dataset(): already satisfied (req: ds) = %s:%s", req, ds.dataset_id)
                 continue
             else:
-                log_message("info", f"init: requires_dataset(): unsatisfied (req) = {req}")
+                log_message("debug", "init: requires_dataset(): unsatisfied (req) = %s", req)
 
             req_attrs = req.split('-')  # breakout realm, grid, freq
 
-            log_message("info", f"init: requires_dataset(): Testing req_attrs = {req_attrs}")
+            log_message("debug", "init: requires_dataset(): Testing req_attrs = %s", req_attrs)
 
             if len(req_attrs) > 3 and req_attrs[0] == 'sea':    # adjust for hyphennated sea-ice
                 req_attrs[0] = req_attrs[0] + req_attrs[1]
                 req_attrs[1] = req_attrs[2]
                 req_attrs[2] = req_attrs[3]
-                log_message("info", f"requires_dataset: created req_attrs[0,1,2] = {req_attrs[0]}-{req_attrs[1]}-{req_attrs[2]}")
+                log_message("debug", "requires_dataset: created req_attrs[0,1,2] = %s-%s-%s", req_attrs[0], req_attrs[1], req_attrs[2])
 
             rcode = dataset.realm.replace('-','')
             gcode = dataset.grid.replace('-','')
@@ -250,7 +417,7 @@ fi
 
             req = '-'.join([req_attrs[0], req_attrs[1], req_attrs[2]])
 
-            log_message("info", f"init: requires_dataset(): Testing this dataset {rcode}-{gcode}-{fcode} against job req {req}")
+            log_message("debug", "init: requires_dataset(): Testing this dataset %s-%s-%s against job req %s", rcode, gcode, fcode, req)
 
             # skip dataset if any non-* item does not match
             if rcode != req_attrs[0] and req_attrs[0] != '*':
@@ -263,7 +430,7 @@ fi
             log_message("info", f"init: returning job requirement req={req} for dataset {dataset.dataset_id}")
             return req
 
-        log_message("info", f"init: returning requirement None for dataset {dataset.dataset_id}")
+        log_message("debug", "init: returning requirement None for dataset %s", dataset.dataset_id)
         return None
 
     def meets_requirements(self):
@@ -272,15 +439,15 @@ fi
         """
         retval = True
         for req in self._requires:
-            log_message("info", f"init: job.meets_requirements(): checking req {req}")
+            log_message("debug", "init: job.meets_requirements(): checking req %s", req)
             obtained = self._requires.get(req)
             if not obtained:
-                log_message("info", f"init: job.meets_requirements(): self._requires.get(req) yields None")
+                log_message("debug", "init: job.meets_requirements(): self._requires.get(req) yields None")
                 retval = False
             else:
-                log_message("info", f"init: job.meets_requirements(): self._requires.get(req) yields {obtained.dataset_id}")
+                log_message("debug", "init: job.meets_requirements(): self._requires.get(req) yields %s", obtained.dataset_id)
 
-        log_message("info", f"init: job.meets_requirements(): returning {retval}")
+        log_message("debug", "init: job.meets_requirements(): returning %s", retval)
         return retval
 
     def find_outpath(self):
@@ -89,6 +89,8 @@ class PostProcess(Workflow):
         for dataset_id, dataset in datasm.datasets.items():
             datasm.start_datasets({dataset_id: dataset})
 
+        datasm.start_status_consumer()
+
         while not datasm.should_exit:
             sleep(2)
 
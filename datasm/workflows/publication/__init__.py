@@ -83,6 +83,8 @@ class Publication(Workflow):
             log_message('info', f'WF_pub_init Publication_call: calling datasm.start_datasets() starting job {self.name} for {dataset_id}')
             datasm.start_datasets({dataset_id: dataset})
 
+        datasm.start_status_consumer()
+
         while not datasm.should_exit:
             sleep(2)
 
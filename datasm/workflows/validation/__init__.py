@@ -4,7 +4,7 @@ from time import sleep
 from datasm.workflows import Workflow
 from datasm.dataset import Dataset, DatasetStatusMessage
 from termcolor import colored, cprint
-from datasm.util import setup_logging, log_message
+from datasm.util import log_message
 
 
 NAME = 'Validation'
@@ -29,7 +29,6 @@ class Validation(Workflow):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.name = NAME.upper()
-        setup_logging('debug', f'{NAME}.log')
         log_message('info', f'initializing workflow {self.name}')
 
     def __call__(self, *args, **kwargs):
@@ -88,6 +87,8 @@ class Validation(Workflow):
             log_message('info',f'starting job {self.name} for {dataset_id}')
             datasm.start_datasets({dataset_id: dataset})
 
+        datasm.start_status_consumer()
+
         while not datasm.should_exit:
             sleep(2)
 
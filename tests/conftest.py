@@ -0,0 +1,8 @@
+import os
+
+# the tests never need the site paths, so dont look them up with $DSM_GETPATH
+os.environ.setdefault("DSM_ROOT_PATHS", "\n".join(
+    f"{tag}:/tmp/datasm-tests/{tag}"
+    for tag in ["PUBLICATION_DATA", "STAGING_DATA", "STAGING_STATUS", "STAGING_RESOURCE",
+                "ARCHIVE_STORAGE", "DSM_STAGING", "STAGING_TOOLS", "ARCHIVE_MANAGEMENT",
+                "USER_ROOT", "STAGING_ARCHIVE_MAPS", "DSM_ROOT"]))
@@ -0,0 +1,95 @@
+from datasm.completeness import merge_ranges, missing_ranges, parse_monthly, parse_ts_spans
+from datasm.dataset import Dataset
+
+DATASET_ID = "E3SM.2_0.piControl.LR.atmos.180x360.time-series.mon.ens1"
+
+
+def make_dataset(tmp_path, start_year, end_year, **attrs):
+    dataset = Dataset(DATASET_ID, status_path=str(tmp_path / "test.status"), no_status_file=True)
+    dataset.start_year, dataset.end_year = start_year, end_year
+    for key, value in attrs.items():
+        setattr(dataset, key, value)
+    return dataset
+
+
+def test_merge_ranges():
+    assert merge_ranges([]) == []
+    assert merge_ranges({7, 1, 3, 2}) == [(1, 3), (7, 7)]
+    assert merge_ranges([5, 5, 6]) == [(5, 6)]
+
+
+def test_missing_ranges():
+    assert missing_ranges({2, 3, 6}, 1, 8) == [(1, 1), (4, 5), (7, 8)]
+    assert missing_ranges(set(range(1, 9)), 1, 8) == []
+    assert missing_ranges(set(), 1, 3) == [(1, 3)]
+
+
+def test_parse_monthly():
+    files = [
+        "case.eam.h0.0002-01.nc",
+        "case.eam.h0.0001-12.nc",
+        "case.eam.h0.0001-01.nc",
+        "case.eam.h1.0001-02.nc",
+        "case.eam.h0.0001-1x.nc",
+    ]
+    prefix, suffix, months = parse_monthly(files)
+    assert (prefix, suffix) == ("case.eam.h0.", ".nc")
+    assert months == {1 * 12, 1 * 12 + 11, 2 * 12}
+    assert parse_monthly(["no-date-here.nc"]) is None
+
+
+def test_parse_ts_spans():
+    files = [
+        "/path/TS_000101_000512.nc",
+        "TS_000601_001012.nc",
+        "PRECT_cmip6_180x360_aave_000101_001012.nc",
+        "README.txt",
+    ]
+    assert parse_ts_spans(files) == {"TS": [(1, 5), (6, 10)], "PRECT": [(1, 10)]}
+
+
+def test_check_monthly(tmp_path):
+    dataset = make_dataset(tmp_path, 1, 3)
+    present = [(1, 3), (1, 4), (2, 1), (2, 2), (3, 12)]
+    files = [f"case.eam.h0.{year:04d}-{month:02d}.nc" for year, month in present]
+    missing = dataset.check_monthly(files)
+    expected = [
+        (year, month)
+        for year in range(1, 4)
+        for month in range(1, 13)
+        if (year, month) not in present
+    ]
+    assert missing == [f"case.eam.h0.{year:04d}-{month:02d}.nc" for year, month in expected]
+    # gaps at the start, in the middle and at the end
+    assert missing[:2] == ["case.eam.h0.0001-01.nc", "case.eam.h0.0001-02.nc"]
+    assert missing[-1] == "case.eam.h0.0003-11.nc"
+
+
+def test_check_time_series(tmp_path):
+    dataset = make_dataset(tmp_path, 1, 20, datavars=["TS", "PRECT", "U"])
+    files = [
+        "TS_000301_000712.nc",
+        "TS_001001_001512.nc",
+        "PRECT_cmip6_180x360_aave_000101_002012.nc",
+    ]
+    assert dataset.check_time_series(files) == [
+        f"{DATASET_ID}-TS-0001-0002",
+        f"{DATASET_ID}-TS-0008-0009",
+        f"{DATASET_ID}-TS-0016-0020",
+        f"{DATASET_ID}-U-0001-0020",
+    ]
+
+
+def test_check_spans(tmp_path):
+    dataset = make_dataset(tmp_path, 1850, 1869)
+    files = [
+        "pbo_Omon_E3SM-2-0_piControl_r1i1p1f1_gr_185201-185512.nc",
+        "pbo_Omon_E3SM-2-0_piControl_r1i1p1f1_gr_185801-186512.nc",
+    ]
+    assert dataset.check_spans(files) == [
+        f"{DATASET_ID}-1850-1851 -> expected case start doesnt match files start",
+        f"{DATASET_ID}-1856-1857",
+        f"{DATASET_ID}-1866-1869 -> expected case end doesnt match files end",
+    ]
+    files.append("pbo_Omon_E3SM-2-0_piControl_r1i1p1f1_gr_185001-186912.nc")
+    assert dataset.check_spans(files) == []
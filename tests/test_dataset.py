@@ -0,0 +1,36 @@
+import random
+
+from benchmarks import latest_status
+from datasm.dataset import Dataset
+from datasm.status import non_binding_status
+
+
+def test_latest_status_matches_scan(tmp_path):
+    status_path = tmp_path / "test.status"
+    latest_status.write_status_file(status_path, 500)
+    dataset = Dataset(latest_status.DATASET_ID, status_path=str(status_path), no_status_file=True)
+    dataset.load_dataset_status_file()
+    assert dataset.get_latest_status() == latest_status.scan_latest_status(dataset)
+
+
+def test_latest_status_out_of_order(tmp_path):
+    rng = random.Random(7)
+    entries = [
+        (f"20240101_000000_{index:06d}", rng.choice(["Pass:", "Fail:", "Engaged:"] + non_binding_status))
+        for index in range(200)
+    ]
+    shuffled = list(entries)
+    rng.shuffle(shuffled)
+    status_path = tmp_path / "test.status"
+    status_path.write_text("".join(f"STAT:{ts}:VALIDATION:Check:{message}\n" for ts, message in shuffled))
+
+    dataset = Dataset(latest_status.DATASET_ID, status_path=str(status_path), no_status_file=True)
+    dataset.load_dataset_status_file()
+
+    binding = [f"VALIDATION:Check:{message}" for _, message in entries if message not in non_binding_status]
+    assert dataset.get_latest_status() == (binding[-1], binding[-2])
+
+
+def test_benchmark_runs():
+    result = latest_status.run(lines=1000, calls=10)
+    assert set(result) == {"load", "scan", "lookup"}
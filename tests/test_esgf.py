@@ -0,0 +1,125 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from datasm import esgf, esgf_cache
+
+pytest.importorskip("requests")
+
+
+class FakeIndex(BaseHTTPRequestHandler):
+    """
+    Answers searches from server.docs, after first answering with the
+    status codes queued in server.failures
+    """
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        self.server.requests.append(query)
+        if self.server.failures:
+            self.send_response(self.server.failures.pop(0))
+            self.end_headers()
+            return
+        offset, limit = int(query["offset"][0]), int(query["limit"][0])
+        docs = [
+            doc for doc in self.server.docs
+            if all(doc.get(key) in values for key, values in query.items() if key == "dataset_id")
+        ]
+        body = json.dumps({
+            "responseHeader": {"status": 0},
+            "response": {"numFound": len(docs), "docs": docs[offset:offset + limit]},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def index():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeIndex)
+    server.docs = [{"id": f"E3SM.doc{x}", "dataset_id": f"E3SM.ds{x % 3}"} for x in range(25)]
+    server.failures = []
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(index, monkeypatch):
+    # each test gets its own cache settings, with the cache off
+    monkeypatch.setattr(esgf_cache, "_config", dict(esgf_cache._config, enabled=False))
+    monkeypatch.setattr(esgf_cache, "_cache", None)
+    monkeypatch.setattr(esgf.time, "sleep", lambda seconds: None)
+    client = esgf.ESGFClient(retries=2, backoff=0.01, page_size=10)
+    client.url = f"http://127.0.0.1:{index.server_port}/esg-search/search/"
+    yield client
+    client.close()
+
+
+def test_pages_and_fields(index, client):
+    docs = client.search({"project": "E3SM"})
+    assert [doc["id"] for doc in docs] == [f"E3SM.doc{x}" for x in range(25)]
+    assert [query["offset"] for query in index.requests] == [["0"], ["10"], ["20"]]
+    assert all(query["fields"] == [esgf.DEFAULT_FIELDS["Dataset"]] for query in index.requests)
+
+    client.search({"dataset_id": ["E3SM.ds1", "E3SM.ds2"]}, qtype="File", fields="*")
+    assert index.requests[-1]["dataset_id"] == ["E3SM.ds1", "E3SM.ds2"]
+    assert "fields" not in index.requests[-1]
+
+
+def test_retries_with_backoff(index, client, monkeypatch):
+    delays = []
+    monkeypatch.setattr(esgf.time, "sleep", delays.append)
+    index.failures = [503, 429]
+    docs, num_found = client.search_page({"project": "E3SM"})
+    assert num_found == 25 and len(docs) == 10
+    assert len(index.requests) == 3
+    # jittered around backoff, then twice backoff
+    assert 0.005 <= delays[0] <= 0.015
+    assert 0.01 <= delays[1] <= 0.03
+
+
+def test_gives_up(index, client):
+    index.failures = [503] * 3
+    with pytest.raises(esgf.ESGFSearchError):
+        client.search_page({"project": "E3SM"})
+    assert len(index.requests) == 3
+
+    # anything but a transient failure isnt retried
+    index.failures = [404]
+    with pytest.raises(esgf.ESGFSearchError):
+        client.search_page({"project": "E3SM"})
+    assert len(index.requests) == 4
+
+
+def test_connection_refused(client):
+    client.url = "http://127.0.0.1:1/esg-search/search/"
+    with pytest.raises(esgf.ESGFSearchError):
+        client.search_page({"project": "E3SM"})
+
+
+def test_cached_responses(index, client, tmp_path):
+    esgf_cache.configure(enabled=True, path=tmp_path / "search.db")
+    client.search_page({"dataset_id": "E3SM.ds1"})
+    client.search_page({"dataset_id": "E3SM.ds1"})
+    assert len(index.requests) == 1
+
+    # searches that found nothing are asked again
+    client.search_page({"dataset_id": "E3SM.missing"})
+    client.search_page({"dataset_id": "E3SM.missing"})
+    assert len(index.requests) == 3
+
+    esgf_cache.configure(refresh=True)
+    client.search_page({"dataset_id": "E3SM.ds1"})
+    assert len(index.requests) == 4
@@ -0,0 +1,108 @@
+import importlib
+
+from datasm import esgf_cache
+
+
+def reload_config(monkeypatch, **env):
+    for name in ["DATASM_ESGF_CACHE", "DATASM_ESGF_CACHE_PATH"]:
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return importlib.reload(esgf_cache)._config
+
+
+def test_config_from_env(monkeypatch, tmp_path):
+    try:
+        config = reload_config(monkeypatch)
+        assert config["enabled"] and config["path"] == esgf_cache.DEFAULT_CACHE_PATH
+
+        config = reload_config(monkeypatch, DATASM_ESGF_CACHE="off")
+        assert not config["enabled"]
+
+        path = str(tmp_path / "search.db")
+        config = reload_config(monkeypatch, DATASM_ESGF_CACHE_PATH=path)
+        assert config["enabled"] and config["path"] == path
+    finally:
+        monkeypatch.undo()
+        importlib.reload(esgf_cache)
+
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, tmp_path, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(esgf_cache.time, "time", clock)
+    return esgf_cache.ESGFCache(tmp_path / "search.db", **kwargs), clock
+
+
+def test_normalized_keys(monkeypatch, tmp_path):
+    cache, _ = make_cache(monkeypatch, tmp_path)
+    cache.put("HTTPS://Node/esg-search/search/?b=2&a=1", "body")
+    assert cache.get("https://node/esg-search/search/?a=1&b=2") == "body"
+    assert cache.get("https://node/esg-search/search/?a=1&b=3") is None
+
+
+def test_ttl(monkeypatch, tmp_path):
+    cache, clock = make_cache(monkeypatch, tmp_path, ttl=60)
+    cache.put("https://node/?q=old", "old")
+    clock.now += 30
+    cache.put("https://node/?q=new", "new")
+    clock.now += 31
+    assert cache.get("https://node/?q=old") is None
+    assert cache.get("https://node/?q=new") == "new"
+
+    # expired entries are dropped on the next eviction, not just ignored
+    cache.evict()
+    urls = [row[0] for row in cache.conn.execute("SELECT url FROM responses")]
+    assert urls == [esgf_cache.normalize_url("https://node/?q=new")]
+
+
+def test_evicts_least_recently_used(monkeypatch, tmp_path):
+    cache, clock = make_cache(monkeypatch, tmp_path, max_bytes=25)
+    for name in ["a", "b"]:
+        cache.put(f"https://node/?q={name}", name * 10)
+        clock.now += 1
+    # using a makes b the least recently used
+    assert cache.get("https://node/?q=a") == "a" * 10
+    clock.now += 1
+    cache.put("https://node/?q=c", "c" * 10)
+
+    assert cache.get("https://node/?q=b") is None
+    assert cache.get("https://node/?q=a") == "a" * 10
+    assert cache.get("https://node/?q=c") == "c" * 10
+
+
+def test_invalidate(monkeypatch, tmp_path):
+    cache, _ = make_cache(monkeypatch, tmp_path)
+    cache.put("https://node/?dataset_id=E3SM.one", "one")
+    cache.put("https://node/?dataset_id=E3SM.two", "two")
+    cache.invalidate("E3SM.one")
+    assert cache.get("https://node/?dataset_id=E3SM.one") is None
+    assert cache.get("https://node/?dataset_id=E3SM.two") == "two"
+
+
+def test_invalidate_versioned_id(monkeypatch, tmp_path):
+    monkeypatch.setattr(esgf_cache, "_config", dict(esgf_cache._config, enabled=True, path=tmp_path / "search.db"))
+    monkeypatch.setattr(esgf_cache, "_cache", None)
+    cache = esgf_cache.get_cache()
+    master = "E3SM.2_0.piControl.LR.atmos.180x360.time-series.mon.ens1"
+    cache.put(f"https://node/?master_id={master}&type=Dataset", "dataset")
+    cache.put("https://node/?master_id=E3SM.other&type=Dataset", "other")
+
+    esgf_cache.invalidate(f"{master}.v20240101|esgf-data.llnl.gov")
+    assert cache.get(f"https://node/?master_id={master}&type=Dataset") is None
+    assert cache.get("https://node/?master_id=E3SM.other&type=Dataset") == "other"
+
+
+def test_master_id():
+    assert esgf_cache.master_id("E3SM.a.b.v20240101|node") == "E3SM.a.b"
+    assert esgf_cache.master_id("E3SM.a.b.v1") == "E3SM.a.b"
+    # ids without a version keep every character
+    assert esgf_cache.master_id("E3SM.a.b") == "E3SM.a.b"
+    assert esgf_cache.master_id("E3SM.a.vorticity") == "E3SM.a.vorticity"
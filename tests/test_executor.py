@@ -0,0 +1,43 @@
+import time
+
+from benchmarks import local_executor
+from datasm.executor import LocalExecutor, parse_job_id
+
+
+def wait_for(executor, job_id, states, timeout=10):
+    deadline = time.monotonic() + timeout
+    while executor.state(job_id) not in states:
+        assert time.monotonic() < deadline, f"job {job_id} stuck in {executor.state(job_id)}"
+        time.sleep(0.01)
+
+
+def test_states(tmp_path):
+    executor = LocalExecutor(max_workers=2)
+    scripts = {}
+    for name, cmd in [("ok", "true"), ("bad", "exit 3"), ("slow", "sleep 30")]:
+        scripts[name] = str(tmp_path / f"{name}.sh")
+        executor.render_script(cmd, scripts[name], [("-J", name), ("-o", str(tmp_path / f"{name}.out"))])
+    ok, bad, slow = (executor.sbatch(scripts[name]) for name in ["ok", "bad", "slow"])
+
+    wait_for(executor, ok, [LocalExecutor.COMPLETED])
+    wait_for(executor, bad, [LocalExecutor.FAILED])
+    wait_for(executor, slow, [LocalExecutor.RUNNING])
+    assert [job["NAME"] for job in executor.queue()] == ["slow"]
+
+    assert executor.cancel(slow)
+    wait_for(executor, slow, [LocalExecutor.CANCELLED])
+    assert not executor.cancel(ok)
+    executor.shutdown()
+    assert executor.queue() == []
+    assert executor.state(12345) is None
+
+
+def test_parse_job_id():
+    assert parse_job_id(" 1234\n") == 1234
+    assert parse_job_id("1234_5") == "1234_5"
+
+
+def test_benchmark_runs():
+    result = local_executor.run(jobs=20, workers=4)
+    assert result["states"] == {LocalExecutor.COMPLETED: 20}
+    assert result["status_lines"] == 20
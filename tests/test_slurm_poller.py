@@ -0,0 +1,190 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from datasm import slurm_poller
+from datasm.slurm_poller import SlurmPoller
+
+FAKE_SLURM = """\
+#!{python}
+# logs how it was called, then prints the lines of $FAKE_SLURM_DIR/<command>.out,
+# or fails if $FAKE_SLURM_DIR/<command>.fail exists
+import os, sys
+root = os.environ["FAKE_SLURM_DIR"]
+name = os.path.basename(sys.argv[0])
+with open(os.path.join(root, "calls"), "a") as outstream:
+    outstream.write(" ".join([name] + sys.argv[1:]) + "\\n")
+if os.path.exists(os.path.join(root, name + ".fail")):
+    sys.exit("slurm_load_jobs error: Socket timed out on send/recv operation")
+with open(os.path.join(root, name + ".out")) as instream:
+    sys.stdout.write(instream.read())
+"""
+
+
+class FakeSlurm(object):
+    def __init__(self, root):
+        self.root = root
+
+    def set_output(self, command, records):
+        with open(self.root / f"{command}.out", "w") as outstream:
+            outstream.writelines("|".join(record) + "\n" for record in records)
+
+    def calls(self, command=None):
+        path = self.root / "calls"
+        if not path.exists():
+            return []
+        calls = path.read_text().splitlines()
+        return [call for call in calls if command is None or call.split()[0] == command]
+
+
+@pytest.fixture
+def fake_slurm(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    for command in ["sacct", "squeue"]:
+        path = bindir / command
+        path.write_text(FAKE_SLURM.format(python=sys.executable))
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SLURM_DIR", str(tmp_path))
+    monkeypatch.setenv("USER", "datasm")
+    fake = FakeSlurm(tmp_path)
+    fake.set_output("sacct", [])
+    fake.set_output("squeue", [])
+    return fake
+
+
+def sacct_record(job_id, name, state="RUNNING"):
+    return [job_id, name, state, "10", "0:0", "None", "debug", "datasm", "node1"]
+
+
+def test_batches_tracked_jobs(fake_slurm):
+    fake_slurm.set_output("sacct", [
+        sacct_record("101", "seg-a"),
+        sacct_record("101.batch", "batch"),
+        sacct_record("102", "seg-b", "COMPLETED"),
+        sacct_record("103.0", "step", "FAILED"),
+    ])
+    poller = SlurmPoller(interval=60)
+    for job_id in [101, 102, 103]:
+        poller.track(job_id=job_id)
+
+    assert poller.job(101)["STATE"] == "RUNNING"
+    assert poller.job("102")["STATE"] == "COMPLETED"
+    # only a step came back for 103
+    assert poller.job(103)["STATE"] == "FAILED"
+    assert poller.job(104) is None
+
+    calls = fake_slurm.calls("sacct")
+    # the first question asks for every tracked id at once, 104 forces one more query
+    assert len(calls) == 2
+    assert calls[0].split()[1:3] == ["-j", "101,102,103"]
+    assert calls[1].split()[1:3] == ["-j", "101,102,103,104"]
+
+
+def test_by_name(fake_slurm):
+    fake_slurm.set_output("sacct", [
+        sacct_record("201", "seg-a", "FAILED"),
+        sacct_record("202", "seg-a", "RUNNING"),
+        sacct_record("203", "seg-b", "PENDING"),
+    ])
+    poller = SlurmPoller(interval=60)
+    poller.track(name="seg-a")
+    poller.track(name="seg-b")
+    assert poller.job_by_name("seg-a")["JOBID"] == "202"
+    assert poller.job_by_name("seg-b")["STATE"] == "PENDING"
+    assert fake_slurm.calls("sacct") == [
+        f"sacct --name=seg-a,seg-b -P --noheader --delimiter=| --format={slurm_poller.SACCT_FORMAT}"
+    ]
+
+
+def test_staleness(fake_slurm):
+    poller = SlurmPoller(interval=60)
+    fake_slurm.set_output("sacct", [sacct_record("301", "seg")])
+    assert poller.job(301)["STATE"] == "RUNNING"
+
+    # within the interval the cached state is served
+    fake_slurm.set_output("sacct", [sacct_record("301", "seg", "COMPLETED")])
+    assert poller.job(301)["STATE"] == "RUNNING"
+    assert len(fake_slurm.calls("sacct")) == 1
+
+    # a caller that needs a fresher answer, or an invalidated cache, asks again
+    assert poller.job(301, max_age=0)["STATE"] == "COMPLETED"
+    poller.invalidate()
+    poller.job(301)
+    assert len(fake_slurm.calls("sacct")) == 3
+
+    # untracked jobs are no longer asked about
+    poller.untrack(job_id=301)
+    poller.track(job_id=302)
+    poller.job(302)
+    assert fake_slurm.calls("sacct")[-1].split()[1:3] == ["-j", "302"]
+
+
+def test_queue(fake_slurm):
+    fake_slurm.set_output("squeue", [["401", "seg", "/path/to/seg.sh", "R", "debug", "datasm", "1:00"]])
+    poller = SlurmPoller(interval=60)
+    assert [job["JOBID"] for job in poller.queue()] == ["401"]
+    assert poller.queue()[0]["STATE"] == "R"
+    assert fake_slurm.calls("squeue") == [f"squeue -u datasm -h -o {slurm_poller.SQUEUE_FORMAT}"]
+    poller.queue(max_age=0)
+    assert len(fake_slurm.calls("squeue")) == 2
+
+
+def test_failed_query_keeps_states(fake_slurm, monkeypatch):
+    monkeypatch.setattr(slurm_poller.time, "sleep", lambda seconds: None)
+    fake_slurm.set_output("sacct", [sacct_record("501", "seg")])
+    poller = SlurmPoller(interval=60)
+    assert poller.job(501)["STATE"] == "RUNNING"
+
+    (fake_slurm.root / "sacct.fail").touch()
+    assert poller.job(501, max_age=0)["STATE"] == "RUNNING"
+    assert len(fake_slurm.calls("sacct")) == 4
+
+    # the failed query didnt count as a refresh, the next question tries again
+    (fake_slurm.root / "sacct.fail").unlink()
+    fake_slurm.set_output("sacct", [sacct_record("501", "seg", "COMPLETED")])
+    assert poller.job(501)["STATE"] == "COMPLETED"
+
+
+def test_queries_outside_the_lock(fake_slurm, monkeypatch):
+    poller = SlurmPoller(interval=60)
+    fake_slurm.set_output("sacct", [sacct_record("601", "seg")])
+    poller.job(601)
+
+    started, release = threading.Event(), threading.Event()
+    sacct = poller._sacct
+
+    def slow_sacct(selection):
+        started.set()
+        release.wait(10)
+        return sacct(selection)
+
+    monkeypatch.setattr(poller, "_sacct", slow_sacct)
+    slow = threading.Thread(target=poller.job, args=(601,), kwargs={"max_age": 0})
+    slow.start()
+    assert started.wait(10)
+
+    # while sacct is running, known jobs are answered from the cache and tracking doesnt wait
+    answered = []
+    other = threading.Thread(target=lambda: answered.append((poller.job(601, max_age=0), poller.track(job_id=602))))
+    other.start()
+    other.join(5)
+    assert not other.is_alive()
+    assert answered[0][0]["STATE"] == "RUNNING"
+
+    release.set()
+    slow.join(10)
+    assert not slow.is_alive()
+
+
+def test_untrack_forgets_unseen(fake_slurm):
+    poller = SlurmPoller(interval=60)
+    fake_slurm.set_output("sacct", [sacct_record("701", "seg")])
+    poller.job(701)
+    poller.track(job_id=702)
+    poller.untrack(job_id=702)
+    poller.job(701)
+    assert len(fake_slurm.calls("sacct")) == 1
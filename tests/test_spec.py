@@ -0,0 +1,50 @@
+import fnmatch
+import random
+
+from datasm.spec import DatasetCatalog
+
+
+FACETS = ["ab", "cd", "a", "b", "x1", "E3SM", "1_0"]
+
+
+def random_ids(rng, count):
+    ids = []
+    for _ in range(count):
+        depth = rng.choice([2, 3, 4, 5])
+        ids.append(".".join(rng.choice(FACETS) for _ in range(depth)))
+    rng.shuffle(ids)
+    return ids
+
+
+def random_pattern(rng):
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        part = rng.choice(FACETS + ["*", "*", "?", "a*", "*b", "?d", "[ac]*", "x?"])
+        parts.append(part)
+    return ".".join(parts)
+
+
+def test_match_agrees_with_fnmatch():
+    rng = random.Random(1234)
+    for _ in range(20):
+        ids = random_ids(rng, 300)
+        catalog = DatasetCatalog(ids)
+        for _ in range(500):
+            pattern = random_pattern(rng)
+            assert catalog.match(pattern) == fnmatch.filter(ids, pattern), pattern
+
+
+def test_match_with_mixed_depths_in_either_order():
+    shallow = [f"E3SM.1_0.exp{i}.atm" for i in range(5)]
+    deep = [f"E3SM.1_0.exp{i}.atm.mon" for i in range(5)]
+    for ids in (shallow + deep, deep + shallow):
+        catalog = DatasetCatalog(ids)
+        for pattern in ["E3SM.*.*.*", "E3SM.1_0.*.atm", "*.atm", "E3SM.*.exp1.*", "*.1_0.*.*.*"]:
+            assert catalog.match(pattern) == fnmatch.filter(ids, pattern), pattern
+
+
+def test_id_that_is_a_prefix_of_another():
+    ids = ["E3SM.1_0.piControl", "E3SM.1_0.piControl.atmos", "E3SM.1_0"]
+    catalog = DatasetCatalog(ids)
+    for pattern in ["E3SM.1_0.piControl", "E3SM.1_0.*", "E3SM.*", "E3SM.1_0", "*"]:
+        assert catalog.match(pattern) == fnmatch.filter(ids, pattern), pattern
@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+from datasm import slurm_poller, util
+
+# srun runs the segment command in place, after noting the pid it will have
+# as the job id. sacct reports every job that has a pid file, RUNNING until
+# the process is gone, and scancel kills the job id it is given
+FAKE_SRUN = """\
+#!{python}
+import os, sys
+root = os.environ["FAKE_SLURM_DIR"]
+args, options = sys.argv[1:], {{}}
+while args[0].startswith("-"):
+    if args[0] == "--exclusive":
+        args = args[1:]
+        continue
+    options[args[0]] = args[1]
+    args = args[2:]
+with open(os.path.join(root, "calls"), "a") as outstream:
+    outstream.write(f"srun {{options['--job-name']}} {{options.get('--exclude', '')}}\\n")
+with open(os.path.join(root, options["--job-name"] + ".pid"), "w") as outstream:
+    outstream.write(str(os.getpid()))
+if "--exclude" in options:
+    os.environ["FAKE_SRUN_EXCLUDE"] = options["--exclude"]
+os.execv(args[0], args)
+"""
+
+FAKE_SACCT = """\
+#!{python}
+import os, sys
+root = os.environ["FAKE_SLURM_DIR"]
+names = [x for x in sys.argv[1:] if x.startswith("--name=")][0][len("--name="):].split(",")
+for name in names:
+    if not os.path.exists(os.path.join(root, name + ".pid")):
+        continue
+    pid = open(os.path.join(root, name + ".pid")).read()
+    try:
+        state = open(f"/proc/{{pid}}/stat").read().rsplit(")", 1)[1].split()[0]
+    except OSError:
+        state = "Z"
+    print(f"{{pid}}|{{name}}|{{'COMPLETED' if state == 'Z' else 'RUNNING'}}|100|0:0|None|debug|datasm|node7")
+"""
+
+FAKE_SCANCEL = """\
+#!{python}
+import os, signal, sys
+with open(os.path.join(os.environ["FAKE_SLURM_DIR"], "calls"), "a") as outstream:
+    outstream.write(f"scancel {{sys.argv[1]}}\\n")
+os.kill(int(sys.argv[1]), signal.SIGTERM)
+"""
+
+# a segment writes <outdir>/<name>.nc, "flaky" fails on its first try and
+# "slow" only finishes quickly when it is a backup copy
+SEGMENT = """\
+import os, sys, time
+outdir, name, marker = sys.argv[1:]
+if name == "flaky" and not os.path.exists(marker):
+    open(marker, "w").close()
+    sys.exit("flaky segment failed")
+copy = "backup" if os.environ.get("FAKE_SRUN_EXCLUDE") else "original"
+if name == "slow" and copy == "original":
+    time.sleep(60)
+with open(os.path.join(outdir, name + ".nc"), "w") as outstream:
+    outstream.write(copy)
+"""
+
+
+@pytest.fixture
+def fake_srun(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    for command, script in [("srun", FAKE_SRUN), ("sacct", FAKE_SACCT), ("scancel", FAKE_SCANCEL)]:
+        path = bindir / command
+        path.write_text(script.format(python=sys.executable))
+        path.chmod(0o755)
+    (tmp_path / "segment.py").write_text(SEGMENT)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SLURM_DIR", str(tmp_path))
+    monkeypatch.setattr(slurm_poller, "_poller", slurm_poller.SlurmPoller(interval=0))
+    monkeypatch.setattr(util, "SRUN_POLL_MIN", 0.2)
+    return tmp_path
+
+
+def test_retry_and_straggler_backup(fake_srun):
+    outdir = fake_srun / "out"
+    outdir.mkdir()
+    seg_list = [
+        {
+            "segname": name,
+            "jobname": f"seg_{name}",
+            "seg_cmd": [sys.executable, str(fake_srun / "segment.py"), str(outdir), name, str(fake_srun / "flaky.marker")],
+            "outdir": str(outdir),
+        }
+        for name in ["a", "b", "c", "flaky", "slow"]
+    ]
+
+    passed, failed = util.slurm_srun_manager(seg_list, minw=600, maxw=3600)
+    assert (passed, failed) == (5, 0)
+
+    calls = (fake_srun / "calls").read_text().splitlines()
+    launched = [call.split()[1] for call in calls if call.startswith("srun")]
+    assert sorted(launched) == ["seg_a", "seg_b", "seg_c", "seg_flaky", "seg_flaky-1", "seg_slow", "seg_slow-1"]
+    # the backup runs away from the node the straggler is on
+    assert "srun seg_slow-1 node7" in calls
+    # and the slower original is cancelled once the backup wins
+    slow_pid = (fake_srun / "seg_slow.pid").read_text()
+    assert f"scancel {slow_pid}" in calls
+
+    # only the winning copy of each segment is promoted, and no staging is left behind
+    assert sorted(os.listdir(outdir)) == ["a.nc", "b.nc", "c.nc", "flaky.nc", "slow.nc"]
+    assert (outdir / "slow.nc").read_text() == "backup"
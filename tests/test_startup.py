@@ -0,0 +1,31 @@
+import importlib.util
+import os
+
+import pytest
+
+from benchmarks import import_time
+
+# the budgets depend on how fast the machine is, so they are only checked when asked for
+timing = pytest.mark.skipif(
+    not os.environ.get("DATASM_TIMING_TESTS"),
+    reason="set DATASM_TIMING_TESTS=1 to check the startup time budgets")
+
+
+def test_util_import_skips_heavy_modules():
+    assert import_time.heavy_imports() == []
+
+
+@timing
+def test_util_import_within_budget():
+    assert import_time.main(["--no-cli", "--repeat", "3"]) == 0
+
+
+CLI_DEPENDENCIES = ["watchdog", "termcolor"]
+
+
+@timing
+@pytest.mark.skipif(
+    any(importlib.util.find_spec(x) is None for x in CLI_DEPENDENCIES),
+    reason=f"datasm --help needs {', '.join(CLI_DEPENDENCIES)}")
+def test_cli_help_within_budget():
+    assert import_time.main(["--repeat", "3"]) == 0
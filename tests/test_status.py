@@ -0,0 +1,82 @@
+import os
+
+from datasm.dataset import Dataset
+from datasm.status import SQLiteStatusStore, StatusFileReader
+
+DATASET_ID = "E3SM.2_0.piControl.LR.atmos.180x360.time-series.mon.ens1"
+
+
+def append(path, *lines):
+    with open(path, "a") as outstream:
+        outstream.writelines(line + "\n" for line in lines)
+
+
+def test_reader_offsets(tmp_path):
+    path = tmp_path / "test.status"
+    path.write_bytes("STAT:1:A:b:Pass:\n\nCOMM:é\nSTAT:2:A:c:Pass:\nSTAT:3:A:d".encode())
+    reader = StatusFileReader(path)
+    assert reader.read() == (False, ["STAT:1:A:b:Pass:", "COMM:é", "STAT:2:A:c:Pass:"])
+    assert reader.line_offsets == [0, 18, 26]
+    append(path, ":Pass:")
+    assert reader.read() == (False, ["STAT:3:A:d:Pass:"])
+    assert reader.line_offsets == [43]
+
+
+def test_repeated_lines_are_kept(tmp_path):
+    path = tmp_path / f"{DATASET_ID}.status"
+    store = SQLiteStatusStore(tmp_path / "status.db")
+    append(path, "STAT:1:WAREHOUSE:Ready:", "COMM:retry", "COMM:retry")
+    assert store.ingest(DATASET_ID, path) == 3
+    append(path, "COMM:retry")
+    assert store.ingest(DATASET_ID, path) == 1
+    assert store.lines(DATASET_ID) == ["STAT:1:WAREHOUSE:Ready:"] + ["COMM:retry"] * 3
+
+    # lines read again from the same offsets are not stored twice
+    reader = StatusFileReader(path)
+    _, lines = reader.read()
+    store.add_lines(DATASET_ID, lines, reader.line_offsets)
+    assert len(store.lines(DATASET_ID)) == 4
+
+
+def test_truncated_or_replaced(tmp_path):
+    path = tmp_path / f"{DATASET_ID}.status"
+    store = SQLiteStatusStore(tmp_path / "status.db")
+    append(path, "STAT:1:WAREHOUSE:Ready:", "STAT:3:PUBLICATION:Verification_Fail:")
+    store.ingest(DATASET_ID, path)
+    assert store.datasets_in_state("PUBLICATION", "Verification_Fail") == [DATASET_ID]
+
+    # truncated and rewritten with older timestamps, the latest state follows the file
+    with open(path, "w") as outstream:
+        outstream.write("STAT:2:VALIDATION:Ready:\n")
+    store.ingest(DATASET_ID, path)
+    assert store.lines(DATASET_ID) == ["STAT:2:VALIDATION:Ready:"]
+    assert store.latest(DATASET_ID) == "VALIDATION:Ready:"
+    assert store.datasets_in_state("PUBLICATION") == []
+
+    replacement = tmp_path / "replacement"
+    append(replacement, "STAT:1:WAREHOUSE:Ready:", "STAT:1:WAREHOUSE:Engaged:")
+    os.replace(replacement, path)
+    store.ingest(DATASET_ID, path)
+    assert store.lines(DATASET_ID) == ["STAT:1:WAREHOUSE:Ready:", "STAT:1:WAREHOUSE:Engaged:"]
+    assert store.latest(DATASET_ID) == "WAREHOUSE:Engaged:"
+
+
+def test_dataset_mirrors_into_store(tmp_path):
+    path = tmp_path / f"{DATASET_ID}.status"
+    store = SQLiteStatusStore(tmp_path / "status.db")
+    append(path, "STAT:3:PUBLICATION:Verification_Fail:")
+    store.ingest(DATASET_ID, path)
+
+    # the file was replaced while nothing was watching it
+    replacement = tmp_path / "replacement"
+    append(replacement, "STAT:1:WAREHOUSE:Ready:")
+    os.replace(replacement, path)
+    dataset = Dataset(DATASET_ID, status_path=str(path), no_status_file=True, status_store=store)
+    dataset.load_dataset_status_file()
+    assert store.lines(DATASET_ID) == ["STAT:1:WAREHOUSE:Ready:"]
+    assert store.latest(DATASET_ID) == "WAREHOUSE:Ready:"
+
+    append(path, "STAT:2:WAREHOUSE:Engaged:", "STAT:2:WAREHOUSE:Engaged:")
+    dataset.load_dataset_status_file()
+    store.ingest(DATASET_ID, path)
+    assert store.lines(DATASET_ID) == ["STAT:1:WAREHOUSE:Ready:"] + ["STAT:2:WAREHOUSE:Engaged:"] * 2
@@ -0,0 +1,22 @@
+import logging
+
+from benchmarks import logging_hot_path
+from datasm.util import log_message
+
+
+def test_log_message(caplog):
+    caplog.set_level(logging.INFO)
+    calls = []
+    log_message("debug", lambda: calls.append("built") or "never built")
+    log_message("info", "checking %s against %s", "atmos-native-mon", "E3SM.one")
+    assert calls == []
+    [record] = caplog.records
+    assert record.getMessage() == "checking atmos-native-mon against E3SM.one"
+    # records are credited to the caller, not to util
+    assert record.module == "test_util"
+
+
+def test_logging_benchmark_runs():
+    results = logging_hot_path.run(datasets=200)
+    assert set(results) == {"before", "after"}
+    assert all(seconds > 0 for seconds in results.values())